@@ -26,28 +26,75 @@ envs = [
 			"DNS_KEY_NAME": "dns_key_name",
 			"DNS_KEY_ALGORITHM": "dns_key_alg",
 			"NAME": "name",
-			"DNS_SERVER": "dns_server"
+			"INVENTORY": "inventory",
+			"ENGINE": "engine",
+			"BACKEND": "backend",
+			"BACKEND_PATH": "backend_path",
+			"DNSMASQ_PID_FILE": "dnsmasq_pid_file",
+			"METRICS_ADDRESS": "metrics_address",
+			"STATE_FILE": "state_file",
+			"RECORD_FILE": "record_file",
+			"TRACE_FILE": "trace_file",
+			"PROFILE_DIR": "profile_dir",
+			"DEAD_LETTER_FILE": "dead_letter_file"
 		},
 		str
 	),
 	(
 		{
 			"SYSLOG": "syslog",
+			"MANAGE_PTR": "manage_ptr",
 			"CLEAR_ON_EXIT": "clear_on_exit"
 		},
 		as_bool
 	),
 	(
 		{
-			"NETWORK": "network"
+			"NETWORK": "network",
+			"REVERSE_ZONE": "reverse_zone"
 		},
 		lambda x: [y.strip() for y in x.split(',')]
 	),
 	(
 		{
-			"VERBOSITY": "verbose"
+			"DNS_SERVER": "dns_server"
+		},
+		lambda x: [dconsole.DnsServerArguments(y.strip()) for y in x.split(',')]
+	),
+	(
+		{
+			"DNS_LISTEN": "dns_listen"
+		},
+		dconsole.ListenArguments
+	),
+	(
+		{
+			"DOCKER_URL": "docker_url"
+		},
+		lambda x: [y.strip() for y in x.split(',')]
+	),
+	(
+		{
+			"VERBOSITY": "verbose",
+			"QUEUE_SIZE": "queue_size",
+			"OWNER_SHARDS": "owner_shards",
+			"RECONNECT_MAX_DELAY": "reconnect_max_delay",
+			"STATE_INTERVAL": "state_interval",
+			"RETRY_ATTEMPTS": "retry_attempts",
+			"LOG_QUEUE_SIZE": "log_queue_size",
+			"METRICS_PORT": "metrics_port"
 		},
 		int
+	),
+	(
+		{
+			"COALESCE_WINDOW": "coalesce_window",
+			"HOLD_DOWN": "hold_down",
+			"RECONCILE_INTERVAL": "reconcile_interval",
+			"RECONCILE_JITTER": "reconcile_jitter",
+			"RETRY_MAX_DELAY": "retry_max_delay"
+		},
+		float
 	)
 ]
 
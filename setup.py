@@ -18,7 +18,7 @@ with open("%s/src/%s/__init__.py" % (here, name), "rt") as f:
     description = re.search(r'^__description__\s*=\s*"([^"]+)', data, re.MULTILINE).group(1)
 
 requires = [
-    'docker>=2.0.0',
+    'docker>=3.5.0',
     'dnspython>=1.13.0'
 ]
 
@@ -56,9 +56,12 @@ setup(name=name_human,
           'suggested': suggested_require
       },
       install_requires=requires,
+      python_requires='>=3.6',
       entry_points = {
         "console_scripts": [
             "docker-hostdns = docker_hostdns.console:execute",
+            "docker-hostdns-benchmark = docker_hostdns.benchmark:execute",
+            "docker-hostdns-replay = docker_hostdns.recording:execute",
         ]
       },
       test_suite="docker_hostdns.tests",
@@ -1,2 +1,2 @@
-__version__ = "2.4.0"
+__version__ = "2.5.0"
 __description__ = "Update BIND nameserver zone with Docker hosts via DNS Updates."
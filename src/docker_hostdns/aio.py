@@ -0,0 +1,428 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import os
+import ssl
+import json
+import signal
+import asyncio
+import logging
+import functools
+import urllib.parse
+import concurrent.futures
+from docker_hostdns import metrics
+from docker_hostdns.hostdns import DockerHandler, ContainerInfo, NetworkEvent, _get_tls_files
+from docker_hostdns.endpoints import MultiDockerHandler
+from docker_hostdns.exceptions import ConnectionException, DnsException
+
+class DockerApi(object):
+    """
+    Minimal asyncio client of Docker HTTP API, supporting GET requests with JSON responses and streams.
+    Each request uses its own connection, so many of them can run concurrently.
+    """
+    
+    default_url = "unix:///var/run/docker.sock"
+    
+    def __init__(self, url=None):
+        super(DockerApi, self).__init__()
+        
+        url = url or os.environ.get("DOCKER_HOST") or self.default_url
+        uri = urllib.parse.urlparse(url)
+        
+        self.url = url
+        self.path = None
+        self.host = None
+        self.port = None
+        self.ssl = None
+        
+        if uri.scheme == "unix":
+            self.path = uri.path
+        elif uri.scheme in ("tcp", "tcp+tls"):
+            self.host = uri.hostname
+            if uri.scheme == "tcp+tls":
+                ca_cert, client_cert, client_key = _get_tls_files(uri)
+                self.ssl = ssl.create_default_context(cafile=ca_cert)
+                self.ssl.load_cert_chain(client_cert, client_key)
+                self.port = uri.port or 2376
+            else:
+                self.port = uri.port or 2375
+        else:
+            raise ConnectionException("Unsupported Docker url %r" % url)
+    
+    async def _open(self):
+        if self.path is not None:
+            return await asyncio.open_unix_connection(self.path)
+        return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+    
+    async def _request(self, path, params=None):
+        if params:
+            path = "%s?%s" % (path, urllib.parse.urlencode(params))
+        
+        reader, writer = await self._open()
+        try:
+            writer.write(("GET %s HTTP/1.1\r\nHost: docker\r\nConnection: close\r\n\r\n" % path).encode())
+            await writer.drain()
+            
+            status = (await reader.readline()).split(None, 2)
+            if len(status) < 2:
+                raise ConnectionException("Invalid response from Docker at %s" % self.url)
+            
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _sep, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+        except Exception:
+            writer.close()
+            raise
+        
+        return int(status[1]), headers, reader, writer
+    
+    async def _read_body(self, reader, headers):
+        """
+        Yields chunks of response body.
+        """
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip(), 16)
+                if size == 0:
+                    return
+                chunk = await reader.readexactly(size)
+                await reader.readexactly(2)
+                yield chunk
+        elif "content-length" in headers:
+            yield await reader.readexactly(int(headers["content-length"]))
+        else:
+            yield await reader.read()
+    
+    async def get(self, path, params=None):
+        """
+        Returns decoded response, None is returned for missing resources.
+        """
+        status, headers, reader, writer = await self._request(path, params)
+        try:
+            body = b"".join([chunk async for chunk in self._read_body(reader, headers)])
+        finally:
+            writer.close()
+        
+        if status == 404:
+            return None
+        if status >= 400:
+            raise ConnectionException("Docker request %s failed with status %d" % (path, status))
+        
+        if headers.get("content-type", "").startswith("application/json"):
+            return json.loads(body)
+        return body.decode()
+    
+    async def stream(self, path, params=None):
+        """
+        Yields JSON objects from streamed response.
+        """
+        status, headers, reader, writer = await self._request(path, params)
+        try:
+            if status >= 400:
+                raise ConnectionException("Docker request %s failed with status %d" % (path, status))
+            
+            buffer = b""
+            async for chunk in self._read_body(reader, headers):
+                buffer += chunk
+                lines = buffer.split(b"\n")
+                buffer = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+        finally:
+            writer.close()
+
+class AsyncWriter(object):
+    """
+    Executes DNS updater calls in order on a worker thread, so blocking queries do not stall event loop.
+    Calls are only queued, producers should await ``drain`` to be slowed down when writer falls behind.
+    """
+    
+    def __init__(self, dns_updater, max_size=1000):
+        super(AsyncWriter, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.dns_updater = dns_updater
+        self.max_size = max_size
+        self.error = None
+        self.processed = 0
+        
+        self._queue = None
+        self._room = None
+        self._executor = None
+        self._task = None
+    
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._room = asyncio.Event()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="dns-writer")
+        self._task = asyncio.ensure_future(self._run())
+    
+    async def close(self):
+        """
+        Waits for queued updates to be written and stops worker thread.
+        """
+        if self._task is None:
+            return
+        
+        self._queue.put_nowait(None)
+        await self._task
+        self._executor.shutdown()
+        self._task = None
+    
+    @property
+    def pending(self):
+        return 0 if self._queue is None else self._queue.qsize()
+    
+    def _put(self, method, *args):
+        if self.error is not None:
+            raise DnsException("DNS writer has stopped") from self.error
+        
+        self._queue.put_nowait((method, args, metrics.pass_event_time()))
+    
+    def set_hosts(self, hosts):
+        self._put("set_hosts", hosts)
+    
+    def add_host(self, names, ipv4s=None, ipv6s=None):
+        self._put("add_host", names, ipv4s, ipv6s)
+    
+    def remove_host(self, hosts):
+        self._put("remove_host", hosts)
+    
+    async def drain(self):
+        while self._queue.qsize() >= self.max_size:
+            self._room.clear()
+            await self._room.wait()
+    
+    def _apply(self, method, args, event_time):
+        with metrics.event_time(event_time):
+            getattr(self.dns_updater, method)(*args)
+            metrics.observe_applied()
+    
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            
+            method, args, event_time = item
+            if self.error is None:
+                try:
+                    await loop.run_in_executor(self._executor, functools.partial(self._apply, method, args, event_time))
+                    self.processed += 1
+                except Exception as e:
+                    self.logger.exception(e)
+                    self.error = e
+            
+            self._room.set()
+
+class AsyncDockerHandler(DockerHandler):
+    """
+    DockerHandler using asyncio Docker API client, containers are inspected concurrently.
+    Updater is expected to be an ``AsyncWriter``.
+    """
+    
+    def __init__(self, dns_updater, inventory="containers", endpoint=None, registry=None, lock=None):
+        super(AsyncDockerHandler, self).__init__(dns_updater, inventory, endpoint, registry, lock)
+        
+        if inventory != "containers":
+            self.logger.info("Inventory %r is not supported by asyncio engine, inspecting containers", inventory)
+        
+        self.api = DockerApi(endpoint)
+        self._inspecting = None
+    
+    async def _inspect(self, container_id, record=False):
+        async with self._inspecting:
+            attrs = await self.api.get("/containers/%s/json" % container_id)
+        
+        if record and self.recorder is not None:
+            self.recorder.record_inspect(container_id, attrs)
+        
+        if attrs is None:
+            return None
+        return ContainerInfo.from_attrs(attrs["Id"], attrs["Name"], attrs["Config"]["Labels"], attrs["NetworkSettings"]["Networks"], self.networks)
+    
+    async def _inspect_all(self, container_ids):
+        infos = await asyncio.gather(*[self._inspect(i) for i in container_ids])
+        return [i for i in infos if i is not None]
+    
+    async def _list_running(self):
+        return await self.api.get("/containers/json", {"filters": json.dumps({"status": ["running"]})})
+    
+    async def async_setup(self, networks=None, state=None):
+        self._inspecting = asyncio.Semaphore(self.inventory_workers)
+        
+        try:
+            await self.api.get("/_ping")
+        except (OSError, ConnectionException) as e:
+            raise ConnectionException('Error communicating with docker at %s.' % self.api.url) from e
+        
+        self.logger.info("Connected to docker at %s", self.api.url)
+        self.networks = ("bridge",) if not networks else tuple(networks)
+        
+        if state is None:
+            with metrics.LOAD_CONTAINERS.time():
+                summaries = await self._list_running()
+                infos = await self._inspect_all(i["Id"] for i in summaries)
+            self._register(infos)
+        else:
+            running = self._restore(state, await self._list_running())
+            changed = self._remove_stopped(running)
+            
+            for info in await self._inspect_all(self._get_changed(running)):
+                self.on_connect(info.id, info.names, info.ipv4s, info.ipv6s, info.name)
+                changed += 1
+            
+            self.logger.info("Resumed from saved state, %d of %d containers changed", changed, len(running))
+        
+        await self.dns_updater.drain()
+    
+    async def async_handle_event(self, event):
+        self.events_received += 1
+        
+        event = NetworkEvent.from_dict(event)
+        if event is None or event.network not in self.networks:
+            return
+        
+        if event.action == "connect":
+            self.logger.debug("Handling connect event for container %r", event.container_id)
+            info = await self._inspect(event.container_id, record=True)
+            if info is not None:
+                # event time is kept only around synchronous calls, as other coroutines run while awaiting
+                with metrics.event_time(event.timestamp):
+                    self.on_connect(event.container_id, info.names, info.ipv4s, info.ipv6s, info.name)
+                    metrics.observe_applied()
+            self.events_handled += 1
+        
+        if event.action == "disconnect":
+            self.logger.debug("Handling disconnect event for container %r", event.container_id)
+            with metrics.event_time(event.timestamp):
+                self.on_disconnect(event.container_id)
+                metrics.observe_applied()
+            self.events_handled += 1
+        
+        self._observe_event(event)
+        await self.dns_updater.drain()
+    
+    async def async_run(self):
+        delay = self.reconnect_delay
+        
+        while True:
+            filters, since = self._get_events_filter()
+            params = {"filters": json.dumps(filters)}
+            if since is not None:
+                params["since"] = since
+            
+            try:
+                async for event in self.api.stream("/events", params):
+                    delay = self.reconnect_delay
+                    
+                    if self.recorder is not None:
+                        self.recorder.record_event(event)
+                    
+                    # events from the second of last seen event are sent again after reconnecting
+                    if self._is_replayed(event):
+                        continue
+                    
+                    await self.async_handle_event(event)
+                    
+                    if "timeNano" in event:
+                        self.last_event_time = event["timeNano"]
+                    
+                    if self.state_file is not None and self.state_file.is_due():
+                        self.save_state()
+                
+                raise ConnectionException("Event stream was closed")
+            except (OSError, ValueError, asyncio.IncompleteReadError, ConnectionException) as e:
+                if not self.reconnect_max_delay:
+                    self.logger.info("Docker connection broken - exitting")
+                    return
+                
+                self.logger.warning("Docker connection broken (%s), reconnecting in %ds", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.reconnect_max_delay)
+
+class AsyncEngine(MultiDockerHandler):
+    """
+    Watches Docker daemons on single asyncio event loop, stopped cleanly with SIGTERM or SIGINT.
+    DNS updates are written by one worker thread, through given updater or pipeline.
+    """
+    
+    handler_class = AsyncDockerHandler
+    
+    def __init__(self, dns_updater, endpoints, inventory="containers", max_size=1000):
+        self.writer = AsyncWriter(dns_updater, max_size)
+        super(AsyncEngine, self).__init__(self.writer, endpoints, inventory)
+        
+        self._networks = None
+        self._state = None
+    
+    def setup(self, networks=None, state=None):
+        """
+        Remembers configuration, daemons are connected to when event loop is started in ``run``.
+        """
+        self._networks = networks
+        self._state = state
+    
+    async def _save_state_periodically(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if self.state_file is not None and self.state_file.is_due():
+                self.save_state()
+    
+    async def _watch(self):
+        await asyncio.gather(*[
+            i.async_setup(self._networks, self._get_handler_state(self._state, i)) for i in self.handlers
+        ])
+        if self._state is None:
+            self.writer.set_hosts(self.get_hosts())
+        
+        tasks = [asyncio.ensure_future(i.async_run()) for i in self.handlers]
+        tasks.append(asyncio.ensure_future(self._save_state_periodically()))
+        
+        try:
+            done, _pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _main(self):
+        loop = asyncio.get_event_loop()
+        
+        self.writer.start()
+        watch = asyncio.ensure_future(self._watch())
+        
+        signals = (signal.SIGTERM, signal.SIGINT)
+        for signum in signals:
+            loop.add_signal_handler(signum, watch.cancel)
+        
+        try:
+            await watch
+        except asyncio.CancelledError:
+            self.logger.info("Exitting")
+        finally:
+            for signum in signals:
+                loop.remove_signal_handler(signum)
+            await self.writer.close()
+    
+    def run(self):
+        handlers = dict((i, signal.getsignal(i)) for i in (signal.SIGTERM, signal.SIGINT))
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._main())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
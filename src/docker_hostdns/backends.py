@@ -0,0 +1,210 @@
+'''
+Targets hosts are published to.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import os
+import time
+import signal
+import logging
+import tempfile
+
+class Backend(object):
+    """
+    Publishes hosts, every change is applied through apply_changes as a batch.
+    Implementations provide ``hosts`` - set of published host names.
+    """
+    
+    def apply_changes(self, changes):
+        """
+        Applies dict of hostname: (ipv4s, ipv6s), or hostname: None for removed hosts.
+        """
+        raise NotImplementedError()
+    
+    def set_hosts(self, hosts):
+        """
+        Makes given hosts the only published ones, hosts parameter is a dict of hostname: (ipv4s, ipv6s).
+        """
+        changes = dict(hosts)
+        for host in self.hosts.difference(hosts.keys()):
+            changes[host] = None
+        
+        self.apply_changes(changes)
+    
+    def add_hosts(self, hosts):
+        self.apply_changes(hosts)
+    
+    def add_host(self, names, ipv4s=None, ipv6s=None):
+        """
+        Publishes host, names parameter can be a single hostname or list of aliases to use.
+        """
+        if isinstance(names, str):
+            names = [names]
+        
+        self.logger.debug("Adding host %r", names)
+        self.apply_changes(dict((host, (ipv4s, ipv6s)) for host in names))
+    
+    def remove_host(self, hosts):
+        self.logger.debug("Removing host %r", hosts)
+        
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        
+        self.apply_changes(dict((host, None) for host in hosts))
+    
+    def setup(self):
+        """
+        Loads published hosts.
+        """
+        pass
+    
+    def restore(self, hosts):
+        """
+        Sets known state of published hosts, hosts parameter is a dict of hostname: (ipv4s, ipv6s).
+        """
+        self.set_hosts(hosts)
+    
+    def close(self):
+        pass
+
+class FileBackend(Backend):
+    """
+    Keeps hosts in memory and atomically replaces whole file after each changed batch.
+    """
+    
+    mode = 0o644
+    
+    def __init__(self, zone, path):
+        super(FileBackend, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.zone = zone
+        self.path = path
+        # hostname: (ipv4s, ipv6s)
+        self.records = {}
+    
+    @property
+    def hosts(self):
+        return set(self.records.keys())
+    
+    def render(self):
+        """
+        Returns file content.
+        """
+        raise NotImplementedError()
+    
+    def _get_fqdn(self, host):
+        return "%s.%s" % (host, self.zone.rstrip("."))
+    
+    def _iter_addresses(self):
+        """
+        Yields (hostname, address, is ipv6) for published hosts, sorted by hostname.
+        """
+        for host in sorted(self.records.keys()):
+            ipv4s, ipv6s = self.records[host]
+            for address in ipv4s:
+                yield host, address, False
+            for address in ipv6s:
+                yield host, address, True
+    
+    def flush(self):
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".%s." % name, dir=directory)
+        try:
+            with os.fdopen(fd, "wt") as f:
+                f.write(self.render())
+            os.chmod(tmp_path, self.mode)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        
+        self.logger.debug("Written %d hosts to %r", len(self.records), self.path)
+    
+    def apply_changes(self, changes):
+        changed = False
+        # changes are kept only when written, so retried batch is not seen as already applied
+        previous = self.records
+        self.records = dict(previous)
+        
+        for host, addresses in changes.items():
+            if addresses is None:
+                changed = self.records.pop(host, None) is not None or changed
+            else:
+                records = (sorted(addresses[0] or []), sorted(addresses[1] or []))
+                if self.records.get(host) != records:
+                    self.records[host] = records
+                    changed = True
+        
+        if changed:
+            try:
+                self.flush()
+            except BaseException:
+                self.records = previous
+                raise
+    
+    def setup(self):
+        self.flush()
+    
+    def restore(self, hosts):
+        self.records = dict((host, (sorted(ipv4s or []), sorted(ipv6s or []))) for host, (ipv4s, ipv6s) in hosts.items())
+        self.flush()
+
+class HostsFileBackend(FileBackend):
+    """
+    Writes hosts in /etc/hosts format, with names in given zone.
+    """
+    
+    def render(self):
+        lines = ["# generated by docker-hostdns, do not edit"]
+        for host, address, _ipv6 in self._iter_addresses():
+            lines.append("%s\t%s" % (address, self._get_fqdn(host)))
+        return "\n".join(lines) + "\n"
+
+class ZoneFileBackend(FileBackend):
+    """
+    Writes zone file with A and AAAA records of hosts and wildcards below them, serial is increased on each write.
+    """
+    
+    ttl = 1
+    # zone needs NS record to be loaded, name outside of zone does not need glue
+    nameserver = "localhost."
+    
+    def __init__(self, zone, path):
+        super(ZoneFileBackend, self).__init__(zone, path)
+        self.serial = int(time.time())
+    
+    def render(self):
+        self.serial = max(self.serial + 1, int(time.time()))
+        
+        lines = [
+            "; generated by docker-hostdns, do not edit",
+            "$ORIGIN %s." % self.zone.rstrip("."),
+            "$TTL %d" % self.ttl,
+            "@\tIN\tSOA\t%s hostmaster (%d 3600 600 86400 %d)" % (self.nameserver, self.serial, self.ttl),
+            "@\tIN\tNS\t%s" % self.nameserver,
+        ]
+        for host, address, ipv6 in self._iter_addresses():
+            for name in (host, "*.%s" % host):
+                lines.append("%s\tIN\t%s\t%s" % (name, "AAAA" if ipv6 else "A", address))
+        return "\n".join(lines) + "\n"
+
+class DnsmasqBackend(HostsFileBackend):
+    """
+    Writes dnsmasq addn-hosts file and signals dnsmasq to reload it.
+    """
+    
+    def __init__(self, zone, path, pid_file="/run/dnsmasq.pid"):
+        super(DnsmasqBackend, self).__init__(zone, path)
+        self.pid_file = pid_file
+    
+    def flush(self):
+        super(DnsmasqBackend, self).flush()
+        
+        try:
+            with open(self.pid_file, "rt") as f:
+                pid = int(f.read().strip())
+            os.kill(pid, signal.SIGHUP)
+        except (OSError, ValueError) as e:
+            self.logger.warning("Could not signal dnsmasq to reload hosts: %s", e)
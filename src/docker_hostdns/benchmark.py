@@ -0,0 +1,335 @@
+'''
+Throughput and latency benchmarks of Docker event handling and DNS updates, run against in-process fake servers.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import contextlib
+from docker_hostdns.hostdns import NamedUpdater, DockerHandler
+from docker_hostdns.server import ZoneServer
+from docker_hostdns.backends import HostsFileBackend, ZoneFileBackend
+from docker_hostdns.fakes.dnsserver import DnsServer
+from docker_hostdns.fakes.dockerserver import DockerServer
+import docker_hostdns
+
+def percentile(values, p):
+    """
+    Returns nearest-rank percentile of given values, None when there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+def get_peak_rss():
+    """
+    Returns peak resident set size of current process in KiB.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+class _TimedBackend(object):
+    """
+    Passes calls of DockerHandler to backend and logs when changes of each host were applied.
+    """
+    
+    def __init__(self, backend):
+        super(_TimedBackend, self).__init__()
+        
+        self.backend = backend
+        # (monotonic time, set of host names)
+        self.log = []
+    
+    @property
+    def hosts(self):
+        return self.backend.hosts
+    
+    def _log(self, names):
+        self.log.append((time.monotonic(), set([names] if isinstance(names, str) else names)))
+    
+    def set_hosts(self, hosts):
+        self.backend.set_hosts(hosts)
+        self._log(hosts.keys())
+    
+    def add_host(self, names, ipv4s=None, ipv6s=None):
+        self.backend.add_host(names, ipv4s, ipv6s)
+        self._log(names)
+    
+    def remove_host(self, hosts):
+        self.backend.remove_host(hosts)
+        self._log(hosts)
+
+class Benchmark(object):
+    """
+    Runs scenarios through DockerHandler and given backend, each against fresh fake Docker daemon and DNS server.
+    Latency is measured from emitting Docker event to backend call for its host returning.
+    """
+    
+    zone = "docker"
+    network = "bridge"
+    # seconds to wait for events to be handled
+    timeout = 120
+    poll_interval = 0.01
+    
+    scenarios = ("cold_start", "burst", "flapping", "slow_dns")
+    backends = ("update", "server", "hosts", "zone")
+    
+    def __init__(self, containers=200, rounds=5, dns_delay=0.005, backend="update"):
+        super(Benchmark, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.containers = containers
+        self.rounds = rounds
+        self.dns_delay = dns_delay
+        self.backend = backend
+        
+        self._tmp_dir = None
+    
+    @contextlib.contextmanager
+    def _servers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self._tmp_dir = tmp_dir
+            docker_server = DockerServer(os.path.join(tmp_dir, "docker.sock"), hold_events=True)
+            dns_server = DnsServer(self.zone)
+            
+            docker_server.start()
+            dns_server.start()
+            try:
+                yield docker_server, dns_server
+            finally:
+                docker_server.stop()
+                dns_server.stop()
+    
+    def _get_container_id(self, index):
+        return "%064x" % (index + 1)
+    
+    def _get_host(self, index):
+        return "bench-%d" % index
+    
+    def _add_container(self, docker_server, index):
+        address = "10.%d.%d.%d" % ((index >> 16) & 255, (index >> 8) & 255, index & 255)
+        docker_server.add_container(self._get_container_id(index), self._get_host(index), {self.network: (address, None)})
+    
+    def _create_backend(self, dns_server):
+        if self.backend == "server":
+            # queries are not benchmarked, so server is not started
+            return ZoneServer(self.zone)
+        if self.backend == "hosts":
+            return HostsFileBackend(self.zone, os.path.join(self._tmp_dir, "hosts"))
+        if self.backend == "zone":
+            return ZoneFileBackend(self.zone, os.path.join(self._tmp_dir, "docker.zone"))
+        return NamedUpdater(self.zone, "127.0.0.1", instance_name="benchmark", dns_port=dns_server.port)
+    
+    def _create_handler(self, docker_server, dns_server):
+        backend = self._create_backend(dns_server)
+        backend.setup()
+        
+        handler = DockerHandler(_TimedBackend(backend), endpoint="unix://%s" % docker_server.path)
+        # handler exits when event stream is closed
+        handler.reconnect_max_delay = 0
+        return handler
+    
+    def _get_latencies(self, log, sent):
+        """
+        Matches each sent event with first following update of its host, returns list of latencies.
+        """
+        # host: list of update times
+        applied = {}
+        for applied_at, names in log:
+            for name in names:
+                applied.setdefault(name, []).append(applied_at)
+        
+        latencies = []
+        positions = {}
+        for sent_at, host in sent:
+            times = applied.get(host, [])
+            position = positions.get(host, 0)
+            while position < len(times) and times[position] < sent_at:
+                position += 1
+            if position == len(times):
+                raise Exception("No DNS update found for event of host %r" % host)
+            latencies.append(times[position] - sent_at)
+            positions[host] = position + 1
+        
+        return latencies
+    
+    def _run_events(self, docker_server, dns_server, events, started=()):
+        """
+        Streams given list of (action, container index) events to running handler and measures their handling.
+        Containers with indexes given in ``started`` are created after handler has loaded running ones.
+        """
+        handler = self._create_handler(docker_server, dns_server)
+        handler.setup()
+        
+        thread = threading.Thread(target=handler.run, name="benchmark-handler", daemon=True)
+        thread.start()
+        
+        deadline = time.monotonic() + self.timeout
+        while "/events" not in docker_server.requests:
+            if time.monotonic() > deadline:
+                raise Exception("Handler has not subscribed to events")
+            time.sleep(self.poll_interval)
+        
+        for index in started:
+            self._add_container(docker_server, index)
+        
+        updater = handler.dns_updater
+        updates = dns_server.zone.updates
+        del updater.log[:]
+        
+        sent = []
+        for action, index in events:
+            sent.append((time.monotonic(), self._get_host(index)))
+            docker_server.add_event(action, self._get_container_id(index), self.network, int(time.time() * 1000000000))
+        
+        while handler.events_handled < len(events):
+            if time.monotonic() > deadline or not thread.is_alive():
+                raise Exception("Only %d of %d events were handled" % (handler.events_handled, len(events)))
+            time.sleep(self.poll_interval)
+        
+        latencies = self._get_latencies(list(updater.log), sent)
+        elapsed = max(sent_at + latency for (sent_at, _host), latency in zip(sent, latencies)) - sent[0][0]
+        writes = len(updater.log)
+        updates = dns_server.zone.updates - updates
+        
+        updater.backend.close()
+        
+        return {
+            "events": len(events),
+            "seconds": elapsed,
+            "events_per_second": len(events) / elapsed,
+            "writes": writes,
+            "writes_per_second": writes / elapsed,
+            "dns_updates": updates,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p99": percentile(latencies, 99),
+            "latency_max": max(latencies),
+        }
+    
+    def cold_start(self):
+        """
+        Loads and publishes all running containers.
+        """
+        with self._servers() as (docker_server, dns_server):
+            for index in range(self.containers):
+                self._add_container(docker_server, index)
+            
+            handler = self._create_handler(docker_server, dns_server)
+            
+            started = time.monotonic()
+            handler.setup()
+            elapsed = time.monotonic() - started
+            
+            handler.dns_updater.backend.close()
+            
+            return {
+                "containers": self.containers,
+                "seconds": elapsed,
+                "containers_per_second": self.containers / elapsed,
+                "writes": len(handler.dns_updater.log),
+                "dns_updates": dns_server.zone.updates,
+            }
+    
+    def burst(self):
+        """
+        Connects all containers at once to already running handler.
+        """
+        indexes = range(self.containers)
+        with self._servers() as (docker_server, dns_server):
+            return self._run_events(docker_server, dns_server, [("connect", i) for i in indexes], started=indexes)
+    
+    def flapping(self):
+        """
+        Repeatedly disconnects and connects tenth of containers.
+        """
+        hosts = max(1, self.containers // 10)
+        events = []
+        for _round in range(self.rounds):
+            for index in range(hosts):
+                events.append(("disconnect", index))
+                events.append(("connect", index))
+        
+        with self._servers() as (docker_server, dns_server):
+            for index in range(self.containers):
+                self._add_container(docker_server, index)
+            
+            return self._run_events(docker_server, dns_server, events)
+    
+    def slow_dns(self):
+        """
+        Connects all containers at once while DNS server delays each update.
+        """
+        indexes = range(self.containers)
+        with self._servers() as (docker_server, dns_server):
+            dns_server.zone.delay = self.dns_delay
+            results = self._run_events(docker_server, dns_server, [("connect", i) for i in indexes], started=indexes)
+        
+        results["dns_delay"] = self.dns_delay
+        return results
+    
+    def run(self, scenarios=None):
+        results = {}
+        
+        for name in scenarios or self.scenarios:
+            self.logger.info("Running %s scenario", name)
+            results[name] = getattr(self, name)()
+            results[name]["peak_rss_kib"] = get_peak_rss()
+        
+        return {
+            "version": docker_hostdns.__version__,
+            "python": platform.python_version(),
+            "backend": self.backend,
+            "containers": self.containers,
+            "scenarios": results,
+        }
+
+def parse_commandline(argv):
+    p = argparse.ArgumentParser(
+        prog="docker-hostdns-benchmark" if argv[0].endswith(".py") else os.path.basename(argv[0]),
+        description="Measure docker-hostdns throughput against in-process fake Docker daemon and DNS server."
+    )
+    p.add_argument('--containers', default=200, type=int, metavar="COUNT", help="number of containers, defaults to 200")
+    p.add_argument('--rounds', default=5, type=int, metavar="COUNT", help="number of disconnect and connect rounds of flapping scenario, defaults to 5")
+    p.add_argument('--dns-delay', default=0.005, type=float, metavar="SECONDS", help="delay of each DNS update in slow_dns scenario, defaults to 0.005")
+    p.add_argument('--backend', default="update", choices=Benchmark.backends, help="backend to publish hosts with, defaults to \"update\"")
+    p.add_argument('--scenario', action="append", choices=Benchmark.scenarios, help="scenario to run, can be used multiple times, defaults to all")
+    p.add_argument('--output', default="-", metavar="PATH", help="file to write JSON results to, defaults to stdout")
+    p.add_argument('--verbose', '-v', action='count', default=0)
+    
+    return p.parse_args(args=argv[1:])
+
+def execute(argv=None):
+    if argv is None:
+        argv = sys.argv
+    conf = parse_commandline(argv)
+    
+    levels = [
+        logging.ERROR,
+        logging.WARNING,
+        logging.INFO,
+        logging.DEBUG
+    ]
+    logging.basicConfig(level=levels[min(conf.verbose, len(levels)-1)])
+    
+    results = Benchmark(conf.containers, conf.rounds, conf.dns_delay, conf.backend).run(conf.scenario)
+    
+    if conf.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(conf.output, "wt") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    execute()
@@ -0,0 +1,106 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import time
+import socket
+import logging
+import dns.inet
+import dns.query
+
+class DnsConnection(object):
+    """
+    Long-lived TCP session to DNS server, messages are sent over it one after another.
+    Connection is re-opened when server closes it or when it was idle for too long.
+    """
+    
+    def __init__(self, address, port=53, timeout=2, idle_timeout=10):
+        super(DnsConnection, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.address = address
+        self.port = port
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        
+        self.opened = 0
+        self.reused = 0
+        
+        self._sock = None
+        self._last_used = None
+    
+    def _connect(self):
+        sock = socket.socket(dns.inet.af_for_address(self.address), socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect((self.address, self.port))
+            sock.setblocking(False)
+        except Exception:
+            sock.close()
+            raise
+        
+        self.logger.debug("Opened connection to %s:%d", self.address, self.port)
+        self._sock = sock
+        self.opened += 1
+    
+    def close(self):
+        if self._sock is None:
+            return
+        
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        self._sock = None
+    
+    def _is_idle(self):
+        return time.monotonic() - self._last_used > self.idle_timeout
+    
+    def _exchange(self, message):
+        expiration = time.time() + self.timeout
+        
+        dns.query.send_tcp(self._sock, message, expiration)
+        response, _received_time = dns.query.receive_tcp(
+            self._sock,
+            expiration,
+            keyring=message.keyring,
+            request_mac=message.request_mac
+        )
+        
+        if not message.is_response(response):
+            raise dns.query.BadResponse()
+        
+        return response
+    
+    def query(self, message):
+        if self._sock is not None and self._is_idle():
+            self.logger.debug("Connection was idle for too long, closing")
+            self.close()
+        
+        reused = self._sock is not None
+        if reused:
+            self.reused += 1
+        else:
+            self._connect()
+        
+        try:
+            response = self._exchange(message)
+        except (OSError, EOFError) as e:
+            self.close()
+            if not reused:
+                raise
+            # server could close session at any time, one retry over fresh connection is enough
+            self.logger.debug("Connection was closed by server (%s), reconnecting", e)
+            self._connect()
+            try:
+                response = self._exchange(message)
+            except Exception:
+                self.close()
+                raise
+        except Exception:
+            # state of session is unknown after timeouts or malformed responses
+            self.close()
+            raise
+        
+        self._last_used = time.monotonic()
+        return response
@@ -7,11 +7,25 @@ import os
 import sys
 import urllib
 import socket
+import atexit
 import signal
 import logging
 import argparse
 from logging.handlers import SysLogHandler
 from docker_hostdns.hostdns import NamedUpdater, DockerHandler
+from docker_hostdns.fanout import MultiUpdater
+from docker_hostdns.server import ZoneServer
+from docker_hostdns.backends import HostsFileBackend, ZoneFileBackend, DnsmasqBackend
+from docker_hostdns.endpoints import MultiDockerHandler
+from docker_hostdns.aio import AsyncEngine
+from docker_hostdns.zones import ZonedDockerHandler, get_network_zones
+from docker_hostdns import metrics
+from docker_hostdns import recording
+from docker_hostdns import tracing
+from docker_hostdns.logqueue import LogQueue
+from docker_hostdns.pipeline import UpdatePipeline, Coalescer, RetryQueue
+from docker_hostdns.state import StateFile
+from docker_hostdns.reconcile import Reconciler
 from docker_hostdns.exceptions import StopException, ConfigException
 import docker_hostdns
 import dns.tsigkeyring
@@ -93,6 +107,84 @@ class SyslogArguments(object):
             "socktype": self.socket
         }
 
+class DnsServerArguments(object):
+    """
+    DNS server with optional own key, in format: [dns://][<key name>:<key secret>@]<host>[:<port>][?alg=<key algorithm>]
+    """
+    
+    port = 53
+    key_name = None
+    key_secret = None
+    key_algorithm = None
+    
+    def __init__(self, target):
+        super(DnsServerArguments, self).__init__()
+        
+        self._parse_target(target)
+    
+    def _parse_target(self, target):
+        if "://" not in target:
+            target = "dns://" + target
+        
+        uri = urllib.parse.urlparse(target)
+        
+        if uri.scheme != "dns":
+            raise argparse.ArgumentTypeError("Unsupported scheme %r" % uri.scheme)
+        if not uri.hostname:
+            raise argparse.ArgumentTypeError("Missing DNS server address in %r" % target)
+        
+        self.hostname = uri.hostname
+        if uri.port:
+            self.port = int(uri.port)
+        
+        if uri.username:
+            if not uri.password:
+                raise argparse.ArgumentTypeError("Missing key secret for DNS server %r" % uri.hostname)
+            self.key_name = urllib.parse.unquote(uri.username)
+            self.key_secret = urllib.parse.unquote(uri.password)
+        
+        query = urllib.parse.parse_qs(uri.query)
+        if "alg" in query:
+            self.key_algorithm = query["alg"][-1].lower()
+            if not hasattr(dns.tsig, self.key_algorithm.upper()):
+                raise argparse.ArgumentTypeError("Unsupported key algorithm %r" % self.key_algorithm)
+    
+    def get_args(self, keyring=None, keyalgorithm=None):
+        """
+        Returns NamedUpdater arguments, given key is used when server has no own key.
+        """
+        if self.key_name:
+            keyring = {self.key_name: self.key_secret}
+            keyalgorithm = self.key_algorithm
+        
+        return {
+            "dns_server": self.hostname,
+            "dns_port": self.port,
+            "keyring": keyring,
+            "keyalgorithm": keyalgorithm,
+        }
+
+class ListenArguments(object):
+    """
+    Address to listen on, in format: <host>[:<port>], IPv6 address has to be enclosed in brackets.
+    """
+    
+    port = 53
+    
+    def __init__(self, target):
+        super(ListenArguments, self).__init__()
+        
+        try:
+            uri = urllib.parse.urlparse("dns://%s" % target)
+            if uri.port is not None:
+                self.port = uri.port
+        except ValueError as e:
+            raise argparse.ArgumentTypeError("Invalid listen address %r: %s" % (target, e))
+        
+        if not uri.hostname:
+            raise argparse.ArgumentTypeError("Missing listen address in %r" % target)
+        self.hostname = uri.hostname
+
 def parse_commandline(argv):
     
     p = argparse.ArgumentParser(
@@ -100,13 +192,23 @@ def parse_commandline(argv):
         description=docker_hostdns.__description__
     )
     p.add_argument('--zone', default="docker", help="dns zone to update, defaults to \"docker\"")
-    p.add_argument('--dns-server', default='127.0.0.1', action="store", help="address of DNS server which will be updated, defaults to 127.0.0.1")
+    p.add_argument('--dns-server', default=None, action="append", type=DnsServerArguments, help="address of DNS server which will be updated, defaults to 127.0.0.1, can be used multiple times to update many servers at once, you can provide uri with server specific key: [dns://][<key name>:<key secret>@]<host>[:<port>][?alg=<key algorithm>]")
+    p.add_argument('--backend', default="update", choices=["update", "server", "hosts", "zone", "dnsmasq"], help="where hosts are published: DNS server updated with DNS UPDATE, built-in DNS server, hosts file, zone file or dnsmasq hosts file, defaults to \"update\"")
+    p.add_argument('--backend-path', default=None, metavar="PATH", help="file written by hosts, zone and dnsmasq backends")
+    p.add_argument('--dnsmasq-pid-file', default="/run/dnsmasq.pid", metavar="PATH", help="pid file of dnsmasq to signal after hosts file is written, defaults to /run/dnsmasq.pid")
+    p.add_argument('--dns-listen', default=None, type=ListenArguments, metavar="ADDRESS[:PORT]", help="address for built-in DNS server to listen on, defaults to 127.0.0.1:53")
     p.add_argument('--dns-key-secret', action="store", help="DNS Server key secret for use when updating zone, use '-' to read from stdin")
     p.add_argument('--dns-key-name', action="store", help="DNS Server key name for use when updating zone")
     algorithms = [i.lower() for i in dir(dns.tsig) if i.startswith('HMAC_')]
     p.add_argument('--dns-key-alg', action="store", help="DNS Server key algorithm for use when updating zone", choices=algorithms)
     p.add_argument('--name', action="store", help="name to differentiate between multiple instances inside same dns zone, defaults to current hostname")
-    p.add_argument('--network', default=None, action="append", help="network to fetch container names from, defaults to docker default bridge, can be used multiple times")
+    p.add_argument('--manage-ptr', default=False, action="store_true", help="also update PTR records of container addresses, reverse zones are found by SOA lookup when not given with --reverse-zone")
+    p.add_argument('--reverse-zone', default=None, action="append", metavar="ZONE", help="reverse zone to update PTR records in, e.g. 17.172.in-addr.arpa, enables --manage-ptr, can be used multiple times")
+    p.add_argument('--owner-shards', default=1, type=int, metavar="COUNT", help="number of TXT records to spread names of managed hosts between, use more for zones with many hosts, defaults to 1")
+    p.add_argument('--network', default=None, action="append", metavar="NETWORK[=ZONE]", help="network to fetch container names from, defaults to docker default bridge, can be used multiple times, containers of network given as NETWORK=ZONE are published in ZONE instead of --zone")
+    p.add_argument('--docker-url', default=None, action="append", metavar="URL", help="Docker daemon to watch, e.g. unix:///var/run/docker.sock or tcp+tls://<host>:2376[?cert_path=<dir>], defaults to configuration from environment, can be used multiple times to watch many daemons")
+    p.add_argument('--engine', default="threads", choices=["threads", "asyncio"], help="runtime used to watch Docker: blocking threads or single asyncio event loop, defaults to \"threads\"")
+    p.add_argument('--inventory', default="containers", choices=["containers", "networks"], help="how to list containers on start: by inspecting each container or by inspecting watched networks, defaults to \"containers\"")
     
     if _has_daemon:
         p.add_argument('--daemonize', '-d', metavar="PIDFILE", action="store", default=None, help="daemonize after start and store PID at given path")
@@ -118,7 +220,24 @@ def parse_commandline(argv):
                    default_on_empty=SyslogArguments('/dev/log'),
                    type=SyslogArguments
                    )
+    p.add_argument('--reconcile-interval', default=0, type=float, metavar="SECONDS", help="periodically transfer zone and fix records which differ from known state, requires background writer, defaults to 0 (disabled)")
+    p.add_argument('--reconcile-jitter', default=0.1, type=float, metavar="FRACTION", help="randomize reconciliation interval by given fraction, defaults to 0.1")
+    p.add_argument('--reconnect-max-delay', default=60, type=int, metavar="SECONDS", help="maximal delay between attempts to reconnect to docker, 0 disables reconnecting, defaults to 60")
+    p.add_argument('--state-file', default=None, metavar="PATH", help="file to keep state in between restarts, so only containers changed in meantime are updated")
+    p.add_argument('--state-interval', default=60, type=int, metavar="SECONDS", help="minimal time between state file writes, defaults to 60")
+    p.add_argument('--log-queue-size', default=10000, type=int, metavar="SIZE", help="number of log messages to buffer for background logging thread, oldest ones are dropped when it is full, 0 logs from calling thread, defaults to 10000")
+    p.add_argument('--record-file', default=None, metavar="PATH", help="append received Docker events and inspect data of their containers to given file, for use with docker-hostdns-replay")
+    p.add_argument('--trace-file', default=None, metavar="PATH", help="write duration of loading, inspecting, event handling and DNS updates to given file in Chrome trace format")
+    p.add_argument('--profile-dir', default=None, metavar="DIR", help="on SIGUSR2 start cProfile and tracemalloc, on next SIGUSR2 write their stats to given directory")
+    p.add_argument('--metrics-port', default=0, type=int, metavar="PORT", help="serve Prometheus metrics over HTTP on given port, defaults to 0 (disabled)")
+    p.add_argument('--metrics-address', default="127.0.0.1", metavar="ADDRESS", help="address to serve metrics on, defaults to 127.0.0.1")
     p.add_argument('--clear-on-exit', default=False, action="store_true", help="clear zone on exit")
+    p.add_argument('--queue-size', default=1000, type=int, help="number of pending DNS updates to buffer when DNS server is slower than Docker events, 0 disables background writer, defaults to 1000")
+    p.add_argument('--coalesce-window', default=0, type=float, metavar="SECONDS", help="merge host changes made within given time into single DNS update, requires background writer, defaults to 0 (disabled)")
+    p.add_argument('--retry-attempts', default=10, type=int, metavar="COUNT", help="number of attempts to write failed DNS update before giving up on it, requires background writer, 0 disables retrying and failed update stops the daemon, defaults to 10")
+    p.add_argument('--retry-max-delay', default=60, type=float, metavar="SECONDS", help="maximal delay between retries of failed DNS updates, defaults to 60")
+    p.add_argument('--dead-letter-file', default=None, metavar="PATH", help="file to append host changes which could not be written to DNS server, as JSON lines")
+    p.add_argument('--hold-down', default=30, type=float, metavar="SECONDS", help="delay updates of flapping hosts until they are stable for given time, used with --coalesce-window, 0 disables, defaults to 30")
     
     conf = p.parse_args(args=argv[1:])
     conf.prog = p.prog
@@ -150,30 +269,251 @@ def execute_with_configuration(conf):
         h.setFormatter(formatter)
         handlers = [h]
     
+    log_queue = None
+    if conf.log_queue_size > 0:
+        if handlers is None:
+            h = logging.StreamHandler()
+            h.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+            handlers = [h]
+        
+        log_queue = LogQueue(handlers, conf.log_queue_size)
+        log_queue.start()
+        atexit.register(log_queue.stop)
+        handlers = [log_queue.handler]
+    
     logging.basicConfig(level=levels[min(conf.verbose, len(levels)-1)], handlers=handlers)
     
-    dns_updater = NamedUpdater(conf.zone, conf.dns_server, keyring, conf.name, conf.dns_key_alg)
-    d = DockerHandler(dns_updater)
+    try:
+        zone_networks = get_network_zones(conf.network, conf.zone)
+    except ValueError as e:
+        raise ConfigException(str(e))
     
-    dns_updater.setup()
-    d.setup(conf.network)
+    docker_urls = conf.docker_url or [None]
+    
+    if conf.backend != "update" and conf.dns_server:
+        raise ConfigException("DNS servers can be given only for update backend")
+    if conf.backend in ("hosts", "zone", "dnsmasq") and not conf.backend_path:
+        raise ConfigException("Backend %r requires --backend-path" % conf.backend)
+    if conf.backend != "update" and (conf.manage_ptr or conf.reverse_zone):
+        raise ConfigException("PTR records can be managed only by update backend")
+    if len(zone_networks) > 1:
+        if conf.backend != "update":
+            raise ConfigException("Networks can be mapped to many zones only with update backend")
+        if conf.engine == "asyncio" or len(docker_urls) > 1:
+            raise ConfigException("Networks can be mapped to many zones only with threads engine and single Docker daemon")
+    
+    # zone: list of updaters managing PTR records
+    ptr_updaters = {}
+    # connections to DNS servers, which can be opened before daemonizing
+    dns_connections = []
+    
+    def create_updater(zone):
+        if conf.backend == "server":
+            listen = conf.dns_listen or ListenArguments("127.0.0.1")
+            return ZoneServer(zone, listen.hostname, listen.port)
+        if conf.backend == "hosts":
+            return HostsFileBackend(zone, conf.backend_path)
+        if conf.backend == "zone":
+            return ZoneFileBackend(zone, conf.backend_path)
+        if conf.backend == "dnsmasq":
+            return DnsmasqBackend(zone, conf.backend_path, conf.dnsmasq_pid_file)
+        
+        dns_servers = conf.dns_server or [DnsServerArguments("127.0.0.1")]
+        dns_updaters = [
+            NamedUpdater(
+                zone, instance_name=conf.name, owner_shards=conf.owner_shards,
+                manage_ptr=conf.manage_ptr, reverse_zones=conf.reverse_zone,
+                **i.get_args(keyring, conf.dns_key_alg)
+            )
+            for i in dns_servers
+        ]
+        ptr_updaters[zone] = [i for i in dns_updaters if i.manage_ptr]
+        dns_connections.extend(i.connection for i in dns_updaters)
+        
+        if len(dns_updaters) > 1:
+            return MultiUpdater(dns_updaters)
+        return dns_updaters[0]
+    
+    # zone: updater, each zone is batched and written by its own updater and pipeline so zones do not block each other
+    dns_updaters = dict((zone, create_updater(zone)) for zone in zone_networks.keys())
+    zone_server = list(dns_updaters.values())[0] if conf.backend == "server" else None
+    
+    pipelines = {}
+    
+    # built-in server applies changes in memory, so they are not queued
+    if conf.queue_size > 0 and zone_server is None:
+        for zone, dns_updater in dns_updaters.items():
+            coalescer = Coalescer(conf.coalesce_window, conf.hold_down) if conf.coalesce_window > 0 else None
+            retry = None
+            if conf.retry_attempts > 0:
+                retry = RetryQueue(conf.retry_attempts, max_delay=conf.retry_max_delay, dead_letter_path=conf.dead_letter_file)
+            pipelines[zone] = UpdatePipeline(dns_updater, conf.queue_size, coalescer, retry)
+    
+    targets = dict((zone, pipelines[zone] if zone in pipelines else dns_updater) for zone, dns_updater in dns_updaters.items())
+    
+    if len(zone_networks) > 1:
+        d = ZonedDockerHandler(
+            dict((zone, (targets[zone], networks)) for zone, networks in zone_networks.items()),
+            conf.inventory, docker_urls[0]
+        )
+    else:
+        target = list(targets.values())[0]
+        if conf.engine == "asyncio":
+            d = AsyncEngine(target, docker_urls, conf.inventory, conf.queue_size or 1000)
+        elif len(docker_urls) > 1:
+            d = MultiDockerHandler(target, docker_urls, conf.inventory)
+        else:
+            d = DockerHandler(target, conf.inventory, docker_urls[0])
+    
+    d.reconnect_max_delay = conf.reconnect_max_delay
+    
+    # PTR records point only to main name of each container, not to its id and aliases
+    for zone, updaters in ptr_updaters.items():
+        registry = d.handlers[zone].registry if len(zone_networks) > 1 else d.registry
+        for i in updaters:
+            i.ptr_names = registry.primary_names
+    
+    def get_pending():
+        pending = sum(pipeline.pending for pipeline in pipelines.values())
+        if conf.engine == "asyncio":
+            pending += d.writer.pending
+        return pending
+    
+    metrics.HOSTS.set_function(lambda: sum(len(i.hosts) for i in dns_updaters.values()))
+    metrics.EVENTS_RECEIVED.set_function(lambda: d.events_received)
+    metrics.EVENTS_HANDLED.set_function(lambda: d.events_handled)
+    
+    def get_servers_status(field, type_):
+        values = {}
+        for zone, dns_updater in dns_updaters.items():
+            if isinstance(dns_updater, MultiUpdater):
+                for status in dns_updater.get_status():
+                    values[(zone, status["server"])] = type_(status[field])
+        return values
+    
+    metrics.DNS_SERVER_IN_SYNC.set_function(lambda: get_servers_status("healthy", int))
+    metrics.DNS_SERVER_LAG.set_function(lambda: get_servers_status("lag", float))
+    metrics.DNS_SERVER_FAILURES.set_function(lambda: get_servers_status("failures", int))
+    metrics.PENDING.set_function(get_pending)
+    
+    metrics_server = None
+    if conf.metrics_port:
+        metrics_server = metrics.MetricsServer(conf.metrics_port, conf.metrics_address)
+    
+    recorder = None
+    if conf.record_file:
+        recorder = recording.Recorder(conf.record_file)
+        d.recorder = recorder
+    
+    reconcilers = []
+    if conf.reconcile_interval > 0:
+        if conf.backend != "update":
+            raise ConfigException("Reconciliation can be used only with update backend")
+        if not pipelines:
+            raise ConfigException("Reconciliation requires background writer to be enabled")
+        reconcilers = [Reconciler(i, conf.reconcile_interval, conf.reconcile_jitter) for i in pipelines.values()]
+    
+    state_file = None
+    state = None
+    
+    if conf.state_file:
+        identity = {
+            "zone": conf.zone,
+            "name": conf.name or socket.gethostname(),
+            "network": sorted(conf.network or ["bridge"]),
+            "owner_shards": conf.owner_shards,
+        }
+        if len(docker_urls) > 1:
+            identity["docker"] = sorted(docker_urls)
+        if conf.backend != "update":
+            identity["backend"] = conf.backend
+        
+        def is_synced():
+            synced = all(pipeline.synced for pipeline in pipelines.values())
+            if conf.engine == "asyncio":
+                synced = synced and d.writer.error is None and d.writer.pending == 0
+            return synced
+        
+        state_file = StateFile(conf.state_file, conf.state_interval, identity, is_synced)
+        state = state_file.load()
+        d.state_file = state_file
+    
+    # spans of startup are traced too
+    if conf.trace_file:
+        tracing.TRACER.open(conf.trace_file)
+    
+    for zone, dns_updater in dns_updaters.items():
+        if state is None:
+            dns_updater.setup()
+        elif len(zone_networks) > 1:
+            dns_updater.restore(StateFile.get_hosts(ZonedDockerHandler.get_zone_state(state, zone)))
+        else:
+            dns_updater.restore(StateFile.get_hosts(state))
+    
+    networks = [network for zone_network_list in zone_networks.values() for network in zone_network_list]
     
     def run():
         signal.signal(signal.SIGTERM, do_quit)
         signal.signal(signal.SIGINT, do_quit)
         logger = logging.getLogger('console')
+        
+        if conf.profile_dir:
+            tracing.PROFILER.directory = conf.profile_dir
+            tracing.PROFILER.install()
+        
+        # writer, logging and server threads have to be started after daemonizing
+        if log_queue:
+            log_queue.start()
+        if zone_server:
+            zone_server.start()
+        for pipeline in pipelines.values():
+            pipeline.start()
+        if metrics_server:
+            metrics_server.start()
+        if recorder:
+            recorder.open()
+        
         try:
+            # hosts are published through already started writers, so resuming many changes does not block on full queue
+            d.setup(networks, state)
+            for reconciler in reconcilers:
+                reconciler.start()
             d.run()
         except Exception as e:
             logger.exception(e)
             raise e
+        finally:
+            logger.info("Handled %d of %d received Docker events", d.events_handled, d.events_received)
+            if metrics_server:
+                metrics_server.stop()
+            if recorder:
+                recorder.close()
+            for reconciler in reconcilers:
+                reconciler.stop()
+            for pipeline in pipelines.values():
+                pipeline.close()
         
         if conf.clear_on_exit:
-            dns_updater.set_hosts({})
+            for dns_updater in dns_updaters.values():
+                dns_updater.set_hosts({})
+            if state_file:
+                state_file.remove()
+        elif state_file and not d.save_state():
+            logger.warning("State file is not updated as some host updates were not written")
+        
+        for dns_updater in dns_updaters.values():
+            dns_updater.close()
+        
+        tracing.TRACER.close()
     
     if _has_daemon and conf.daemonize:
         pid_writer = PidWriter(os.path.realpath(conf.daemonize))
-        with daemon.DaemonContext(pidfile=pid_writer):
+        if log_queue:
+            log_queue.stop()
+        # daemonizing closes open descriptors, connections are opened again on next query
+        for connection in dns_connections:
+            connection.close()
+        with daemon.DaemonContext(pidfile=pid_writer, files_preserve=tracing.TRACER.files):
             run()
     else:
         run()
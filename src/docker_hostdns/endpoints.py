@@ -0,0 +1,159 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import logging
+import threading
+import concurrent.futures
+from docker_hostdns.hostdns import DockerHandler
+from docker_hostdns.registry import HostRegistry
+from docker_hostdns.exceptions import StopException
+
+class MultiDockerHandler(object):
+    """
+    Watches many Docker daemons at once, each by its own DockerHandler running in separate thread.
+    All handlers share host registry, so names are unique across daemons, and DNS updater.
+    Containers are registered under daemon url namespace so same container ids from different daemons do not clash.
+    """
+    
+    handler_class = DockerHandler
+    
+    # how often state file is checked while waiting for handlers
+    poll_interval = 1
+    
+    def __init__(self, dns_updater, endpoints, inventory="containers"):
+        super(MultiDockerHandler, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.dns_updater = dns_updater
+        self.lock = threading.RLock()
+        self.state_file = None
+        self.error = None
+        
+        if len(endpoints) > 1:
+            self.registry = HostRegistry()
+            self.handlers = [self.handler_class(dns_updater, inventory, i, self.registry, self.lock) for i in endpoints]
+        else:
+            # single daemon keeps container ids and state format of standalone handler
+            self.handlers = [self.handler_class(dns_updater, inventory, endpoints[0], lock=self.lock)]
+            self.registry = self.handlers[0].registry
+        
+        for handler in self.handlers:
+            handler.publish_on_load = False
+        
+        self._finished = threading.Event()
+    
+    @property
+    def reconnect_max_delay(self):
+        return self.handlers[0].reconnect_max_delay
+    
+    @reconnect_max_delay.setter
+    def reconnect_max_delay(self, value):
+        for handler in self.handlers:
+            handler.reconnect_max_delay = value
+    
+    @property
+    def events_received(self):
+        return sum(i.events_received for i in self.handlers)
+    
+    @property
+    def events_handled(self):
+        return sum(i.events_handled for i in self.handlers)
+    
+    @property
+    def recorder(self):
+        return self.handlers[0].recorder
+    
+    @recorder.setter
+    def recorder(self, value):
+        for handler in self.handlers:
+            handler.recorder = value
+    
+    def _get_handler_state(self, state, handler):
+        if state is None or handler.namespace is None:
+            return state
+        
+        prefix = handler.namespace + "/"
+        return {
+            "last_event_time": state["last_event_time"].get(handler.namespace),
+            "containers": dict(
+                (key[len(prefix):], value) for key, value in state["containers"].items() if key.startswith(prefix)
+            ),
+        }
+    
+    def setup(self, networks=None, state=None):
+        """
+        Connects to all daemons concurrently and publishes their hosts in single update.
+        """
+        def setup_handler(handler):
+            handler.setup(networks, self._get_handler_state(state, handler))
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.handlers)) as executor:
+            list(executor.map(setup_handler, self.handlers))
+        
+        if state is None:
+            self.dns_updater.set_hosts(self.get_hosts())
+    
+    def get_hosts(self):
+        hosts = {}
+        with self.lock:
+            for handler in self.handlers:
+                hosts.update(handler.get_hosts())
+        return hosts
+    
+    def get_state(self):
+        if self.handlers[0].namespace is None:
+            with self.lock:
+                return self.handlers[0].get_state()
+        
+        containers = {}
+        last_event_times = {}
+        
+        with self.lock:
+            for handler in self.handlers:
+                for container_id, value in handler.get_state()["containers"].items():
+                    containers[handler._key(container_id)] = value
+                last_event_times[handler.namespace] = handler.last_event_time
+        
+        return {
+            "last_event_time": last_event_times,
+            "containers": containers,
+        }
+    
+    def save_state(self):
+        return self.state_file.save(self.get_state())
+    
+    def _run_handler(self, handler):
+        try:
+            handler.run()
+        except Exception as e:
+            self.logger.exception(e)
+            self.error = e
+        finally:
+            self._finished.set()
+    
+    def run(self):
+        """
+        Handles events of all daemons until any of handlers stops, remaining ones are then stopped too.
+        """
+        threads = []
+        for handler in self.handlers:
+            thread = threading.Thread(target=self._run_handler, args=(handler,), name="docker-%s" % handler.endpoint, daemon=True)
+            thread.start()
+            threads.append(thread)
+        
+        try:
+            while not self._finished.wait(self.poll_interval):
+                if self.state_file is not None and self.state_file.is_due():
+                    self.save_state()
+        except StopException:
+            self.logger.info("Exitting")
+        finally:
+            # handlers must not send updates after caller closes DNS updater
+            for handler in self.handlers:
+                handler.stop()
+            for thread in threads:
+                thread.join()
+        
+        if self.error is not None:
+            raise self.error
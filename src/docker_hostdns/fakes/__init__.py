@@ -0,0 +1,5 @@
+'''
+In-process stand-ins for Docker daemon and DNS server, used by tests and benchmarks.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
@@ -0,0 +1,174 @@
+'''
+Minimal authoritative DNS server accepting updates, used as stand-in for BIND in tests and benchmarks.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import time
+import struct
+import threading
+import socketserver
+import dns.name
+import dns.rrset
+import dns.flags
+import dns.opcode
+import dns.message
+import dns.rdataclass
+import dns.rdatatype
+import dns.exception
+import dns.rdtypes.ANY.SOA
+
+class _TcpHandler(socketserver.BaseRequestHandler):
+    def _read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+    
+    def handle(self):
+        try:
+            while True:
+                (size,) = struct.unpack("!H", self._read(2))
+                wire = self.server.zone.handle(self._read(size))
+                self.request.sendall(struct.pack("!H", len(wire)) + wire)
+        except (EOFError, ConnectionError):
+            pass
+
+class _UdpHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        sock.sendto(self.server.zone.handle(data, max_size=512), self.client_address)
+
+class _TcpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _UdpServer(socketserver.ThreadingUDPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class Zone(object):
+    """
+    In-memory zone, records are kept as dict of (name, rdtype): set of rdata.
+    """
+    
+    ttl = 1
+    # seconds to wait before applying each update, simulates slow server
+    delay = 0
+    
+    def __init__(self, origin):
+        super(Zone, self).__init__()
+        
+        self.origin = dns.name.from_text(origin)
+        self.serial = 1
+        self.records = {}
+        self.updates = 0
+        self.lock = threading.Lock()
+    
+    def get(self, name, rdtype):
+        """
+        Returns textual values of records with given name relative to zone.
+        """
+        key = (dns.name.from_text(name, self.origin), dns.rdatatype.from_text(rdtype))
+        with self.lock:
+            return set(rd.to_text().strip('"') for rd in self.records.get(key, ()))
+    
+    def set(self, name, rdtype, values):
+        key = (dns.name.from_text(name, self.origin), dns.rdatatype.from_text(rdtype))
+        rrset = dns.rrset.from_text_list(key[0], self.ttl, dns.rdataclass.IN, key[1], list(values))
+        with self.lock:
+            if rrset:
+                self.records[key] = set(rrset)
+            else:
+                self.records.pop(key, None)
+            self.serial += 1
+    
+    def _get_soa(self):
+        rrset = dns.rrset.RRset(self.origin, dns.rdataclass.IN, dns.rdatatype.SOA)
+        rrset.add(dns.rdtypes.ANY.SOA.SOA(
+            dns.rdataclass.IN, dns.rdatatype.SOA,
+            dns.name.from_text("ns", self.origin), dns.name.from_text("admin", self.origin),
+            self.serial, 3600, 600, 86400, self.ttl
+        ), self.ttl)
+        return rrset
+    
+    def _get_rrset(self, name, rdtype):
+        rrset = dns.rrset.RRset(name, dns.rdataclass.IN, rdtype)
+        for rd in self.records.get((name, rdtype), ()):
+            rrset.add(rd, self.ttl)
+        return rrset
+    
+    def _update(self, q):
+        for rrset in q.authority:
+            key = (rrset.name, rrset.rdtype)
+            if rrset.deleting == dns.rdataclass.ANY:
+                self.records.pop(key, None)
+            elif rrset.deleting == dns.rdataclass.NONE:
+                current = self.records.get(key, set())
+                current.difference_update(rrset)
+                if not current:
+                    self.records.pop(key, None)
+            else:
+                self.records.setdefault(key, set()).update(rrset)
+        
+        self.serial += 1
+        self.updates += 1
+    
+    def handle(self, wire, max_size=65535):
+        q = dns.message.from_wire(wire)
+        r = dns.message.make_response(q)
+        
+        if self.delay and q.opcode() == dns.opcode.UPDATE:
+            time.sleep(self.delay)
+        
+        with self.lock:
+            if q.opcode() == dns.opcode.UPDATE:
+                self._update(q)
+            else:
+                question = q.question[0]
+                if question.rdtype == dns.rdatatype.AXFR:
+                    r.answer.append(self._get_soa())
+                    for name, rdtype in sorted(self.records.keys()):
+                        r.answer.append(self._get_rrset(name, rdtype))
+                    r.answer.append(self._get_soa())
+                elif question.rdtype == dns.rdatatype.SOA and question.name == self.origin:
+                    r.answer.append(self._get_soa())
+                elif (question.name, question.rdtype) in self.records:
+                    r.answer.append(self._get_rrset(question.name, question.rdtype))
+        
+        if q.edns >= 0:
+            max_size = max(max_size, q.payload)
+        
+        try:
+            return r.to_wire(max_size=max_size)
+        except dns.exception.TooBig:
+            r.answer = []
+            r.flags |= dns.flags.TC
+            return r.to_wire()
+
+class DnsServer(object):
+    """
+    Serves given zone over TCP and UDP on random port of localhost.
+    """
+    
+    def __init__(self, zone="example-zone"):
+        super(DnsServer, self).__init__()
+        
+        self.zone = Zone(zone)
+        self._tcp = _TcpServer(("127.0.0.1", 0), _TcpHandler)
+        self.port = self._tcp.server_address[1]
+        self._udp = _UdpServer(("127.0.0.1", self.port), _UdpHandler)
+        
+        for server in (self._tcp, self._udp):
+            server.zone = self.zone
+    
+    def start(self):
+        for server in (self._tcp, self._udp):
+            threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    
+    def stop(self):
+        for server in (self._tcp, self._udp):
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,177 @@
+'''
+Minimal Docker API served over unix socket, used as stand-in for Docker daemon in tests and benchmarks.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import re
+import json
+import asyncio
+import threading
+import urllib.parse
+
+class DockerServer(object):
+    """
+    Serves containers listing, inspecting and network events stream.
+    Event stream is closed after all events are sent, unless ``hold_events`` is set - then events added later
+    are streamed until server is stopped.
+    """
+    
+    re_inspect = re.compile("^/containers/([^/]+)/json$")
+    re_version = re.compile("^/v[0-9.]+(/.*)$")
+    
+    api_version = "1.41"
+    
+    def __init__(self, path, hold_events=False):
+        super(DockerServer, self).__init__()
+        
+        self.path = path
+        self.hold_events = hold_events
+        # container id: inspect data
+        self.containers = {}
+        self.events = []
+        self.requests = []
+        
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._stopped = None
+        # queues of connected event streams
+        self._subscribers = set()
+    
+    def add_container(self, id_, name, networks):
+        """
+        Registers running container, networks is a dict of network name: (ipv4, ipv6).
+        """
+        self.containers[id_] = {
+            "Id": id_,
+            "Name": "/%s" % name,
+            "Config": {"Labels": {}},
+            "NetworkSettings": {"Networks": dict(
+                (network, {"IPAddress": ipv4 or "", "GlobalIPv6Address": ipv6 or "", "Aliases": None})
+                for network, (ipv4, ipv6) in networks.items()
+            )},
+        }
+    
+    def add_event(self, action, container_id, network, time_nano):
+        event = {
+            "Type": "network",
+            "Action": action,
+            "Actor": {"Attributes": {"container": container_id, "name": network}},
+            "timeNano": time_nano,
+        }
+        if self._stopped is None:
+            self._publish(event)
+        else:
+            self._loop.call_soon_threadsafe(self._publish, event)
+    
+    def _publish(self, event):
+        self.events.append(event)
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+    
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._stop)
+        self._thread.join()
+    
+    def _stop(self):
+        self._stopped.set()
+        for queue in self._subscribers:
+            queue.put_nowait(None)
+    
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._serve())
+        self._loop.close()
+    
+    async def _serve(self):
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_unix_server(self._handle, self.path)
+        self._ready.set()
+        await self._stopped.wait()
+        server.close()
+        await server.wait_closed()
+    
+    def _write(self, writer, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % (status, content_type, len(body))).encode() + body)
+    
+    async def _write_event(self, writer, event):
+        chunk = json.dumps(event).encode() + b"\n"
+        writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        await writer.drain()
+    
+    async def _write_events(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+        
+        queue = asyncio.Queue()
+        if self.hold_events and not self._stopped.is_set():
+            self._subscribers.add(queue)
+        
+        try:
+            for event in list(self.events):
+                await self._write_event(writer, event)
+            
+            if queue in self._subscribers:
+                while True:
+                    event = await queue.get()
+                    if event is None:
+                        break
+                    await self._write_event(writer, event)
+        finally:
+            self._subscribers.discard(queue)
+        
+        writer.write(b"0\r\n\r\n")
+    
+    async def _handle(self, reader, writer):
+        _method, target, _version = (await reader.readline()).decode().split()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        
+        uri = urllib.parse.urlparse(target)
+        path = uri.path
+        versioned = self.re_version.match(path)
+        if versioned:
+            path = versioned.group(1)
+        self.requests.append(path)
+        
+        inspect = self.re_inspect.match(path)
+        
+        if path == "/_ping":
+            self._write(writer, "200 OK", b"OK", "text/plain")
+        elif path == "/version":
+            self._write(writer, "200 OK", {"ApiVersion": self.api_version, "Version": "fake"})
+        elif path == "/containers/json":
+            self._write(writer, "200 OK", [
+                {
+                    "Id": i["Id"],
+                    "Names": [i["Name"]],
+                    "Labels": i["Config"]["Labels"],
+                    "NetworkSettings": {"Networks": i["NetworkSettings"]["Networks"]},
+                } for i in self.containers.values()
+            ])
+        elif inspect:
+            container = self.containers.get(inspect.group(1))
+            if container is None:
+                self._write(writer, "404 Not Found", {"message": "No such container"})
+            else:
+                self._write(writer, "200 OK", container)
+        elif path == "/events":
+            try:
+                await self._write_events(writer)
+            except ConnectionError:
+                # client has stopped watching
+                return
+        else:
+            self._write(writer, "404 Not Found", {"message": "page not found"})
+        
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
@@ -0,0 +1,234 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import time
+import logging
+import threading
+import concurrent.futures
+from docker_hostdns.exceptions import DnsException
+
+class _Server(object):
+    """
+    Updater of single DNS server with its own worker thread, so slow server does not hold back others.
+    """
+    
+    def __init__(self, dns_updater):
+        super(_Server, self).__init__()
+        
+        self.dns_updater = dns_updater
+        self.name = "%s:%d" % (dns_updater.dns_server, dns_updater.dns_port)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="dns-%s" % self.name)
+        
+        self.in_sync = True
+        self.is_set_up = False
+        self.failures = 0
+        self.error = None
+        self.last_success = time.monotonic()
+        
+        # currently running call, server is lagging while it is not finished
+        self.future = None
+        self.started = None
+        self.resyncing = False
+
+class MultiUpdater(object):
+    """
+    Sends each update to many DNS servers concurrently.
+    Server which failed or did not answer in time is taken out of sync and then, in its own thread,
+    brought back with full set of hosts while remaining servers keep receiving updates.
+    """
+    
+    timeout = 10
+    resync_delay = 1
+    resync_max_delay = 60
+    
+    def __init__(self, dns_updaters):
+        super(MultiUpdater, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.servers = [_Server(i) for i in dns_updaters]
+        
+        # hostname: (ipv4s, ipv6s) which should be published, None until first full set of hosts is known
+        self.desired = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+    
+    @property
+    def hosts(self):
+        hosts = set()
+        for server in self.servers:
+            hosts.update(server.dns_updater.hosts)
+        if self.desired is not None:
+            hosts.update(self.desired.keys())
+        return hosts
+    
+    def get_status(self):
+        """
+        Returns list of dicts with health and lag, in seconds, of each server.
+        """
+        now = time.monotonic()
+        status = []
+        for server in self.servers:
+            with self._lock:
+                if not server.in_sync:
+                    lag = now - server.last_success
+                elif server.future is not None:
+                    lag = now - server.started
+                else:
+                    lag = 0
+                status.append({
+                    "server": server.name,
+                    "healthy": server.in_sync,
+                    "lag": lag,
+                    "failures": server.failures,
+                    "error": None if server.error is None else str(server.error),
+                })
+        return status
+    
+    def _mark_failed(self, server, error):
+        server.failures += 1
+        server.error = error
+        if server.in_sync:
+            self.logger.warning("DNS server %s is out of sync: %s", server.name, error)
+        server.in_sync = False
+    
+    def _mark_succeeded(self, server):
+        if server.failures:
+            self.logger.info("DNS server %s is back in sync", server.name)
+        server.failures = 0
+        server.error = None
+        server.last_success = time.monotonic()
+    
+    def _on_done(self, server, method, future):
+        with self._lock:
+            server.future = None
+            error = future.exception()
+            if error is None:
+                if method in ("setup", "restore"):
+                    server.is_set_up = True
+                if server.in_sync:
+                    self._mark_succeeded(server)
+            else:
+                self._mark_failed(server, error)
+            
+            if not server.in_sync:
+                self._schedule_resync(server)
+    
+    def _schedule_resync(self, server):
+        if server.resyncing or server.future is not None or self._closed.is_set():
+            return
+        
+        server.resyncing = True
+        server.executor.submit(self._resync, server)
+    
+    def _resync(self, server):
+        if server.failures:
+            delay = min(self.resync_max_delay, self.resync_delay * 2 ** (server.failures - 1))
+            if self._closed.wait(delay):
+                server.resyncing = False
+                return
+        
+        with self._lock:
+            version = self._version
+            desired = None if self.desired is None else dict(self.desired)
+        
+        try:
+            if not server.is_set_up:
+                server.dns_updater.setup()
+                server.is_set_up = True
+            if desired is not None:
+                self.logger.info("Resyncing DNS server %s with %d hosts", server.name, len(desired))
+                server.dns_updater.set_hosts(desired)
+        except Exception as e:
+            with self._lock:
+                server.resyncing = False
+                self._mark_failed(server, e)
+                self._schedule_resync(server)
+            return
+        
+        with self._lock:
+            server.resyncing = False
+            if version == self._version:
+                server.in_sync = True
+                self._mark_succeeded(server)
+            else:
+                # changes were made while resyncing
+                self._schedule_resync(server)
+    
+    def _call(self, method, *args, changes=None, hosts=None):
+        """
+        Runs given updater method on all servers which are in sync and waits for them to finish.
+        Servers which did not finish in time are left to work in background and resynced afterwards.
+        """
+        futures = {}
+        
+        with self._lock:
+            if hosts is not None:
+                self.desired = dict(hosts)
+            elif changes is not None and self.desired is not None:
+                for host, addresses in changes.items():
+                    if addresses is None:
+                        self.desired.pop(host, None)
+                    else:
+                        self.desired[host] = addresses
+            
+            if hosts is not None or changes is not None:
+                self._version += 1
+            
+            for server in self.servers:
+                if server.in_sync and server.future is None:
+                    future = server.executor.submit(getattr(server.dns_updater, method), *args)
+                    server.future = future
+                    server.started = time.monotonic()
+                    futures[future] = server
+                else:
+                    if server.in_sync:
+                        self.logger.warning("DNS server %s is lagging behind", server.name)
+                    server.in_sync = False
+                    self._schedule_resync(server)
+        
+        done, _not_done = concurrent.futures.wait(futures.keys(), timeout=self.timeout)
+        
+        errors = []
+        for future, server in futures.items():
+            future.add_done_callback(lambda f, server=server: self._on_done(server, method, f))
+            if future in done and future.exception() is not None:
+                errors.append("%s: %s" % (server.name, future.exception()))
+        
+        if futures and len(errors) == len(futures):
+            raise DnsException("Update failed on all DNS servers (%s)" % ", ".join(errors))
+    
+    def setup(self):
+        self._call("setup")
+    
+    def restore(self, hosts):
+        self._call("restore", hosts, hosts=hosts)
+    
+    def set_hosts(self, hosts):
+        self._call("set_hosts", hosts, hosts=hosts)
+    
+    def add_hosts(self, hosts):
+        self._call("add_hosts", hosts, changes=hosts)
+    
+    def apply_changes(self, changes):
+        self._call("apply_changes", changes, changes=changes)
+    
+    def add_host(self, names, ipv4s=None, ipv6s=None):
+        if isinstance(names, str):
+            names = [names]
+        self._call("add_host", names, ipv4s, ipv6s, changes=dict((name, (ipv4s, ipv6s)) for name in names))
+    
+    def remove_host(self, hosts):
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        self._call("remove_host", hosts, changes=dict((host, None) for host in hosts))
+    
+    def reconcile(self):
+        self._call("reconcile")
+    
+    def close(self):
+        self._closed.set()
+        for server in self.servers:
+            server.executor.shutdown(wait=True)
+            server.dns_updater.close()
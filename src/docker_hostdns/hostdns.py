@@ -4,8 +4,17 @@ Created on 29.03.2017
 @author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
 '''
 
+import os
 import re
+import time
+import zlib
+import threading
+import collections
+import urllib.parse
 import docker
+import docker.tls
+import docker.errors
+import concurrent.futures
 import logging
 import socket
 import dns.query
@@ -13,6 +22,15 @@ import dns.update
 import dns.tsig
 import dns.inet
 import dns.tsigkeyring
+import dns.rdatatype
+import dns.reversename
+import dns.exception
+import dns.flags
+from docker_hostdns import metrics
+from docker_hostdns import tracing
+from docker_hostdns.backends import Backend
+from docker_hostdns.connection import DnsConnection
+from docker_hostdns.registry import HostRegistry
 from docker_hostdns.exceptions import ConnectionException, DnsException,\
     StopException
 
@@ -21,12 +39,45 @@ def _as_str(s):
         return s.decode()
     return s
 
-class NamedUpdater(object):
+def _get_tls_files(uri):
+    """
+    Returns paths of CA certificate, client certificate and key for Docker url with "cert_path" query parameter,
+    DOCKER_CERT_PATH or ~/.docker is used when parameter is missing.
+    """
+    query = urllib.parse.parse_qs(uri.query)
+    cert_path = query.get("cert_path", [os.environ.get("DOCKER_CERT_PATH") or os.path.expanduser("~/.docker")])[-1]
+    return tuple(os.path.join(cert_path, i) for i in ("ca.pem", "cert.pem", "key.pem"))
+
+class NamedUpdater(Backend):
+    """
+    Publishes hosts to BIND zone with DNS UPDATE messages.
+    Optionally manages PTR records of host addresses in reverse zones, which are configured or found with SOA lookup.
+    """
     
     keyring = None
     keyalgorithm = None
     
-    def __init__(self, zone, dns_server, keyring=None, instance_name=None, keyalgorithm=None):
+    ttl = 1
+    
+    # DNS messages over TCP are limited to 64KiB, some space is left for header, zone and TSIG record
+    max_message_size = 65535
+    message_size_reserve = 1024
+    
+    # EDNS buffer size used when loading ownership records
+    udp_payload = 4096
+    
+    transfer_timeout = 30
+    _reconciled_serial = None
+    
+    # seconds to remember reverse zone found by SOA lookup, or that there was none
+    reverse_zone_cache_ttl = 300
+    
+    _rdata_sizes = {
+        dns.rdatatype.A: 4,
+        dns.rdatatype.AAAA: 16,
+    }
+    
+    def __init__(self, zone, dns_server, keyring=None, instance_name=None, keyalgorithm=None, owner_shards=1, dns_port=53, manage_ptr=False, reverse_zones=None, ptr_names=None):
         super(NamedUpdater, self).__init__()
         self.logger = logging.getLogger(self.__class__.__name__)
         
@@ -34,9 +85,15 @@ class NamedUpdater(object):
         
         # resolve dns server hostname
         dns_server = socket.gethostbyname(dns_server)
-
+        
         self.dns_server = dns_server
+        self.dns_port = dns_port
+        self.connection = DnsConnection(dns_server, dns_port)
         self.hosts = set()
+        # hostname: (ipv4s, ipv6s) as last sent to server, hosts loaded from ownership records have unknown addresses
+        self.records = {}
+        # hostname: name of ownership record holding it
+        self._owners = {}
         
         self._dns_zone = dns.name.from_text(self.zone)
         
@@ -45,109 +102,492 @@ class NamedUpdater(object):
         
         self._dns_txt_record = dns.name.from_text("_container_%s" % instance_name, self._dns_zone)
         
+        if owner_shards > 1:
+            self._dns_txt_records = [dns.name.from_text("_container_%s-%d" % (instance_name, i), self._dns_zone) for i in range(owner_shards)]
+        else:
+            self._dns_txt_records = [self._dns_txt_record]
+        
         if keyring:
             self.keyring = dns.tsigkeyring.from_text(keyring)
         
         if keyalgorithm is None:
             keyalgorithm = 'hmac_md5'
         self.keyalgorithm = getattr(dns.tsig, keyalgorithm.upper())
+        
+        self.manage_ptr = manage_ptr or bool(reverse_zones)
+        # configured reverse zones, longest first so most specific one is matched
+        self.reverse_zones = sorted((dns.name.from_text(i) for i in reverse_zones or []), key=len, reverse=True)
+        # parent of reverse name: (reverse zone or None, expiration time)
+        self._reverse_zone_cache = {}
+        # hosts which get PTR records, so each address points to single name of its container, None for all hosts
+        self.ptr_names = ptr_names
+    
+    def _get_owner_record(self, host):
+        """
+        Returns name of ownership record for given host, hosts are spread between shards by hash of their names.
+        """
+        owner = self._owners.get(host)
+        if owner is None:
+            owner = self._dns_txt_records[zlib.crc32(host.encode()) % len(self._dns_txt_records)]
+        return owner
+    
+    def _query(self, q):
+        """
+        Sends query over UDP and retries it over TCP when response was truncated.
+        """
+        q.use_edns(0, 0, self.udp_payload)
+        r = dns.query.udp(q, self.dns_server, timeout=self.connection.timeout, port=self.dns_port)
+        
+        if r.flags & dns.flags.TC:
+            self.logger.debug("Response for %s was truncated, retrying over TCP", q.question[0].name)
+            r = self.connection.query(q)
+        
+        return r
     
     def load_records(self):
-        q = dns.message.make_query(self._dns_txt_record, dns.rdatatype.TXT)
+        owner_records = list(self._dns_txt_records)
+        if self._dns_txt_record not in owner_records:
+            # hosts added before sharding was enabled
+            owner_records.append(self._dns_txt_record)
         
-        r = dns.query.udp(q, self.dns_server)
+        owners = {}
+        with metrics.LOAD_RECORDS.time(), tracing.span("load_records", zone=self.zone):
+            for owner_record in owner_records:
+                q = dns.message.make_query(owner_record, dns.rdatatype.TXT)
+                r = self._query(q)
+                
+                if r.answer:
+                    ns_rrset = r.find_rrset(r.answer, owner_record, dns.rdataclass.IN, dns.rdatatype.TXT)
+                    
+                    for rr in ns_rrset:
+                        for i in rr.strings:
+                            owners[_as_str(i)] = owner_record
         
-        ret = []
-        if r.answer:
-            ns_rrset = r.find_rrset(r.answer, self._dns_txt_record, dns.rdataclass.IN, dns.rdatatype.TXT)
-            
-            for rr in ns_rrset:
-                for i in rr.strings:
-                    ret.append(_as_str(i))
+        self.hosts = set(owners.keys())
+        self.records = {}
+        self._owners = owners
     
-        self.hosts = set(ret)
+    def get_serial(self):
+        q = dns.message.make_query(self._dns_zone, dns.rdatatype.SOA)
+        r = self.connection.query(q)
+        return r.find_rrset(r.answer, self._dns_zone, dns.rdataclass.IN, dns.rdatatype.SOA)[0].serial
+    
+    def _transfer(self):
+        """
+        Fetches zone with AXFR and returns tuple of zone serial, dict of owned hostname: ownership record
+        and dict of (dns name, rdtype): set of addresses.
+        """
+        owner_records = set(self._dns_txt_records)
+        owner_records.add(self._dns_txt_record)
+        
+        serial = None
+        owners = {}
+        addresses = {}
+        
+        messages = dns.query.xfr(
+            self.dns_server, self._dns_zone, port=self.dns_port,
+            keyring=self.keyring, keyalgorithm=self.keyalgorithm,
+            relativize=False, timeout=self.connection.timeout, lifetime=self.transfer_timeout
+        )
+        
+        for message in messages:
+            for rrset in message.answer:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    serial = rrset[0].serial
+                elif rrset.rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                    addresses.setdefault((rrset.name, rrset.rdtype), set()).update(rd.address for rd in rrset)
+                elif rrset.rdtype == dns.rdatatype.TXT and rrset.name in owner_records:
+                    for rd in rrset:
+                        for i in rd.strings:
+                            owners[_as_str(i)] = rrset.name
+        
+        return serial, owners, addresses
+    
+    def reconcile(self):
+        """
+        Compares zone contents with known state and sends single batch of corrections.
+        Zone is not transferred when its serial did not change since last reconciliation.
+        """
+        serial = self.get_serial()
+        if serial == self._reconciled_serial:
+            self.logger.debug("Zone serial %d did not change, skipping reconciliation", serial)
+            return
         
+        serial, owners, addresses = self._transfer()
+        
+        expected = dict(self.records)
+        unknown = self.hosts.difference(expected.keys())
+        
+        # known state is replaced with actual zone contents so only differences are sent
+        records = {}
+        for host in owners.keys():
+            dns_names = self._get_host_names(host)
+            host_records = []
+            for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                values = [frozenset(addresses.get((dns_name, rdtype), ())) for dns_name in dns_names]
+                host_records.append(values[0] if values[0] == values[1] else None)
+            if None not in host_records:
+                records[host] = tuple(host_records)
+        
+        self.hosts = set(owners.keys())
+        self.records = records
+        self._owners = owners
+        
+        changes = {}
+        for host, (ipv4s, ipv6s) in expected.items():
+            if records.get(host) != (ipv4s, ipv6s):
+                changes[host] = (ipv4s, ipv6s)
+        for host in self.hosts.difference(expected.keys(), unknown):
+            changes[host] = None
+        
+        if changes:
+            self.logger.warning("Found %d hosts with unexpected records in zone, fixing", len(changes))
+            self._apply(changes, fallback=True)
+            self._reconciled_serial = None
+        else:
+            self._reconciled_serial = serial
+        
+        # hosts with unknown addresses are kept as they were
+        self.hosts.update(unknown)
+    
     def setup(self):
         self.load_records()
     
+    def restore(self, hosts):
+        """
+        Sets known state without querying DNS server, hosts parameter is a dict of hostname: (ipv4s, ipv6s).
+        """
+        self.hosts = set(hosts.keys())
+        self._owners = {}
+        self.records = dict((host, (frozenset(ipv4s or []), frozenset(ipv6s or []))) for host, (ipv4s, ipv6s) in hosts.items())
+    
+    def close(self):
+        self.logger.debug("Closing DNS connection, %d opened and %d reused", self.connection.opened, self.connection.reused)
+        self.connection.close()
+    
     def set_hosts(self, hosts):
-        current_hosts = []
-        for host, (ipv4s, ipv6s) in hosts.items():
-            current_hosts.append(host)
-            if host not in self.hosts:
-                self.add_host(host, ipv4s, ipv6s)
+        """
+        Makes given hosts the only ones in DNS, only differences from current state are sent.
+        Hosts parameter is a dict of hostname: (ipv4s, ipv6s).
+        """
+        changes = dict(hosts)
+        for host in self.hosts.difference(hosts.keys()):
+            changes[host] = None
+        
+        self._apply(changes, fallback=True)
+    
+    def _create_update(self, ops, zone=None):
+        update = dns.update.Update(zone or self._dns_zone, keyring=self.keyring, keyalgorithm=self.keyalgorithm)
+        
+        for adding, name, rdtype, value in ops:
+            if adding:
+                update.add(name, self.ttl, rdtype, value)
+            elif value is None:
+                update.delete(name, rdtype)
+            else:
+                update.delete(name, rdtype, value)
         
-        old_hosts = self.hosts.difference(current_hosts)
-        if old_hosts:
-            self.remove_host(old_hosts)
+        return update
     
-    def add_host(self, names, ipv4s=None, ipv6s=None):
+    def _get_host_names(self, host):
+        return (
+            dns.name.from_text(host, self._dns_zone),
+            dns.name.from_text("*.%s" % host, self._dns_zone)
+        )
+    
+    def _get_add_ops(self, host, ipv4s=None, ipv6s=None):
+        ops = []
+        
+        if ipv4s or ipv6s:
+            dns_names = self._get_host_names(host)
+            
+            for rdtype, addresses in ((dns.rdatatype.A, ipv4s), (dns.rdatatype.AAAA, ipv6s)):
+                for address in addresses or []:
+                    for dns_name in dns_names:
+                        ops.append((True, dns_name, rdtype, address))
+        
+        ops.append((True, self._get_owner_record(host), dns.rdatatype.TXT, host))
+        return ops
+    
+    def _get_remove_ops(self, host, keep_owner=False):
+        ops = []
+        
+        for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+            for dns_name in self._get_host_names(host):
+                ops.append((False, dns_name, rdtype, None))
+        
+        if not keep_owner:
+            ops.append((False, self._get_owner_record(host), dns.rdatatype.TXT, host))
+        return ops
+    
+    def _get_diff_ops(self, host, old, new):
+        ops = []
+        dns_names = self._get_host_names(host)
+        
+        for rdtype, old_addresses, new_addresses in zip((dns.rdatatype.A, dns.rdatatype.AAAA), old, new):
+            for address in sorted(old_addresses.difference(new_addresses)):
+                for dns_name in dns_names:
+                    ops.append((False, dns_name, rdtype, address))
+            for address in sorted(new_addresses.difference(old_addresses)):
+                for dns_name in dns_names:
+                    ops.append((True, dns_name, rdtype, address))
+        
+        return ops
+    
+    def _get_change_ops(self, host, records):
         """
-        Update DNS with host records.
-        Names parameter can be a single hostname or list of aliases to use.
+        Returns minimal list of ops needed to get from current state of host to given records.
         """
+        if records is None:
+            return self._get_remove_ops(host)
         
-        if isinstance(names, str):
-            names = [names]
+        if host not in self.hosts:
+            return self._get_add_ops(host, *records)
         
-        self.logger.debug("Adding host %r", names)
-        update = dns.update.Update(self._dns_zone, keyring=self.keyring, keyalgorithm=self.keyalgorithm)
+        current = self.records.get(host)
+        if current is None:
+            # only ownership record is known, so all address records are replaced
+            ops = self._get_remove_ops(host, keep_owner=True)
+            ops.extend(op for op in self._get_add_ops(host, *records) if op[2] != dns.rdatatype.TXT)
+            return ops
         
-        for host in names:
-            if ipv4s or ipv6s:
-                dns_name_single = dns.name.from_text(host, self._dns_zone)
-                dns_name_multi = dns.name.from_text("*.%s" % host, self._dns_zone)
-            
-            if ipv4s:
-                for ipv4 in ipv4s:
-                    update.add(dns_name_single, 1, dns.rdatatype.A, ipv4)
-                    update.add(dns_name_multi, 1, dns.rdatatype.A, ipv4)
-            
-            if ipv6s:
-                for ipv6 in ipv6s:
-                    update.add(dns_name_single, 1, dns.rdatatype.AAAA, ipv6)
-                    update.add(dns_name_multi, 1, dns.rdatatype.AAAA, ipv6)
+        return self._get_diff_ops(host, current, records)
+    
+    def _get_ops_size(self, ops):
+        """
+        Returns upper bound of wire size of given ops, name compression is not taken into account.
+        """
+        size = 0
+        for _adding, name, rdtype, value in ops:
+            # owner name followed by type, class, ttl and rdlength fields
+            size += len(name.to_wire()) + 10
+            if value is not None:
+                size += self._rdata_sizes.get(rdtype, len(value) + 1)
+        return size
+    
+    def _chunk(self, items):
+        """
+        Groups (host, ops) items so each group fits in single UPDATE message.
+        """
+        limit = self.max_message_size - self.message_size_reserve
         
-            update.add(self._dns_txt_record, 1, dns.rdatatype.TXT, host)
+        chunk = []
+        chunk_size = 0
+        for item in items:
+            item_size = self._get_ops_size(item[1])
+            if chunk and chunk_size + item_size > limit:
+                yield chunk
+                chunk = []
+                chunk_size = 0
+            chunk.append(item)
+            chunk_size += item_size
         
-        self._update(update)
-        self.hosts.update(names)
+        if chunk:
+            yield chunk
     
-    def _update(self, update):
-        response = dns.query.tcp(update, self.dns_server, timeout=2)
+    def _commit(self, host, records):
+        if records is None:
+            self.hosts.discard(host)
+            self.records.pop(host, None)
+            self._owners.pop(host, None)
+        else:
+            self._owners[host] = self._get_owner_record(host)
+            self.hosts.add(host)
+            self.records[host] = records
+    
+    def _apply(self, changes, fallback=False):
+        """
+        Sends changes in as few UPDATE messages as possible.
+        With fallback enabled, hosts from rejected message are retried one by one so single bad entry does not block the rest.
+        """
+        previous = dict((host, self.records.get(host)) for host in changes.keys())
+        if self.manage_ptr:
+            for host, old in previous.items():
+                if old is None and host in self.hosts:
+                    # addresses of hosts loaded from ownership records are needed to remove their PTR records
+                    previous[host] = self._lookup_addresses(host)
+        try:
+            self._apply_forward(changes, fallback)
+        finally:
+            if self.manage_ptr:
+                self._apply_ptrs(previous)
+    
+    def _apply_forward(self, changes, fallback):
+        items = []
+        for host, addresses in changes.items():
+            records = None if addresses is None else (frozenset(addresses[0] or []), frozenset(addresses[1] or []))
+            ops = self._get_change_ops(host, records)
+            if ops:
+                items.append((host, ops, records))
+            else:
+                self._commit(host, records)
         
-        rcode = response.rcode()
-        if rcode != dns.rcode.NOERROR:
-            raise DnsException("Adding host failed with %s" % dns.rcode.to_text(rcode))
+        if not items:
+            return
+        
+        self.logger.debug("Updating %d hosts", len(items))
+        
+        for chunk in self._chunk(items):
+            try:
+                self._update(self._create_update([op for _host, ops, _records in chunk for op in ops]))
+            except DnsException as e:
+                if not fallback:
+                    raise
+                
+                self.logger.warning("Batch of %d hosts was rejected (%s), falling back to single updates", len(chunk), e)
+                for host, ops, records in chunk:
+                    try:
+                        self._update(self._create_update(ops))
+                    except DnsException as e:
+                        self.logger.error("Updating host %r failed: %s", host, e)
+                    else:
+                        self._commit(host, records)
+            else:
+                for host, _ops, records in chunk:
+                    self._commit(host, records)
     
-    def remove_host(self, hosts):
-        self.logger.debug("Removing host %r", hosts)
+    def _lookup_reverse_zone(self, name):
+        """
+        Asks DNS server for SOA of given name, returns name of zone it is authoritative for or None.
+        """
+        q = dns.message.make_query(name, dns.rdatatype.SOA)
+        r = self._query(q)
         
-        if isinstance(hosts, str):
-            hosts = [hosts]
+        if not r.flags & dns.flags.AA or r.rcode() not in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+            return None
         
-        update = dns.update.Update(self._dns_zone, keyring=self.keyring, keyalgorithm=self.keyalgorithm)
+        # zone apex has SOA in answer, names below it in authority section
+        for rrset in list(r.answer) + list(r.authority):
+            if rrset.rdtype == dns.rdatatype.SOA and name.is_subdomain(rrset.name):
+                return rrset.name
+        return None
+    
+    def _get_reverse_zone(self, name):
+        """
+        Returns reverse zone holding given PTR name, configured zones are used before asking DNS server.
+        """
+        for zone in self.reverse_zones:
+            if name.is_subdomain(zone):
+                return zone
         
-        for host in hosts:
-            dns_name_single = dns.name.from_text(host, self._dns_zone)
-            dns_name_multi = dns.name.from_text("*.%s" % host, self._dns_zone)
-            
-            update.delete(dns_name_single, dns.rdatatype.A)
-            update.delete(dns_name_multi, dns.rdatatype.A)
-            
-            update.delete(dns_name_single, dns.rdatatype.AAAA)
-            update.delete(dns_name_multi, dns.rdatatype.AAAA)
-            
-            update.delete(self._dns_txt_record, dns.rdatatype.TXT, host)
+        key = name.parent()
+        cached = self._reverse_zone_cache.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        
+        try:
+            zone = self._lookup_reverse_zone(name)
+        except (dns.exception.DNSException, OSError) as e:
+            self.logger.warning("Looking up reverse zone of %s failed: %s", name, e)
+            return None
+        
+        if zone is None:
+            self.logger.info("No reverse zone found for %s, PTR records will not be managed", key)
+        
+        self._reverse_zone_cache[key] = (zone, time.monotonic() + self.reverse_zone_cache_ttl)
+        return zone
+    
+    def _get_ptr_ops(self, host, old, new):
+        """
+        Returns list of (reverse name, ops) for PTR records of addresses which were removed from or added to host.
+        Records are added only for hosts listed in ``ptr_names``, but removed for any host,
+        as deleting missing record is a no-op. Added records replace whole PTR rrset of address,
+        so address reused by other container does not keep name of previous one.
+        """
+        old_addresses = set() if old is None else old[0].union(old[1])
+        new_addresses = set() if new is None else new[0].union(new[1])
+        target = dns.name.from_text(host, self._dns_zone).to_text()
+        
+        added = new_addresses.difference(old_addresses)
+        if self.ptr_names is not None and host not in self.ptr_names:
+            added = ()
+        
+        items = []
+        for address in sorted(old_addresses.difference(new_addresses)):
+            name = dns.reversename.from_address(address)
+            items.append((name, [(False, name, dns.rdatatype.PTR, target)]))
+        for address in sorted(added):
+            name = dns.reversename.from_address(address)
+            items.append((name, [(False, name, dns.rdatatype.PTR, None), (True, name, dns.rdatatype.PTR, target)]))
+        return items
+    
+    def _lookup_addresses(self, host):
+        """
+        Asks DNS server for addresses of host, returns (ipv4s, ipv6s) or None when lookup failed.
+        """
+        name = dns.name.from_text(host, self._dns_zone)
+        records = []
+        try:
+            for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                r = self._query(dns.message.make_query(name, rdtype))
+                records.append(frozenset(rd.address for rrset in r.answer if rrset.rdtype == rdtype for rd in rrset))
+        except (dns.exception.DNSException, OSError) as e:
+            self.logger.warning("Looking up addresses of %r failed, its PTR records will not be removed: %s", host, e)
+            return None
+        return tuple(records)
+    
+    def _apply_ptrs(self, previous):
+        """
+        Updates PTR records of hosts changed since given previous records, with single UPDATE message per reverse zone.
+        PTR records are secondary to forward ones, so failures are only logged.
+        """
+        # reverse zone: list of (host, ops)
+        zones = {}
+        for host, old in previous.items():
+            for name, ops in self._get_ptr_ops(host, old, self.records.get(host)):
+                zone = self._get_reverse_zone(name)
+                if zone is not None:
+                    zones.setdefault(zone, []).append((host, ops))
         
-        self._update(update)
-        self.hosts.difference_update(hosts)
+        for zone, items in zones.items():
+            self.logger.debug("Updating %d PTR records in zone %s", len(items), zone)
+            for chunk in self._chunk(items):
+                try:
+                    self._update(self._create_update([op for _host, ops in chunk for op in ops], zone))
+                except (DnsException, dns.exception.DNSException, OSError) as e:
+                    self.logger.error("Updating PTR records in zone %s failed: %s", zone, e)
+    
+    def add_hosts(self, hosts):
+        """
+        Update DNS with many hosts at once, using as few UPDATE messages as possible.
+        Hosts parameter is a dict of hostname: (ipv4s, ipv6s).
+        When server rejects a batch, its hosts are retried one by one so single bad entry does not block the rest.
+        """
+        self._apply(hosts, fallback=True)
+    
+    def apply_changes(self, changes):
+        """
+        Update DNS with many host changes at once, using as few UPDATE messages as possible.
+        Changes parameter is a dict of hostname: (ipv4s, ipv6s), or hostname: None for removed hosts.
+        Only records which differ from current state are sent.
+        """
+        self._apply(changes)
+    
+    def _update(self, update):
+        # round trips can be made from worker threads of asyncio writer or of DNS servers fan-out
+        tracing.attach()
+        started = time.monotonic()
+        try:
+            with tracing.span("dns_update", zone=update.origin.to_text()):
+                response = self.connection.query(update)
+        except Exception:
+            metrics.DNS_UPDATES.inc("error")
+            raise
+        finally:
+            metrics.DNS_UPDATE_LATENCY.observe(time.monotonic() - started)
+        
+        rcode = response.rcode()
+        metrics.DNS_UPDATES.inc(dns.rcode.to_text(rcode))
+        if rcode != dns.rcode.NOERROR:
+            raise DnsException("Adding host failed with %s" % dns.rcode.to_text(rcode))
 
 class ContainerInfo(object):
     ipv4s = None
     ipv6s = None
     id = None
     names = None
+    # main name of container, from label or container name
+    name = None
     
     re_name = re.compile('[^a-zA-Z0-9-.]+')
     
@@ -163,127 +603,519 @@ class ContainerInfo(object):
     def from_container(cls, container, network_names):
         d = container.attrs
         
-        id_ = d["Id"]
-        aliases = set([id_[:12], d["Name"]])
-        
-        ipv4s = []
-        ipv6s = []
-        
-        custom_name = d["Config"]["Labels"].get("pl.glorpen.hostname", None)
-        
-        for network_name in network_names:
-            try:
-                network = d["NetworkSettings"]["Networks"][network_name]
-            except KeyError:
-                continue
-        
-            if network["IPAddress"]:
-                ipv4s.append(network["IPAddress"])
-            if network["GlobalIPv6Address"]:
-                ipv6s.append(network["GlobalIPv6Address"])
-            if not custom_name and network["Aliases"]:
-                aliases.update(network["Aliases"])
+        return cls.from_attrs(d["Id"], d["Name"], d["Config"]["Labels"], d["NetworkSettings"]["Networks"], network_names)
+    
+    @classmethod
+    def from_attrs(cls, id_, name, labels, networks, network_names):
+        """
+        Creates info from parts of container inspect data, networks is a dict of network name: endpoint settings.
+        """
+        with tracing.span("container_info"):
+            aliases = set([id_[:12], name])
+            
+            ipv4s = []
+            ipv6s = []
+            
+            custom_name = (labels or {}).get("pl.glorpen.hostname", None)
+            
+            for network_name in network_names:
+                try:
+                    network = networks[network_name]
+                except KeyError:
+                    continue
+                
+                if network["IPAddress"]:
+                    ipv4s.append(network["IPAddress"])
+                if network["GlobalIPv6Address"]:
+                    ipv6s.append(network["GlobalIPv6Address"])
+                if not custom_name and network.get("Aliases"):
+                    aliases.update(network["Aliases"])
+            
+            names = [custom_name] if custom_name else aliases
+            names = set(cls.sanitize(i) for i in names)
         
-        names = [custom_name] if custom_name else aliases
-        names = set(cls.re_name.sub("-", name).strip("-") for name in names)
+        return cls(id=id_, names=names, name=cls.sanitize(custom_name or name), ipv4s=ipv4s, ipv6s=ipv6s)
+    
+    @classmethod
+    def sanitize(cls, name):
+        return cls.re_name.sub("-", name).strip("-")
+
+class NetworkEvent(collections.namedtuple("NetworkEvent", ["action", "container_id", "network", "time"])):
+    """
+    Docker network connect/disconnect event.
+    """
+    __slots__ = ()
+    
+    @classmethod
+    def from_dict(cls, event):
+        """
+        Decodes event from Docker API, None is returned for non network events.
+        """
+        if event.get("Type") != "network":
+            return None
         
-        return cls(id=id_, names=names, ipv4s=ipv4s, ipv6s=ipv6s)
+        attributes = event.get("Actor", {}).get("Attributes", {})
+        return cls(event.get("Action"), attributes.get("container"), attributes.get("name"), event.get("timeNano"))
+    
+    @property
+    def timestamp(self):
+        """
+        Unix time of event in seconds, None when not known.
+        """
+        return self.time / 1000000000 if self.time else None
 
 class DockerHandler(object):
     
     client = None
     networks = []
     
-    def __init__(self, dns_updater):
+    inventory_workers = 8
+    
+    reconnect_delay = 1
+    reconnect_max_delay = 60
+    
+    # nanosecond timestamp of last handled event
+    last_event_time = None
+    # unix time of first events request, starting position until any event is seen
+    subscribed_time = None
+    
+    events_received = 0
+    events_handled = 0
+    
+    # predefined networks which does not support aliases
+    _networks_without_aliases = ("bridge",)
+    
+    # when disabled, hosts found on start are not sent and have to be published by caller
+    publish_on_load = True
+    
+    # records seen events and inspect data fetched for them when set
+    recorder = None
+    
+    def __init__(self, dns_updater, inventory="containers", endpoint=None, registry=None, lock=None):
+        """
+        Endpoint is Docker daemon url, "tcp+tls://" scheme enables TLS with certificates from "cert_path" query parameter,
+        DOCKER_CERT_PATH or ~/.docker. Environment configuration is used when not given.
+        Registry and lock can be shared by handlers of many daemons, names of their containers are then kept under endpoint namespace.
+        """
         super(DockerHandler, self).__init__()
         self.logger = logging.getLogger(self.__class__.__name__)
         
         self.dns_updater = dns_updater
-        self._hosts_cache = {}
+        self.inventory = inventory
+        self.endpoint = endpoint
+        self.namespace = None if registry is None else endpoint
+        self.registry = HostRegistry() if registry is None else registry
+        self.lock = threading.RLock() if lock is None else lock
+        # container id: (ipv4s, ipv6s)
+        self.addresses = {}
+        self.state_file = None
+        
+        self._stopping = threading.Event()
+        self._events = None
+    
+    def _key(self, container_id):
+        """
+        Returns registry key of given container.
+        """
+        if self.namespace is None:
+            return container_id
+        return "%s/%s" % (self.namespace, container_id)
+    
+    def _create_client(self):
+        if self.endpoint is None:
+            return docker.from_env()
+        
+        uri = urllib.parse.urlparse(self.endpoint)
+        tls = False
+        
+        if uri.scheme == "tcp+tls":
+            ca_cert, client_cert, client_key = _get_tls_files(uri)
+            tls = docker.tls.TLSConfig(client_cert=(client_cert, client_key), ca_cert=ca_cert, verify=True)
+            base_url = "tcp://%s" % uri.netloc
+        else:
+            base_url = self.endpoint
+        
+        return docker.DockerClient(base_url=base_url, tls=tls)
     
-    def setup(self, networks=None):
+    def _connect(self):
         try:
-            client = docker.from_env()
+            client = self._create_client()
             client.ping()
         except Exception:
-            raise ConnectionException('Error communicating with docker.')
+            raise ConnectionException('Error communicating with docker%s.' % ("" if self.endpoint is None else " at %s" % self.endpoint))
         
-        self.logger.info("Connected to docker")
+        self.logger.info("Connected to docker%s", "" if self.endpoint is None else " at %s" % self.endpoint)
         self.client = client
+    
+    def setup(self, networks=None, state=None):
+        self._connect()
         
         self.networks = ("bridge",) if not networks else tuple(networks)
         
-        self.load_containers()
+        if state is None:
+            self.load_containers()
+        else:
+            self.resume(state)
     
-    def _deduplicate_container_names(self, names):
-        names = set(_as_str(name) for name in names)
+    def _get_network_endpoints(self):
+        """
+        Returns dict of container id: {network name: endpoint settings} built from inspecting watched networks.
+        """
+        endpoints = {}
         
-        for cached_names in self._hosts_cache.values():
-            to_remove = []
-            for name in names:
-                if cached_names.count(name) > 0:
-                    to_remove.append(name)
+        for network_name in self.networks:
+            try:
+                network = self.client.networks.get(network_name)
+            except docker.errors.NotFound:
+                self.logger.warning("Network %r was not found", network_name)
+                continue
             
-            for name in to_remove:
-                self.logger.warning('Removing duplicated host %r', name)
-                names.discard(name)
+            for container_id, endpoint in (network.attrs.get("Containers") or {}).items():
+                # endpoints of containers from other swarm nodes
+                if container_id.startswith("ep-"):
+                    continue
+                
+                endpoints.setdefault(container_id, {})[network_name] = {
+                    "IPAddress": endpoint["IPv4Address"].split("/")[0],
+                    "GlobalIPv6Address": endpoint["IPv6Address"].split("/")[0],
+                    "Aliases": None,
+                }
         
-        return tuple(names)
+        return endpoints
     
-    def load_containers(self):
-        known_hosts = {}
+    def _scan_by_networks(self):
+        """
+        Lists running containers with O(networks) API calls.
+        Containers are inspected only when they could have network aliases.
+        """
+        endpoints = self._get_network_endpoints()
+        summaries = dict((c["Id"], c) for c in self.client.api.containers(filters={"status":"running"}))
+        
+        sources = []
+        to_inspect = []
         
-        for container in self.client.containers.list(filters={"status":"running"}):
-            info = ContainerInfo.from_container(container, self.networks)
+        for container_id, networks in endpoints.items():
+            summary = summaries.get(container_id)
+            
+            if summary is None:
+                # container was started after listing
+                to_inspect.append(container_id)
+                continue
+            
+            labels = summary.get("Labels") or {}
+            if "pl.glorpen.hostname" not in labels and set(networks.keys()).difference(self._networks_without_aliases):
+                to_inspect.append(container_id)
+                continue
             
+            sources.append((container_id, summary["Names"][0], labels, networks))
+        
+        if to_inspect:
+            self.logger.debug("Inspecting %d containers", len(to_inspect))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.inventory_workers) as executor:
+                for container in executor.map(self._get_running_container, to_inspect):
+                    if container is not None:
+                        sources.append(container)
+        
+        return sources
+    
+    def _get_running_container(self, container_id):
+        try:
+            with tracing.span("inspect", container=container_id[:12]):
+                return self.client.containers.get(container_id)
+        except docker.errors.NotFound:
+            return None
+    
+    def _inspect_container(self, container_id):
+        container = self._get_running_container(container_id)
+        return None if container is None else ContainerInfo.from_container(container, self.networks)
+    
+    def _scan(self):
+        """
+        Lists running containers as list of containers or tuples of ContainerInfo.from_attrs arguments,
+        so infos for any subset of watched networks can be made from single scan.
+        """
+        if self.inventory == "networks":
+            return self._scan_by_networks()
+        
+        return self.client.containers.list(filters={"status":"running"})
+    
+    def _get_info(self, source, network_names):
+        if isinstance(source, tuple):
+            return ContainerInfo.from_attrs(*source, network_names=network_names)
+        return ContainerInfo.from_container(source, network_names)
+    
+    def _list_containers(self):
+        return [self._get_info(i, self.networks) for i in self._scan()]
+    
+    def load_containers(self):
+        with metrics.LOAD_CONTAINERS.time(), tracing.span("load_containers"):
+            infos = self._list_containers()
+        self._register(infos)
+    
+    def _register(self, infos):
+        """
+        Registers listed containers and, unless disabled, publishes them as the only hosts.
+        """
+        with self.lock:
+            with tracing.span("dedup", containers=len(infos)):
+                for info in infos:
+                    if info.has_address():
+                        self.registry.add(self._key(info.id), [_as_str(name) for name in info.names], _as_str(info.name))
+                        self.addresses[info.id] = (info.ipv4s, info.ipv6s)
+            
+            if self.publish_on_load:
+                self.dns_updater.set_hosts(self.get_hosts())
+    
+    def get_hosts(self):
+        """
+        Returns dict of hostname: (ipv4s, ipv6s) of tracked containers.
+        """
+        hosts = {}
+        with self.lock:
+            for container_id, addresses in self.addresses.items():
+                for name in self.registry.get(self._key(container_id)):
+                    hosts[name] = addresses
+        return hosts
+    
+    def get_state(self):
+        containers = {}
+        with self.lock:
+            for container_id, (ipv4s, ipv6s) in self.addresses.items():
+                key = self._key(container_id)
+                containers[container_id] = [self.registry.get(key), ipv4s, ipv6s, self.registry.get_primary(key)]
+        
+        return {
+            "last_event_time": self.last_event_time,
+            "containers": containers,
+        }
+    
+    def save_state(self):
+        return self.state_file.save(self.get_state())
+    
+    def resume(self, state):
+        """
+        Restores containers from saved state and handles only the ones which changed since then.
+        Running containers are listed without inspecting, only new ones are inspected.
+        """
+        self._resume(state, self.client.api.containers(filters={"status":"running"}))
+    
+    def _resume(self, state, summaries):
+        running = self._restore(state, summaries)
+        changed = self._remove_stopped(running)
+        
+        for container_id in self._get_changed(running):
+            info = self._inspect_container(container_id)
+            if info is not None:
+                self.on_connect(container_id, info.names, info.ipv4s, info.ipv6s, info.name)
+                changed += 1
+        
+        self.logger.info("Resumed from saved state, %d of %d containers changed", changed, len(running))
+    
+    def _restore(self, state, summaries):
+        """
+        Registers containers from saved state and returns dict of container id: (ipv4s, ipv6s) of running ones.
+        """
+        with self.lock:
+            for container_id, value in state["containers"].items():
+                # main name is missing in state saved by earlier development builds
+                names, ipv4s, ipv6s = value[:3]
+                self.registry.add(self._key(container_id), names, value[3] if len(value) > 3 else None)
+                self.addresses[container_id] = (ipv4s, ipv6s)
+        
+        self.last_event_time = state.get("last_event_time")
+        
+        running = {}
+        for summary in summaries:
+            networks = (summary.get("NetworkSettings") or {}).get("Networks") or {}
+            info = ContainerInfo.from_attrs(summary["Id"], summary["Names"][0], summary.get("Labels"), networks, self.networks)
             if info.has_address():
-                unique_names = self._deduplicate_container_names(info.names)
-                self._hosts_cache[info.id] = unique_names
-                for unique_name in unique_names:
-                    known_hosts[unique_name] = (info.ipv4s, info.ipv6s)
+                running[info.id] = (info.ipv4s, info.ipv6s)
         
-        self.dns_updater.set_hosts(known_hosts)
+        return running
+    
+    def _remove_stopped(self, running):
+        removed = 0
+        for container_id in list(self.addresses.keys()):
+            if container_id not in running:
+                self.on_disconnect(container_id)
+                removed += 1
+        return removed
+    
+    def _get_changed(self, running):
+        """
+        Returns ids of running containers which are new or have different addresses than saved ones.
+        """
+        changed = []
+        for container_id, (ipv4s, ipv6s) in running.items():
+            known = self.addresses.get(container_id)
+            if known is None or sorted(known[0]) != sorted(ipv4s) or sorted(known[1]) != sorted(ipv6s):
+                changed.append(container_id)
+        return changed
     
     def on_disconnect(self, container_id):
-        if container_id not in self._hosts_cache:
-            self.logger.debug("Disconnected container %r was not tracked, ignoring", container_id)
-            return
-        names = self._hosts_cache[container_id]
-        self.logger.info("Removing entry %r as container %r disconnected", names, container_id)
-        del self._hosts_cache[container_id]
-        
-        self.dns_updater.remove_host(names)
+        with self.lock:
+            names = self.registry.remove(self._key(container_id))
+            if names is None:
+                self.logger.debug("Disconnected container %r was not tracked, ignoring", container_id)
+                return
+            del self.addresses[container_id]
+            self.logger.info("Removing entry %r as container %r disconnected", names, container_id)
+            
+            self.dns_updater.remove_host(names)
+    
+    def on_connect(self, container_id, names, ipv4s, ipv6s, primary=None):
+        with self.lock:
+            previous_names = self.registry.get(self._key(container_id)) or ()
+            with tracing.span("dedup", containers=1):
+                unique_names = self.registry.add(self._key(container_id), [_as_str(name) for name in names], _as_str(primary))
+            self.addresses[container_id] = (ipv4s, ipv6s)
+            
+            # already known container can be deduplicated to different names than before
+            dropped_names = tuple(i for i in previous_names if i not in unique_names)
+            if dropped_names:
+                self.logger.info("Removing entry %r as container %r was renamed", dropped_names, container_id)
+                self.dns_updater.remove_host(dropped_names)
+            
+            self.logger.info("Adding new entry %r:{ipv4:%r, ipv6:%r} for container %r", unique_names, ipv4s, ipv6s, container_id)
+            self.dns_updater.add_host(unique_names, ipv4s, ipv6s)
     
-    def on_connect(self, container_id, names, ipv4s, ipv6s):
-        unique_names = self._deduplicate_container_names(names)
-        self.logger.info("Adding new entry %r:{ipv4:%r, ipv6:%r} for container %r", unique_names, ipv4s, ipv6s, container_id)
-        self._hosts_cache[container_id] = unique_names
-        self.dns_updater.add_host(unique_names, ipv4s, ipv6s)
+    def _get_container(self, container_id):
+        """
+        Fetches container of handled event.
+        """
+        try:
+            with tracing.span("inspect", container=container_id[:12]):
+                container = self.client.containers.get(container_id)
+        except docker.errors.NotFound:
+            if self.recorder is not None:
+                self.recorder.record_inspect(container_id, None)
+            raise
         
+        if self.recorder is not None:
+            self.recorder.record_inspect(container_id, container.attrs)
+        return container
+    
     def handle_event(self, event):
-        if event["Type"] == "network" and event["Actor"]["Attributes"]["name"] in self.networks:
-            if event["Action"] == "connect":
-                container_id = event["Actor"]["Attributes"]["container"]
-                self.logger.debug("Handling connect event for container %r", container_id)
-                info = ContainerInfo.from_container(self.client.containers.get(container_id), self.networks)
-                self.on_connect(container_id, info.names, info.ipv4s, info.ipv6s)
+        self.events_received += 1
+        
+        event = NetworkEvent.from_dict(event)
+        if event is None or event.network not in self.networks:
+            return
+        
+        with tracing.span("handle_event", action=event.action, network=event.network), metrics.event_time(event.timestamp):
+            if event.action == "connect":
+                self.logger.debug("Handling connect event for container %r", event.container_id)
+                info = ContainerInfo.from_container(self._get_container(event.container_id), self.networks)
+                self.on_connect(event.container_id, info.names, info.ipv4s, info.ipv6s, info.name)
+                self.events_handled += 1
             
-            if event["Action"] == "disconnect":
-                container_id = event["Actor"]["Attributes"]["container"]
-                self.logger.debug("Handling disconnect event for container %r", container_id)
-                self.on_disconnect(container_id)
+            if event.action == "disconnect":
+                self.logger.debug("Handling disconnect event for container %r", event.container_id)
+                self.on_disconnect(event.container_id)
+                self.events_handled += 1
+            
+            # no-op when update was queued, writer observes it when applied
+            metrics.observe_applied()
+        
+        self._observe_event(event)
+    
+    def _observe_event(self, event):
+        # latency is observed when update caused by event is applied
+        metrics.EVENTS.inc(event.action)
+    
+    def _get_events_filter(self):
+        """
+        Returns filters and "since" parameter for Docker events request.
+        """
+        filters = {
+            "type": ["network"],
+            "event": ["connect", "disconnect"],
+            "network": list(self.networks),
+        }
+        if self.last_event_time is not None:
+            since = self.last_event_time // 1000000000
+        else:
+            if self.subscribed_time is None:
+                # events missed while stream was broken before first one was seen are requested after reconnecting
+                self.subscribed_time = int(time.time())
+            since = self.subscribed_time
+        return filters, since
+    
+    def _get_events(self):
+        filters, since = self._get_events_filter()
+        kwargs = {
+            "decode": True,
+            "filters": filters,
+        }
+        if since is not None:
+            kwargs["since"] = since
+        return self.client.events(**kwargs)
+    
+    def _is_replayed(self, event):
+        return self.last_event_time is not None and event.get("timeNano", 0) <= self.last_event_time
+    
+    def stop(self):
+        """
+        Makes ``run`` return without handling more events, can be called from other thread.
+        """
+        self._stopping.set()
+        
+        events = self._events
+        if events is not None:
+            # unblocks thread waiting for next event
+            events.close()
     
     def run(self):
-        events = self.client.events(decode=True)
+        events = None
+        delay = self.reconnect_delay
         
-        while True:
+        while not self._stopping.is_set():
             try:
+                if events is None:
+                    events = self._events = self._get_events()
                 event = next(events)
             except StopException:
                 self.logger.info("Exitting")
                 return
-            except Exception:
-                self.logger.info("Docker connection broken - exitting")
-                return
+            except Exception as e:
+                if self._stopping.is_set():
+                    break
+                if not self.reconnect_max_delay:
+                    self.logger.info("Docker connection broken - exitting")
+                    return
+                
+                events = None
+                self.logger.warning("Docker connection broken (%s), reconnecting in %ds", e, delay)
+                try:
+                    self._stopping.wait(delay)
+                except StopException:
+                    self.logger.info("Exitting")
+                    return
+                
+                delay = min(delay * 2, self.reconnect_max_delay)
+                continue
+            
+            delay = self.reconnect_delay
+            tracing.attach()
+            
+            if self._stopping.is_set():
+                break
+            
+            if self.recorder is not None:
+                self.recorder.record_event(event)
+            
+            # events from the second of last seen event are sent again after reconnecting
+            if self._is_replayed(event):
+                continue
+            
+            # connect events replayed after reconnecting or resuming may refer to already removed containers
+            try:
+                self.handle_event(event)
+            except docker.errors.NotFound as e:
+                self.logger.info("Skipping event of removed container: %s", e)
+            
+            if "timeNano" in event:
+                self.last_event_time = event["timeNano"]
             
-            self.handle_event(event)
+            if self.state_file is not None and self.state_file.is_due():
+                self.save_state()
@@ -0,0 +1,74 @@
+'''
+Logging through bounded queue handled by background thread.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import queue
+import logging
+import logging.handlers
+from docker_hostdns import metrics
+
+class DroppingQueue(queue.Queue):
+    """
+    Queue which never blocks producers, oldest item is dropped to make room for new one.
+    """
+    
+    def __init__(self, maxsize):
+        super(DroppingQueue, self).__init__(maxsize)
+        self.dropped = 0
+    
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            # None is stop sentinel of listener and is never dropped
+            if 0 < self.maxsize <= self._qsize() and self.queue[0] is not None:
+                self._get()
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+                metrics.LOG_DROPPED.inc()
+            
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # records are handled in the same process, so message is formatted by listener thread
+        return record
+
+class LogQueue(object):
+    """
+    Passes log records to given handlers from background thread, so slow handlers (eg. remote syslog) do not block logging code.
+    Listener has to be started again after forking.
+    """
+    
+    def __init__(self, handlers, max_size=10000):
+        super(LogQueue, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.queue = DroppingQueue(max_size)
+        self.handler = _QueueHandler(self.queue)
+        self._listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self._running = False
+    
+    @property
+    def dropped(self):
+        return self.queue.dropped
+    
+    def start(self):
+        if not self._running:
+            self._listener.start()
+            self._running = True
+    
+    def stop(self):
+        """
+        Stops listener after handling already queued records.
+        """
+        if not self._running:
+            return
+        
+        if self.dropped:
+            self.logger.warning("Dropped %d log messages because log handlers were too slow", self.dropped)
+        
+        self._listener.stop()
+        self._running = False
@@ -0,0 +1,274 @@
+'''
+Minimal Prometheus metrics, rendered in text exposition format.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import time
+import logging
+import threading
+import contextlib
+import http.server
+import socketserver
+
+REGISTRY = []
+
+class _Metric(object):
+    type = None
+    
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        super(_Metric, self).__init__()
+        
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        
+        if registry is not None:
+            registry.append(self)
+    
+    def _format_labels(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in pairs)
+    
+    def _get_samples(self):
+        """
+        Returns list of (suffix, label values, extra labels, value).
+        """
+        raise NotImplementedError()
+    
+    def render(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s %s" % (self.name, self.type),
+        ]
+        for suffix, values, extra, value in self._get_samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, self._format_labels(values, extra), _format_value(value)))
+        return "\n".join(lines)
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter(_Metric):
+    type = "counter"
+    
+    def __init__(self, *args, **kwargs):
+        super(Counter, self).__init__(*args, **kwargs)
+        # label values: count
+        self._values = {}
+        self._function = None
+    
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+    
+    def get(self, *label_values):
+        return self._values.get(label_values, 0)
+    
+    def set_function(self, function):
+        """
+        Reads value of unlabelled counter kept elsewhere on each scrape.
+        """
+        self._function = function
+    
+    def _get_samples(self):
+        if self._function is not None:
+            try:
+                return [("_total", (), (), self._function())]
+            except Exception:
+                return []
+        with self._lock:
+            return [("_total", values, (), value) for values, value in sorted(self._values.items())]
+
+class Gauge(_Metric):
+    """
+    Gauge holding set value or, when function is given, reading it on each scrape.
+    Labelled gauge needs function returning dict of label values tuple: value.
+    """
+    
+    type = "gauge"
+    
+    def __init__(self, *args, **kwargs):
+        super(Gauge, self).__init__(*args, **kwargs)
+        self._value = 0
+        self._function = None
+    
+    def set(self, value):
+        self._value = value
+    
+    def set_function(self, function):
+        self._function = function
+    
+    def get(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+    
+    @contextlib.contextmanager
+    def time(self):
+        """
+        Sets gauge to duration of given block.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.set(time.monotonic() - started)
+    
+    def _get_samples(self):
+        try:
+            value = self.get()
+        except Exception:
+            return []
+        if self.labels:
+            return [("", values, (), i) for values, i in sorted(value.items())]
+        return [("", (), (), value)]
+
+class Histogram(_Metric):
+    type = "histogram"
+    
+    default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    
+    def __init__(self, *args, buckets=None, **kwargs):
+        super(Histogram, self).__init__(*args, **kwargs)
+        
+        self.buckets = tuple(buckets or self.default_buckets) + (float("inf"),)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0
+        self._count = 0
+    
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            self._sum += value
+            self._count += 1
+    
+    @property
+    def count(self):
+        return self._count
+    
+    def _get_samples(self):
+        samples = []
+        with self._lock:
+            cumulative = 0
+            for bound, count in zip(self.buckets, self._counts):
+                cumulative += count
+                samples.append(("_bucket", (), (("le", _format_value(float(bound))),), cumulative))
+            samples.append(("_sum", (), (), self._sum))
+            samples.append(("_count", (), (), self._count))
+        return samples
+
+def render(registry=REGISTRY):
+    return "\n".join(i.render() for i in registry) + "\n"
+
+EVENTS = Counter("docker_hostdns_events", "Handled Docker network events.", labels=("action",))
+EVENTS_RECEIVED = Counter("docker_hostdns_events_received", "Received Docker events, including ones which were not handled.")
+EVENTS_HANDLED = Counter("docker_hostdns_events_handled", "Handled Docker connect and disconnect events.")
+EVENT_LATENCY = Histogram("docker_hostdns_event_latency_seconds", "Time from Docker event to its host update being applied.")
+QUEUE_LATENCY = Histogram("docker_hostdns_queue_latency_seconds", "Time updates waited in writer queue before being picked up.")
+DNS_UPDATES = Counter("docker_hostdns_dns_updates", "Sent DNS UPDATE messages by response code.", labels=("rcode",))
+DNS_UPDATE_LATENCY = Histogram("docker_hostdns_dns_update_seconds", "DNS UPDATE round-trip time.")
+HOSTS = Gauge("docker_hostdns_hosts", "Number of managed hosts.")
+PENDING = Gauge("docker_hostdns_pending_updates", "Number of host updates waiting to be written.")
+LOAD_CONTAINERS = Gauge("docker_hostdns_load_containers_seconds", "Duration of last listing of running containers.")
+LOG_DROPPED = Counter("docker_hostdns_log_dropped", "Log messages dropped because log handlers were too slow.")
+LOAD_RECORDS = Gauge("docker_hostdns_load_records_seconds", "Duration of last loading of ownership records.")
+DNS_SERVER_IN_SYNC = Gauge("docker_hostdns_dns_server_in_sync", "Whether DNS server of fan-out receives updates, 0 while it is resynced.", labels=("zone", "server"))
+DNS_SERVER_LAG = Gauge("docker_hostdns_dns_server_lag_seconds", "Time DNS server of fan-out is behind others.", labels=("zone", "server"))
+DNS_SERVER_FAILURES = Gauge("docker_hostdns_dns_server_failures", "Consecutive failures of DNS server of fan-out.", labels=("zone", "server"))
+
+# time of Docker event which caused updates made by current thread
+_event = threading.local()
+
+@contextlib.contextmanager
+def event_time(timestamp):
+    """
+    Marks host updates made by calling thread in given block as caused by Docker event of given unix time,
+    None marks them as not caused by any event.
+    """
+    previous = getattr(_event, "time", None)
+    _event.time = timestamp
+    try:
+        yield
+    finally:
+        _event.time = previous
+
+def get_event_time():
+    return getattr(_event, "time", None)
+
+def pass_event_time():
+    """
+    Returns event time of current block for updates passed to other thread,
+    which observes their latency, so it is not observed again in calling thread.
+    """
+    timestamp = get_event_time()
+    _event.time = None
+    return timestamp
+
+def observe_applied():
+    """
+    Observes latency of applied update from Docker event it was caused by,
+    called once by top-level caller after whole update was applied.
+    """
+    timestamp = get_event_time()
+    if timestamp is not None:
+        EVENT_LATENCY.observe(max(0, time.time() - timestamp))
+        _event.time = None
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        
+        body = render(self.server.registry).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format_, *args):
+        self.server.logger.debug(format_, *args)
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class MetricsServer(object):
+    """
+    Serves metrics on "/metrics" path from background thread.
+    """
+    
+    def __init__(self, port, address="127.0.0.1", registry=REGISTRY):
+        super(MetricsServer, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.address = address
+        self.port = port
+        self.registry = registry
+        
+        self._server = None
+    
+    def start(self):
+        self._server = _Server((self.address, self.port), _Handler)
+        self._server.registry = self.registry
+        self._server.logger = self.logger
+        self.port = self._server.server_address[1]
+        
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        self.logger.info("Serving metrics on %s:%d", self.address, self.port)
+    
+    def stop(self):
+        if self._server is None:
+            return
+        
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
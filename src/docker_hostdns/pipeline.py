@@ -0,0 +1,492 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import collections
+from docker_hostdns import metrics
+from docker_hostdns import tracing
+from docker_hostdns.exceptions import DnsException
+
+class Coalescer(object):
+    """
+    Collects host changes for a short window and reduces them to their net effect per host name.
+    Names which keep flapping are held down until they stay quiet.
+    """
+    
+    flap_threshold = 3
+    
+    def __init__(self, window, hold_down=0):
+        super(Coalescer, self).__init__()
+        
+        self.window = window
+        self.hold_down = hold_down
+        
+        # name: [existed, addresses, first_change_time]
+        self._pending = {}
+        # name: (is_removal, change_time)
+        self._last_change = {}
+        # name: (flap_count, last_flap_time)
+        self._flaps = {}
+    
+    def __len__(self):
+        return len(self._pending)
+    
+    def __contains__(self, name):
+        return name in self._pending
+    
+    def push(self, name, addresses, now):
+        """
+        Registers change for given name, addresses should be (ipv4s, ipv6s) tuple or None for removal.
+        """
+        is_removal = addresses is None
+        
+        if self.hold_down:
+            last = self._last_change.get(name)
+            if last is not None and last[0] != is_removal and now - last[1] < self.hold_down:
+                self._record_flap(name, now)
+            self._last_change[name] = (is_removal, now)
+        
+        entry = self._pending.get(name)
+        if entry is None:
+            # removal of a name means it was published before this window
+            self._pending[name] = [is_removal, addresses, now]
+        else:
+            entry[1] = addresses
+    
+    def _record_flap(self, name, now):
+        count, last = self._flaps.get(name, (0, now))
+        if now - last >= self.hold_down:
+            count = 0
+        self._flaps[name] = (count + 1, now)
+    
+    def _held_until(self, name):
+        count, last = self._flaps.get(name, (0, None))
+        if count >= self.flap_threshold:
+            return last + self.hold_down
+        return None
+    
+    def next_deadline(self):
+        """
+        Returns time at which some pending changes will be ready, None when nothing is pending.
+        """
+        deadline = None
+        for name, (_existed, _addresses, first) in self._pending.items():
+            ready = first + self.window
+            held = self._held_until(name)
+            if held is not None and held > ready:
+                ready = held
+            if deadline is None or ready < deadline:
+                deadline = ready
+        return deadline
+    
+    def pop(self, now, force=False, published=()):
+        """
+        Returns dict of net changes, in format accepted by ``apply_changes``, which are ready to be written.
+        Removal of a name from given published ones is always kept.
+        """
+        changes = {}
+        
+        for name, (existed, addresses, first) in list(self._pending.items()):
+            if not force:
+                if now < first + self.window:
+                    continue
+                held = self._held_until(name)
+                if held is not None and now < held:
+                    continue
+            
+            del self._pending[name]
+            
+            # host which was added and removed in same window was never published, unless it already was before
+            if addresses is None and not existed and name not in published:
+                continue
+            
+            changes[name] = addresses
+        
+        if changes and self.hold_down:
+            self._forget(now)
+        
+        return changes
+    
+    def _forget(self, now):
+        for name, (_is_removal, changed) in list(self._last_change.items()):
+            if now - changed >= self.hold_down and name not in self._pending:
+                del self._last_change[name]
+                self._flaps.pop(name, None)
+
+class RetryQueue(object):
+    """
+    Keeps host changes from failed DNS updates and hands them back with exponential backoff.
+    Newer changes for a pending name replace the old ones, names failing too many times are written to dead-letter file.
+    """
+    
+    def __init__(self, max_attempts=10, delay=1, max_delay=60, max_size=10000, dead_letter_path=None):
+        super(RetryQueue, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.dead_letter_path = dead_letter_path
+        
+        self.dead = 0
+        # names given up on, until they are written by later update
+        self.dead_names = set()
+        
+        # name: [addresses, attempts], oldest first
+        self._pending = collections.OrderedDict()
+        self._failures = 0
+        self._next_retry = None
+    
+    def __len__(self):
+        return len(self._pending)
+    
+    def get_delay(self):
+        """
+        Returns backoff delay for current number of consecutive failures, with "equal jitter" applied.
+        """
+        delay = min(self.max_delay, self.delay * 2 ** (self._failures - 1))
+        return random.uniform(delay / 2, delay)
+    
+    def push(self, changes, error, now):
+        """
+        Registers changes, in format accepted by ``apply_changes``, which failed to be written.
+        """
+        self._failures += 1
+        dead = []
+        
+        for name, addresses in changes.items():
+            entry = self._pending.pop(name, None)
+            attempts = 1 if entry is None else entry[1] + 1
+            
+            if attempts >= self.max_attempts:
+                dead.append((name, addresses, attempts))
+            else:
+                self._pending[name] = [addresses, attempts]
+        
+        while len(self._pending) > self.max_size:
+            name, (addresses, attempts) = self._pending.popitem(last=False)
+            dead.append((name, addresses, attempts))
+        
+        if dead:
+            self._write_dead(dead, error)
+        
+        self._next_retry = now + self.get_delay() if self._pending else None
+    
+    def discard(self, names):
+        """
+        Drops pending changes superseded by newer ones.
+        """
+        for name in names:
+            self._pending.pop(name, None)
+        
+        if not self._pending:
+            self._next_retry = None
+    
+    def succeeded(self, names=()):
+        """
+        Resets backoff after successful update, given up names which were written by it are forgotten.
+        """
+        self._failures = 0
+        self.dead_names.difference_update(names)
+    
+    def next_deadline(self):
+        return self._next_retry
+    
+    def pop(self, now, force=False):
+        """
+        Returns pending changes when retry is due.
+        """
+        if self._next_retry is None or (not force and now < self._next_retry):
+            return {}
+        
+        self._next_retry = None
+        return dict((name, addresses) for name, (addresses, _attempts) in self._pending.items())
+    
+    def clear(self, error):
+        """
+        Gives up on all pending changes.
+        """
+        dead = [(name, addresses, attempts) for name, (addresses, attempts) in self._pending.items()]
+        self._pending.clear()
+        self._next_retry = None
+        self._write_dead(dead, error)
+    
+    def _write_dead(self, dead, error):
+        self.dead_names.update(name for name, _addresses, _attempts in dead)
+        self.dead += len(dead)
+        self.logger.error("Giving up on updating %d hosts: %s", len(dead), error)
+        
+        if self.dead_letter_path is None:
+            return
+        
+        try:
+            with open(self.dead_letter_path, "at") as f:
+                for name, addresses, attempts in dead:
+                    f.write(json.dumps({
+                        "time": time.time(),
+                        "host": name,
+                        "addresses": addresses,
+                        "attempts": attempts,
+                        "error": str(error),
+                    }, separators=(",", ":")))
+                    f.write("\n")
+        except OSError as e:
+            self.logger.error("Could not write dead-letter file %r: %s", self.dead_letter_path, e)
+
+class UpdatePipeline(object):
+    """
+    Moves DNS writes off the Docker event reading thread.
+    Calls are put in bounded queue and executed in order by separate writer thread,
+    when queue is full producer is blocked until writer catches up.
+    When coalescer is given, added and removed hosts are merged into batched updates.
+    When retry queue is given, failed host updates are retried later instead of stopping the writer.
+    """
+    
+    def __init__(self, dns_updater, max_size=1000, coalescer=None, retry=None):
+        super(UpdatePipeline, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.dns_updater = dns_updater
+        self.coalescer = coalescer
+        self.retry = retry
+        self.queue = queue.Queue(maxsize=max_size)
+        self.error = None
+        self.processed = 0
+        
+        self._thread = None
+        self._current = None
+        self._saturated = False
+        # name: time of oldest event of its coalesced changes
+        self._event_times = {}
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="dns-writer", daemon=True)
+        self._thread.start()
+    
+    def close(self):
+        """
+        Waits for queued updates to be written and stops writer thread.
+        """
+        if self._thread is None:
+            return
+        
+        self.queue.put(None)
+        self._thread.join()
+        self._thread = None
+    
+    @property
+    def pending(self):
+        """
+        Number of queued and not yet written updates.
+        """
+        pending = self.queue.unfinished_tasks
+        if self.coalescer is not None:
+            pending += len(self.coalescer)
+        if self.retry is not None:
+            pending += len(self.retry)
+        return pending
+    
+    @property
+    def synced(self):
+        """
+        Whether all updates were written, none is waiting or was given up on.
+        """
+        if self.error is not None or self.pending:
+            return False
+        return self.retry is None or not self.retry.dead_names
+    
+    @property
+    def lag(self):
+        """
+        Age in seconds of oldest not yet written update.
+        """
+        oldest = self._current
+        if oldest is None:
+            with self.queue.mutex:
+                if self.queue.queue and self.queue.queue[0] is not None:
+                    oldest = self.queue.queue[0][0]
+        
+        return 0 if oldest is None else time.monotonic() - oldest
+    
+    def _put(self, method, *args):
+        if self.error is not None:
+            raise DnsException("DNS writer has stopped") from self.error
+        
+        item = (time.monotonic(), method, args, metrics.pass_event_time())
+        
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            if not self._saturated:
+                self._saturated = True
+                self.logger.warning("Update queue is full, DNS writer is %.1fs behind", self.lag)
+            self.queue.put(item)
+        else:
+            self._saturated = False
+    
+    def set_hosts(self, hosts):
+        self._put("set_hosts", hosts)
+    
+    def add_host(self, names, ipv4s=None, ipv6s=None):
+        self._put("add_host", names, ipv4s, ipv6s)
+    
+    def remove_host(self, hosts):
+        self._put("remove_host", hosts)
+    
+    def reconcile(self):
+        self._put("reconcile")
+    
+    def _get_changes(self, method, args):
+        """
+        Converts host update call to dict of changes, None is returned for other calls.
+        """
+        if method == "apply_changes":
+            return args[0]
+        
+        if method == "set_hosts":
+            changes = dict((name, None) for name in self.dns_updater.hosts)
+            changes.update(args[0])
+            return changes
+        
+        if method == "add_host":
+            names, ipv4s, ipv6s = args
+            addresses = (ipv4s, ipv6s)
+        elif method == "remove_host":
+            names = args[0]
+            addresses = None
+        else:
+            return None
+        
+        if isinstance(names, str):
+            names = [names]
+        
+        return dict((name, addresses) for name in names)
+    
+    def _execute(self, method, *args, retrying=False):
+        if self.error is not None:
+            return
+        
+        changes = None
+        if self.retry is not None:
+            changes = self._get_changes(method, args)
+            # new changes supersede pending ones, while retried ones keep their attempt counts
+            if changes is not None and not retrying:
+                self.retry.discard(changes.keys())
+        
+        try:
+            getattr(self.dns_updater, method)(*args)
+            self.processed += 1
+        except Exception as e:
+            self.logger.exception(e)
+            if self.retry is None:
+                # queue is still consumed so blocked producer can notice the error
+                self.error = e
+            elif changes is not None:
+                self.retry.push(changes, e, time.monotonic())
+        else:
+            metrics.observe_applied()
+            if self.retry is not None:
+                # full set of hosts replaces everything which was given up on
+                self.retry.succeeded(list(self.retry.dead_names) if method == "set_hosts" else changes or ())
+                if retrying:
+                    self.retry.discard(changes.keys())
+    
+    def _retry(self, force=False):
+        changes = self.retry.pop(time.monotonic(), force)
+        if changes:
+            self.logger.info("Retrying update of %d hosts", len(changes))
+            # latency of retried updates is not observed
+            with metrics.event_time(None):
+                self._execute("apply_changes", changes, retrying=True)
+    
+    def _pop_event_time(self):
+        """
+        Returns time of oldest event of changes which are no longer held by coalescer.
+        """
+        popped = [name for name in self._event_times.keys() if name not in self.coalescer]
+        times = [self._event_times.pop(name) for name in popped]
+        return min(times) if times else None
+    
+    def _flush(self, force=False):
+        if self.coalescer is not None:
+            changes = self.coalescer.pop(time.monotonic(), force, self.dns_updater.hosts)
+            event_time = self._pop_event_time()
+            if changes:
+                with metrics.event_time(event_time):
+                    self._execute("apply_changes", changes)
+        if self.retry is not None:
+            self._retry(force)
+    
+    def _coalesce(self, method, args, event_time):
+        now = time.monotonic()
+        
+        if method == "add_host":
+            names, ipv4s, ipv6s = args
+            addresses = (ipv4s, ipv6s)
+        else:
+            names = args[0]
+            addresses = None
+        
+        if isinstance(names, str):
+            names = [names]
+        
+        for name in names:
+            self.coalescer.push(name, addresses, now)
+            if event_time is not None and name not in self._event_times:
+                self._event_times[name] = event_time
+    
+    def _next_deadline(self):
+        deadlines = [
+            i.next_deadline() for i in (self.coalescer, self.retry) if i is not None
+        ]
+        deadlines = [i for i in deadlines if i is not None]
+        return min(deadlines) if deadlines else None
+    
+    def _get(self):
+        while True:
+            deadline = self._next_deadline()
+            if deadline is None:
+                return self.queue.get()
+            
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                self._flush()
+                continue
+            
+            try:
+                return self.queue.get(timeout=timeout)
+            except queue.Empty:
+                pass
+    
+    def _run(self):
+        while True:
+            item = self._get()
+            tracing.attach()
+            if item is None:
+                self._flush(True)
+                if self.retry is not None and len(self.retry):
+                    self.retry.clear("DNS writer was stopped")
+                self.queue.task_done()
+                return
+            
+            queued_at, method, args, event_time = item
+            self._current = queued_at
+            metrics.QUEUE_LATENCY.observe(time.monotonic() - queued_at)
+            try:
+                if self.coalescer is not None and method in ("add_host", "remove_host"):
+                    self._coalesce(method, args, event_time)
+                else:
+                    if self.coalescer is not None:
+                        self._flush(True)
+                    with metrics.event_time(event_time):
+                        self._execute(method, *args)
+            finally:
+                self._current = None
+                self.queue.task_done()
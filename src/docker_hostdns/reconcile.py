@@ -0,0 +1,46 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import random
+import logging
+import threading
+
+class Reconciler(object):
+    """
+    Periodically asks updater to compare zone contents with known state.
+    Interval is randomized by given jitter fraction so many instances do not transfer zone at once.
+    """
+    
+    def __init__(self, dns_updater, interval, jitter=0.1):
+        super(Reconciler, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.dns_updater = dns_updater
+        self.interval = interval
+        self.jitter = jitter
+        
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def get_delay(self):
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="reconciler", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        if self._thread is None:
+            return
+        
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+    
+    def _run(self):
+        while not self._stop.wait(self.get_delay()):
+            try:
+                self.dns_updater.reconcile()
+            except Exception as e:
+                self.logger.exception(e)
@@ -0,0 +1,201 @@
+'''
+Recording of Docker events seen by handlers and their replay.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import collections
+import docker.errors
+from docker_hostdns.hostdns import NamedUpdater, DockerHandler
+from docker_hostdns import console
+from docker_hostdns.fakes.dnsserver import DnsServer
+
+RecordedContainer = collections.namedtuple("RecordedContainer", ["attrs"])
+
+class Recorder(object):
+    """
+    Appends events and inspect data of containers to file, one compact JSON object per line:
+    ``{"time": <unix time>, "event": <event>}`` or ``{"time": <unix time>, "inspect": <container id>, "attrs": <inspect data or null>}``.
+    Can be shared by handlers running in many threads.
+    """
+    
+    def __init__(self, path):
+        super(Recorder, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+    
+    def open(self):
+        self._file = open(self.path, "at")
+        self.logger.info("Recording events to %r", self.path)
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+    
+    def _write(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+    
+    def record_event(self, event):
+        self._write({"time": time.time(), "event": event})
+    
+    def record_inspect(self, container_id, attrs):
+        self._write({"time": time.time(), "inspect": container_id, "attrs": attrs})
+
+class ReplayHandler(DockerHandler):
+    """
+    Feeds recorded events through handle_event, containers are inspected from recorded data.
+    Speed scales delays between recorded events, 0 replays them as fast as possible.
+    """
+    
+    def __init__(self, dns_updater, path, speed=1):
+        super(ReplayHandler, self).__init__(dns_updater)
+        
+        self.path = path
+        self.speed = speed
+        # container id: inspect data
+        self._inspects = {}
+    
+    def setup(self, networks=None, state=None):
+        self.networks = ("bridge",) if not networks else tuple(networks)
+        self._register([])
+    
+    def _get_container(self, container_id):
+        attrs = self._inspects.get(container_id)
+        if attrs is None:
+            raise docker.errors.NotFound("No recorded inspect data of container %r" % container_id)
+        return RecordedContainer(attrs)
+    
+    def _read(self):
+        """
+        Yields (time, event, inspects) tuples, inspects is a dict of container id: inspect data recorded after the event.
+        """
+        current = None
+        
+        with open(self.path, "rt") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    self.logger.warning("Skipping broken record at line %d", number)
+                    continue
+                
+                if "event" in record:
+                    if current is not None:
+                        yield current
+                    current = (record["time"], record["event"], {})
+                elif current is not None:
+                    current[2][record["inspect"]] = record["attrs"]
+        
+        if current is not None:
+            yield current
+    
+    def run(self):
+        started = time.monotonic()
+        first = None
+        skipped = 0
+        
+        for recorded_at, event, inspects in self._read():
+            if self.speed:
+                if first is None:
+                    first = recorded_at
+                delay = (recorded_at - first) / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            
+            self._inspects.update(inspects)
+            
+            if self._is_replayed(event):
+                continue
+            
+            try:
+                self.handle_event(event)
+            except docker.errors.NotFound as e:
+                self.logger.debug("Skipping event: %s", e)
+                skipped += 1
+            
+            if "timeNano" in event:
+                self.last_event_time = event["timeNano"]
+        
+        elapsed = time.monotonic() - started
+        
+        return {
+            "events": self.events_received,
+            "handled": self.events_handled,
+            "skipped": skipped,
+            "seconds": elapsed,
+            "events_per_second": self.events_received / elapsed if elapsed else None,
+        }
+
+def parse_commandline(argv):
+    p = argparse.ArgumentParser(
+        prog="docker-hostdns-replay" if argv[0].endswith(".py") else os.path.basename(argv[0]),
+        description="Replay Docker events recorded with --record-file."
+    )
+    p.add_argument('path', help="recorded events file")
+    p.add_argument('--speed', default=1, type=float, metavar="FACTOR", help="multiplier of original speed, 0 replays events as fast as possible, defaults to 1")
+    p.add_argument('--zone', default="docker", help="dns zone to update, defaults to \"docker\"")
+    p.add_argument('--dns-server', default=None, type=console.DnsServerArguments, help="DNS server to update, in format: [dns://][<key name>:<key secret>@]<host>[:<port>][?alg=<key algorithm>], in-process stub server is used when not given")
+    p.add_argument('--name', default="replay", help="instance name, defaults to \"replay\"")
+    p.add_argument('--network', '-n', action="append", help="network to watch, defaults to \"bridge\", can be used multiple times")
+    p.add_argument('--verbose', '-v', action='count', default=0)
+    
+    return p.parse_args(args=argv[1:])
+
+def execute(argv=None):
+    if argv is None:
+        argv = sys.argv
+    conf = parse_commandline(argv)
+    
+    levels = [
+        logging.ERROR,
+        logging.WARNING,
+        logging.INFO,
+        logging.DEBUG
+    ]
+    logging.basicConfig(level=levels[min(conf.verbose, len(levels)-1)])
+    
+    dns_server = None
+    if conf.dns_server is None:
+        dns_server = DnsServer(conf.zone)
+        dns_server.start()
+        server_args = {"dns_server": "127.0.0.1", "dns_port": dns_server.port}
+    else:
+        server_args = conf.dns_server.get_args(None, None)
+    
+    try:
+        dns_updater = NamedUpdater(conf.zone, instance_name=conf.name, **server_args)
+        dns_updater.setup()
+        
+        handler = ReplayHandler(dns_updater, conf.path, conf.speed)
+        handler.setup(conf.network)
+        results = handler.run()
+        
+        dns_updater.close()
+        
+        if dns_server is not None:
+            results["updates"] = dns_server.zone.updates
+    finally:
+        if dns_server is not None:
+            dns_server.stop()
+    
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    execute()
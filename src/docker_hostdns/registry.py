@@ -0,0 +1,121 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import logging
+
+class HostRegistry(object):
+    """
+    Keeps track of host names used by containers.
+    Name already used by other container gets "-<number>" suffix appended.
+    """
+    
+    def __init__(self):
+        super(HostRegistry, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        # container id: tuple of names
+        self._names = {}
+        # name: container id
+        self._owners = {}
+        # base name: last used suffix number
+        self._suffixes = {}
+        # suffixed name: (base name, suffix number)
+        self._suffixed = {}
+        # container id: main name
+        self._primaries = {}
+        # main names of all containers, read by DNS updater from its own thread
+        self.primary_names = set()
+    
+    def __contains__(self, container_id):
+        return container_id in self._names
+    
+    def __len__(self):
+        return len(self._names)
+    
+    def get(self, container_id):
+        return self._names.get(container_id)
+    
+    def get_primary(self, container_id):
+        return self._primaries.get(container_id)
+    
+    def owner(self, name):
+        return self._owners.get(name)
+    
+    def items(self):
+        return self._names.items()
+    
+    def _get_unique_name(self, name):
+        if name not in self._owners:
+            return name
+        
+        number = self._suffixes.get(name, 0)
+        while True:
+            number += 1
+            unique_name = "%s-%d" % (name, number)
+            if unique_name not in self._owners:
+                break
+        
+        self._suffixes[name] = number
+        self._suffixed[unique_name] = (name, number)
+        self.logger.warning("Renaming duplicated host %r to %r", name, unique_name)
+        
+        return unique_name
+    
+    def add(self, container_id, names, primary=None):
+        """
+        Registers names for given container and returns them after deduplication.
+        Primary is the main name of container, one of given names.
+        """
+        # main name is kept listed while container is registered again, so it is not missing for other threads
+        previous_primary = self._primaries.pop(container_id, None)
+        
+        if container_id in self._names:
+            self.remove(container_id)
+        
+        unique_names = []
+        unique_primary = None
+        for name in sorted(names):
+            unique_name = self._get_unique_name(name)
+            self._owners[unique_name] = container_id
+            unique_names.append(unique_name)
+            if name == primary:
+                unique_primary = unique_name
+        
+        unique_names = tuple(unique_names)
+        self._names[container_id] = unique_names
+        
+        if previous_primary is not None and previous_primary != unique_primary:
+            self.primary_names.discard(previous_primary)
+        if unique_primary is not None:
+            self._primaries[container_id] = unique_primary
+            self.primary_names.add(unique_primary)
+        
+        return unique_names
+    
+    def remove(self, container_id):
+        """
+        Unregisters container and returns its names, None is returned for unknown containers.
+        """
+        names = self._names.pop(container_id, None)
+        if names is None:
+            return None
+        
+        primary = self._primaries.pop(container_id, None)
+        if primary is not None:
+            self.primary_names.discard(primary)
+        
+        for name in names:
+            del self._owners[name]
+            
+            suffixed = self._suffixed.pop(name, None)
+            if suffixed is not None:
+                # let freed number to be used again
+                base, number = suffixed
+                if number <= self._suffixes.get(base, 0):
+                    if number > 1:
+                        self._suffixes[base] = number - 1
+                    else:
+                        del self._suffixes[base]
+        
+        return names
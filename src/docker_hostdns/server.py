@@ -0,0 +1,276 @@
+'''
+Built-in authoritative DNS server answering from known hosts, used in place of updating external server.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import time
+import struct
+import logging
+import threading
+import socketserver
+import dns.name
+import dns.flags
+import dns.rcode
+import dns.rrset
+import dns.opcode
+import dns.message
+import dns.rdataclass
+import dns.rdatatype
+import dns.exception
+import dns.rdtypes.ANY.SOA
+from docker_hostdns.backends import Backend
+
+class _TcpHandler(socketserver.BaseRequestHandler):
+    def _read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+    
+    def handle(self):
+        try:
+            while True:
+                (size,) = struct.unpack("!H", self._read(2))
+                wire = self.server.zone_server.handle(self._read(size))
+                if wire is not None:
+                    self.request.sendall(struct.pack("!H", len(wire)) + wire)
+        except (EOFError, ConnectionError):
+            pass
+
+class _UdpHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        wire = self.server.zone_server.handle(data, udp=True)
+        if wire is not None:
+            sock.sendto(wire, self.client_address)
+
+class _TcpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _UdpServer(socketserver.UDPServer):
+    # cached answers are cheap, so datagrams are handled in single thread
+    allow_reuse_address = True
+
+class ZoneServer(Backend):
+    """
+    Serves A and AAAA records of hosts, and wildcards below them, over UDP and TCP.
+    Accepts the same calls as NamedUpdater, so changes are visible right after they are made.
+    Responses are cached in wire format per question and dropped when host they depend on changes.
+    """
+    
+    ttl = 1
+    max_cache_size = 10000
+    
+    _header = struct.Struct("!HHHHHH")
+    
+    def __init__(self, zone, address="127.0.0.1", port=53):
+        super(ZoneServer, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.zone = zone
+        self.address = address
+        self.port = port
+        
+        self._origin = dns.name.from_text(zone)
+        # lowercased hostname: (hostname, ipv4s, ipv6s)
+        self.records = {}
+        self.serial = int(time.time())
+        
+        # question wire: (bucket, response wire)
+        self._cache = {}
+        # bucket: set of question wires
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._servers = []
+    
+    @property
+    def hosts(self):
+        return set(i[0] for i in self.records.values())
+    
+    def start(self):
+        tcp = _TcpServer((self.address, self.port), _TcpHandler)
+        # use port picked for TCP when random one was requested
+        udp = _UdpServer((self.address, tcp.server_address[1]), _UdpHandler)
+        self.port = tcp.server_address[1]
+        
+        self._servers = [tcp, udp]
+        for server in self._servers:
+            server.zone_server = self
+            threading.Thread(target=server.serve_forever, name="dns-server", daemon=True).start()
+        
+        self.logger.info("Serving zone %r on %s:%d", self.zone, self.address, self.port)
+    
+    def close(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+    
+    def _get_bucket(self, host):
+        """
+        Returns name of cache bucket, answers for any name depend only on hosts from its bucket.
+        """
+        return host.rsplit(".", 1)[-1]
+    
+    def _invalidate(self, hosts):
+        for bucket in set(self._get_bucket(i) for i in hosts).union([""]):
+            for key in self._buckets.pop(bucket, ()):
+                self._cache.pop(key, None)
+    
+    def apply_changes(self, changes):
+        """
+        Applies dict of hostname: (ipv4s, ipv6s), None removes host.
+        """
+        with self._lock:
+            for host, addresses in changes.items():
+                if addresses is None:
+                    self.records.pop(host.lower(), None)
+                else:
+                    ipv4s, ipv6s = addresses
+                    self.records[host.lower()] = (host, list(ipv4s or []), list(ipv6s or []))
+            
+            self.serial += 1
+            self._invalidate(i.lower() for i in changes.keys())
+    
+    def get_serial(self):
+        return self.serial
+    
+    def _get_question(self, wire):
+        """
+        Returns cache key made of question section of plain query and presence of additional records, None for other messages.
+        """
+        try:
+            _id, flags, qdcount, ancount, nscount, arcount = self._header.unpack_from(wire)
+        except struct.error:
+            return None
+        
+        if flags & 0xF800 or qdcount != 1 or ancount or nscount:
+            # response or not QUERY opcode
+            return None
+        
+        end = 12
+        while end < len(wire) and wire[end]:
+            if wire[end] & 0xC0:
+                return None
+            end += wire[end] + 1
+        
+        end += 5
+        if end > len(wire):
+            return None
+        # case is kept, as it is echoed in response
+        return wire[12:end] + (b"+" if arcount else b"")
+    
+    def _get_soa(self):
+        rrset = dns.rrset.RRset(self._origin, dns.rdataclass.IN, dns.rdatatype.SOA)
+        rrset.add(dns.rdtypes.ANY.SOA.SOA(
+            dns.rdataclass.IN, dns.rdatatype.SOA,
+            dns.name.from_text("ns", self._origin), dns.name.from_text("hostmaster", self._origin),
+            self.serial, 3600, 600, 86400, self.ttl
+        ), self.ttl)
+        return rrset
+    
+    def _find_host(self, labels):
+        """
+        Returns record of host with given name or closest one covering it with wildcard.
+        """
+        for i in range(len(labels)):
+            record = self.records.get(".".join(labels[i:]))
+            if record is not None:
+                return record
+        return None
+    
+    def _resolve(self, q):
+        """
+        Returns response to given query and name of cache bucket, bucket is None when response should not be cached.
+        """
+        r = dns.message.make_response(q)
+        r.flags |= dns.flags.AA
+        
+        if q.opcode() != dns.opcode.QUERY:
+            r.set_rcode(dns.rcode.NOTIMP)
+            return r, None
+        
+        if len(q.question) != 1:
+            r.set_rcode(dns.rcode.FORMERR)
+            return r, None
+        
+        question = q.question[0]
+        if question.rdclass != dns.rdataclass.IN or not question.name.is_subdomain(self._origin):
+            r.set_rcode(dns.rcode.REFUSED)
+            return r, None
+        
+        labels = [i.decode("ascii", "replace").lower() for i in question.name.relativize(self._origin).labels]
+        
+        if not labels:
+            if question.rdtype in (dns.rdatatype.SOA, dns.rdatatype.ANY):
+                r.answer.append(self._get_soa())
+            else:
+                r.authority.append(self._get_soa())
+            return r, ""
+        
+        record = self._find_host(labels)
+        if record is None:
+            r.set_rcode(dns.rcode.NXDOMAIN)
+            r.authority.append(self._get_soa())
+            return r, labels[-1]
+        
+        _host, ipv4s, ipv6s = record
+        for rdtype, addresses in ((dns.rdatatype.A, ipv4s), (dns.rdatatype.AAAA, ipv6s)):
+            if addresses and question.rdtype in (rdtype, dns.rdatatype.ANY):
+                r.answer.append(dns.rrset.from_text_list(question.name, self.ttl, dns.rdataclass.IN, rdtype, addresses))
+        
+        if not r.answer:
+            r.authority.append(self._get_soa())
+        
+        return r, labels[-1]
+    
+    def _patch(self, query, response):
+        """
+        Copies id and RD flag of query to cached response.
+        """
+        return query[:2] + bytes((response[2] | (query[2] & 0x01), response[3])) + response[4:]
+    
+    def _truncate(self, q):
+        r = dns.message.make_response(q)
+        r.flags |= dns.flags.AA | dns.flags.TC
+        return r.to_wire()
+    
+    def handle(self, wire, udp=False):
+        """
+        Returns wire response to given query, None when query could not be parsed.
+        """
+        key = self._get_question(wire)
+        cached = None if key is None else self._cache.get(key)
+        
+        q = None
+        if cached is not None:
+            response = self._patch(wire, cached[1])
+        else:
+            try:
+                q = dns.message.from_wire(wire)
+            except dns.exception.DNSException:
+                return None
+            
+            with self._lock:
+                r, bucket = self._resolve(q)
+                response = r.to_wire()
+                
+                if key is not None and bucket is not None:
+                    if len(self._cache) >= self.max_cache_size:
+                        self._cache.clear()
+                        self._buckets.clear()
+                    self._cache[key] = (bucket, response)
+                    self._buckets.setdefault(bucket, set()).add(key)
+        
+        if udp and len(response) > 512:
+            if q is None:
+                q = dns.message.from_wire(wire)
+            if q.edns < 0 or len(response) > q.payload:
+                return self._truncate(q)
+        
+        return response
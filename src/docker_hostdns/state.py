@@ -0,0 +1,103 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import os
+import json
+import time
+import logging
+import tempfile
+
+class StateFile(object):
+    """
+    Snapshot of known containers and last seen Docker event, used to skip full reconciliation on restart.
+    """
+    
+    version = 1
+    
+    def __init__(self, path, interval=60, identity=None, is_synced=None):
+        """
+        Identity is a dict of configuration values which must be same when loading snapshot.
+        Is_synced is a callable telling whether all host updates were written, snapshot is not saved otherwise
+        as unwritten hosts would be restored as published.
+        """
+        super(StateFile, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.path = path
+        self.interval = interval
+        self.identity = identity or {}
+        self.is_synced = is_synced
+        
+        self._last_saved = time.monotonic()
+    
+    def load(self):
+        """
+        Returns saved state or None when there is no usable snapshot.
+        """
+        try:
+            with open(self.path, "rt") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            self.logger.warning("Ignoring broken state file %r: %s", self.path, e)
+            return None
+        
+        if state.get("version") != self.version:
+            self.logger.warning("Ignoring state file %r with unsupported version", self.path)
+            return None
+        
+        if state.get("identity") != self.identity:
+            self.logger.warning("Ignoring state file %r saved with different configuration", self.path)
+            return None
+        
+        return state
+    
+    @staticmethod
+    def get_hosts(state):
+        """
+        Returns dict of hostname: (ipv4s, ipv6s) from saved state.
+        """
+        hosts = {}
+        for names, ipv4s, ipv6s in state["containers"].values():
+            for name in names:
+                hosts[name] = (ipv4s, ipv6s)
+        return hosts
+    
+    def is_due(self):
+        return time.monotonic() - self._last_saved >= self.interval
+    
+    def save(self, state):
+        """
+        Atomically replaces snapshot with given state, returns False when it was skipped.
+        Given state should be taken before calling, so updates it contains are already queued when checking if they were written.
+        """
+        if self.is_synced is not None and not self.is_synced():
+            # previous snapshot is kept, it was consistent with DNS and changes made since then are found when resuming
+            self._last_saved = time.monotonic()
+            self.logger.debug("Not saving state, some host updates are not written")
+            return False
+        
+        state = dict(state, version=self.version, identity=self.identity, time=time.time())
+        
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix=".hostdns-state-")
+        try:
+            with os.fdopen(fd, "wt") as f:
+                json.dump(state, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        
+        self._last_saved = time.monotonic()
+        self.logger.debug("State saved to %r", self.path)
+        return True
+    
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
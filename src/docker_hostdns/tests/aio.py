@@ -0,0 +1,95 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import os
+import signal
+import asyncio
+import tempfile
+import threading
+import unittest.mock
+from docker_hostdns.aio import DockerApi, AsyncEngine
+from docker_hostdns.fakes.dockerserver import DockerServer
+
+class AsyncEngineTest(unittest.TestCase):
+    
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.url = "unix://%s/docker.sock" % tmp_dir.name
+    
+    def start_server(self, **kwargs):
+        server = DockerServer(self.url[len("unix://"):], **kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+    
+    def test_api(self):
+        server = self.start_server()
+        server.add_container("id1", "web", {"bridge": ("10.0.0.1", None)})
+        server.add_event("connect", "id1", "bridge", 1000000001)
+        server.add_event("disconnect", "id1", "bridge", 2000000001)
+        
+        api = DockerApi(self.url)
+        
+        async def run():
+            ping = await api.get("/_ping")
+            missing = await api.get("/containers/other/json")
+            inspected = await api.get("/containers/id1/json")
+            events = [i async for i in api.stream("/events")]
+            return ping, missing, inspected, events
+        
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        ping, missing, inspected, events = loop.run_until_complete(run())
+        
+        self.assertEqual(ping, "OK")
+        self.assertIsNone(missing)
+        self.assertEqual(inspected["Name"], "/web")
+        self.assertEqual([i["Action"] for i in events], ["connect", "disconnect"], "chunked stream is decoded")
+    
+    def test_run(self):
+        server = self.start_server()
+        server.add_container("id1", "web", {"bridge": ("10.0.0.1", None)})
+        server.add_container("id2", "db", {"bridge": ("10.0.0.2", None), "other": ("10.1.0.2", None)})
+        
+        updater = unittest.mock.Mock()
+        engine = AsyncEngine(updater, [self.url])
+        engine.reconnect_max_delay = 0
+        engine.setup()
+        
+        server.add_container("id3", "cache", {"bridge": ("10.0.0.3", None)})
+        server.add_event("connect", "id3", "bridge", 1000000001)
+        server.add_event("disconnect", "id1", "bridge", 2000000001)
+        server.add_event("connect", "id2", "other", 3000000001)
+        
+        engine.run()
+        
+        updater.set_hosts.assert_called_once_with({
+            "web": (["10.0.0.1"], []),
+            "id1": (["10.0.0.1"], []),
+            "db": (["10.0.0.2"], []),
+            "id2": (["10.0.0.2"], []),
+            "cache": (["10.0.0.3"], []),
+            "id3": (["10.0.0.3"], []),
+        })
+        updater.add_host.assert_called_once_with(("cache", "id3"), ["10.0.0.3"], [])
+        updater.remove_host.assert_called_once_with(("id1", "web"))
+        self.assertEqual(engine.get_state()["last_event_time"], 3000000001)
+        self.assertEqual(server.requests.count("/containers/id3/json"), 2, "containers are inspected on start and on connect")
+    
+    def test_stop_on_signal(self):
+        server = self.start_server(hold_events=True)
+        
+        updater = unittest.mock.Mock()
+        engine = AsyncEngine(updater, [self.url])
+        engine.setup()
+        
+        timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+        timer.start()
+        
+        previous = signal.getsignal(signal.SIGTERM)
+        engine.run()
+        
+        self.assertIs(signal.getsignal(signal.SIGTERM), previous, "signal handlers are restored")
+        updater.set_hosts.assert_called_once_with({})
+        self.assertIn("/events", server.requests)
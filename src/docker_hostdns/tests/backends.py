@@ -0,0 +1,87 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import os
+import signal
+import tempfile
+import unittest.mock
+import dns.zone
+import dns.rdatatype
+from docker_hostdns.backends import HostsFileBackend, ZoneFileBackend, DnsmasqBackend
+
+class FileBackendTest(unittest.TestCase):
+    
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.path = os.path.join(tmp_dir.name, "hosts")
+    
+    def read(self):
+        with open(self.path, "rt") as f:
+            return f.read()
+    
+    def test_hosts_file(self):
+        b = HostsFileBackend("docker", self.path)
+        b.setup()
+        self.assertEqual(self.read().splitlines()[1:], [], "file is created on setup")
+        
+        b.add_host(["web", "id1"], ["10.0.0.1"], ["fe80::1"])
+        b.add_host("db", ["10.0.0.2"])
+        b.remove_host("id1")
+        
+        self.assertEqual(self.read().splitlines()[1:], [
+            "10.0.0.2\tdb.docker",
+            "10.0.0.1\tweb.docker",
+            "fe80::1\tweb.docker",
+        ])
+        self.assertEqual(os.listdir(self.tmp_dir), ["hosts"], "temporary files are not left")
+        
+        b.set_hosts({"db": (["10.0.0.2"], [])})
+        self.assertEqual(b.hosts, {"db"})
+        
+        with unittest.mock.patch.object(b, "flush") as flush:
+            b.add_host("db", ["10.0.0.2"], [])
+            b.remove_host("other")
+            flush.assert_not_called()
+    
+    def test_failed_write(self):
+        b = HostsFileBackend("docker", self.path)
+        b.setup()
+        
+        with unittest.mock.patch.object(b, "render", side_effect=OSError("No space left on device")):
+            self.assertRaises(OSError, b.add_host, "web", ["10.0.0.1"])
+        self.assertEqual(b.hosts, set(), "unwritten changes are not kept")
+        
+        b.add_host("web", ["10.0.0.1"])
+        self.assertEqual(self.read().splitlines()[1:], ["10.0.0.1\tweb.docker"], "retried changes are written")
+    
+    def test_zone_file(self):
+        b = ZoneFileBackend("docker", self.path)
+        b.restore({"web": (["10.0.0.1"], ["fe80::1"])})
+        serial = b.serial
+        
+        zone = dns.zone.from_text(self.read(), "docker.", relativize=False)
+        self.assertEqual(zone.find_rdataset("*.web.docker.", dns.rdatatype.A)[0].to_text(), "10.0.0.1")
+        self.assertEqual(zone.find_rdataset("web.docker.", dns.rdatatype.AAAA)[0].to_text(), "fe80::1")
+        self.assertEqual(zone.find_rdataset("docker.", dns.rdatatype.SOA)[0].serial, serial)
+        
+        b.remove_host("web")
+        self.assertGreater(b.serial, serial)
+        self.assertNotIn("web", self.read())
+    
+    def test_dnsmasq(self):
+        pid_file = os.path.join(self.tmp_dir, "dnsmasq.pid")
+        with open(pid_file, "wt") as f:
+            f.write("1234\n")
+        
+        b = DnsmasqBackend("docker", self.path, pid_file)
+        with unittest.mock.patch("os.kill") as kill:
+            b.add_host("web", ["10.0.0.1"])
+        
+        kill.assert_called_once_with(1234, signal.SIGHUP)
+        self.assertIn("10.0.0.1\tweb.docker", self.read())
+        
+        os.unlink(pid_file)
+        with self.assertLogs("DnsmasqBackend", "WARNING"):
+            b.remove_host("web")
@@ -0,0 +1,36 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import unittest
+from docker_hostdns.benchmark import Benchmark, percentile
+
+class BenchmarkTest(unittest.TestCase):
+    
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 99), 3)
+        self.assertIsNone(percentile([], 50))
+    
+    def test_run(self):
+        results = Benchmark(containers=5, rounds=2, dns_delay=0.001).run()
+        scenarios = results["scenarios"]
+        
+        self.assertEqual(sorted(scenarios.keys()), sorted(Benchmark.scenarios))
+        self.assertEqual(scenarios["cold_start"]["containers"], 5)
+        self.assertEqual(scenarios["burst"]["events"], 5)
+        self.assertEqual(scenarios["burst"]["dns_updates"], 5, "each connect event is written with single update")
+        self.assertEqual(scenarios["flapping"]["events"], 4)
+        
+        for name in ("burst", "flapping", "slow_dns"):
+            self.assertGreater(scenarios[name]["events_per_second"], 0)
+            self.assertLessEqual(scenarios[name]["latency_p50"], scenarios[name]["latency_p99"])
+    
+    def test_file_backend(self):
+        results = Benchmark(containers=5, rounds=1, backend="zone").run(["cold_start", "flapping"])
+        scenarios = results["scenarios"]
+        
+        self.assertEqual(results["backend"], "zone")
+        self.assertEqual(scenarios["cold_start"]["dns_updates"], 0)
+        self.assertEqual(scenarios["flapping"]["writes"], 2)
@@ -0,0 +1,80 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import unittest.mock
+import socketserver
+import threading
+import struct
+import dns.message
+import dns.rcode
+from docker_hostdns.connection import DnsConnection
+
+class _Handler(socketserver.BaseRequestHandler):
+    def _read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+    
+    def handle(self):
+        self.server.connections += 1
+        served = 0
+        try:
+            while served < self.server.messages_per_connection:
+                (size,) = struct.unpack("!H", self._read(2))
+                query = dns.message.from_wire(self._read(size))
+                wire = dns.message.make_response(query).to_wire()
+                self.request.sendall(struct.pack("!H", len(wire)) + wire)
+                served += 1
+        except EOFError:
+            pass
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    connections = 0
+    messages_per_connection = 100
+
+class DnsConnectionTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        
+        self.connection = DnsConnection("127.0.0.1", port=self.server.server_address[1])
+    
+    def tearDown(self):
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def query(self):
+        r = self.connection.query(dns.message.make_query("example.docker", "A"))
+        self.assertEqual(r.rcode(), dns.rcode.NOERROR)
+    
+    def test_reuse(self):
+        for _i in range(5):
+            self.query()
+        
+        self.assertEqual(self.connection.opened, 1)
+        self.assertEqual(self.connection.reused, 4)
+        self.assertEqual(self.server.connections, 1)
+    
+    def test_reconnect_when_closed_by_server(self):
+        self.server.messages_per_connection = 2
+        
+        for _i in range(5):
+            self.query()
+        
+        self.assertEqual(self.connection.opened, 3)
+    
+    def test_reconnect_when_idle(self):
+        self.query()
+        with unittest.mock.patch.object(DnsConnection, "_is_idle", return_value=True):
+            self.query()
+        
+        self.assertEqual(self.connection.opened, 2)
+        self.assertEqual(self.connection.reused, 0)
@@ -30,3 +30,39 @@ class ConsoleTest(unittest.TestCase):
         self.assertEqual(o.syslog.socket, socket.SOCK_STREAM)
         self.assertEqual(o.syslog.hostname, self.test_host)
         self.assertEqual(o.syslog.port, 1234)
+    
+    def test_queue_size(self):
+        o = console.parse_commandline(["prog"])
+        self.assertEqual(o.queue_size, 1000)
+        
+        o = console.parse_commandline(["prog", "--queue-size", "0"])
+        self.assertEqual(o.queue_size, 0, "background writer can be disabled")
+    
+    def test_dns_server_argument_parsing(self):
+        o = console.parse_commandline(["prog"])
+        self.assertIsNone(o.dns_server)
+        
+        o = console.parse_commandline(["prog", "--dns-server", self.test_host, "--dns-server", "dns://name:c2VjcmV0@%s:5353?alg=hmac_sha256" % self.test_host])
+        plain, keyed = o.dns_server
+        
+        self.assertEqual(plain.get_args({"global": "key"}, "hmac_md5"), {
+            "dns_server": self.test_host,
+            "dns_port": 53,
+            "keyring": {"global": "key"},
+            "keyalgorithm": "hmac_md5",
+        }, "server without own key uses global one")
+        self.assertEqual(keyed.get_args({"global": "key"}, "hmac_md5"), {
+            "dns_server": self.test_host,
+            "dns_port": 5353,
+            "keyring": {"name": "c2VjcmV0"},
+            "keyalgorithm": "hmac_sha256",
+        })
+        
+        self.assertRaises(SystemExit, console.parse_commandline, ["prog", "--dns-server", "tcp://%s" % self.test_host])
+    
+    def test_dns_listen_argument_parsing(self):
+        o = console.parse_commandline(["prog", "--dns-listen", "0.0.0.0"])
+        self.assertEqual((o.dns_listen.hostname, o.dns_listen.port), ("0.0.0.0", 53))
+        
+        o = console.parse_commandline(["prog", "--dns-listen", "[::1]:5353"])
+        self.assertEqual((o.dns_listen.hostname, o.dns_listen.port), ("::1", 5353))
@@ -0,0 +1,115 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import threading
+import unittest.mock
+from docker_hostdns.hostdns import ContainerInfo
+from docker_hostdns.endpoints import MultiDockerHandler
+from docker_hostdns.exceptions import StopException
+
+class MultiDockerHandlerTest(unittest.TestCase):
+    
+    endpoints = ["unix:///run/a.sock", "tcp://b:2375"]
+    
+    def setUp(self):
+        self.clients = {}
+        for endpoint in self.endpoints:
+            self.clients[endpoint] = unittest.mock.MagicMock()
+        
+        p_client = unittest.mock.patch("docker.DockerClient", side_effect=lambda base_url, tls: self.clients[base_url])
+        p_client.start()
+        self.addCleanup(p_client.stop)
+        
+        p_info = unittest.mock.patch.object(ContainerInfo, "from_container", side_effect=lambda c, networks: c)
+        p_info.start()
+        self.addCleanup(p_info.stop)
+        
+        self.updater = unittest.mock.MagicMock()
+        self.d = MultiDockerHandler(self.updater, self.endpoints)
+    
+    def test_setup(self):
+        self.clients["unix:///run/a.sock"].containers.list.return_value = [
+            ContainerInfo(id="id1", names=["web"], ipv4s=["ipv4.1"], ipv6s=[]),
+        ]
+        self.clients["tcp://b:2375"].containers.list.return_value = [
+            ContainerInfo(id="id1", names=["web"], ipv4s=["ipv4.2"], ipv6s=[]),
+            ContainerInfo(id="id2", names=["db"], ipv4s=["ipv4.3"], ipv6s=[]),
+        ]
+        
+        self.d.setup()
+        
+        self.updater.set_hosts.assert_called_once()
+        hosts = self.updater.set_hosts.call_args[0][0]
+        self.assertEqual(sorted(hosts.keys()), ["db", "web", "web-1"], "names are unique across daemons")
+        self.assertEqual(sorted(hosts[i][0][0] for i in ("web", "web-1")), ["ipv4.1", "ipv4.2"])
+        
+        state = self.d.get_state()
+        self.assertEqual(sorted(state["containers"].keys()), ["tcp://b:2375/id1", "tcp://b:2375/id2", "unix:///run/a.sock/id1"])
+        
+        b = self.d.handlers[1]
+        b.on_disconnect("id1")
+        self.assertEqual(len(self.d.registry), 2, "only container of given daemon is removed")
+        self.assertEqual(self.d.handlers[0].addresses, {"id1": (["ipv4.1"], [])})
+    
+    def test_resume(self):
+        self.clients["unix:///run/a.sock"].api.containers.return_value = []
+        self.clients["tcp://b:2375"].api.containers.return_value = [
+            {"Id": "id2", "Names": ["/db"], "Labels": {}, "NetworkSettings": {"Networks": {
+                "bridge": {"IPAddress": "ipv4.3", "GlobalIPv6Address": ""}
+            }}},
+        ]
+        
+        self.d.setup(state={
+            "last_event_time": {"unix:///run/a.sock": 1000000001, "tcp://b:2375": 2000000001},
+            "containers": {
+                "unix:///run/a.sock/id1": [["web"], ["ipv4.1"], []],
+                "tcp://b:2375/id2": [["db"], ["ipv4.3"], []],
+            }
+        })
+        
+        self.updater.set_hosts.assert_not_called()
+        self.updater.remove_host.assert_called_once_with(("web",))
+        self.assertEqual([i.last_event_time for i in self.d.handlers], [1000000001, 2000000001])
+        self.assertEqual(self.d.get_state()["containers"], {"tcp://b:2375/id2": [("db",), ["ipv4.3"], [], None]})
+    
+    def test_run(self):
+        for client in self.clients.values():
+            client.containers.list.return_value = []
+        self.d.setup()
+        
+        event = {
+            "Type": "network",
+            "Action": "connect",
+            "timeNano": 1000000001,
+            "Actor": {"Attributes": {"container": "id1", "name": "bridge"}}
+        }
+        
+        def events(**kwargs):
+            yield event
+            raise StopException()
+        
+        released = threading.Event()
+        self.addCleanup(released.set)
+        
+        def wait_for_event():
+            released.wait()
+            raise StopIteration()
+        
+        # stream of other daemon is blocked until it is closed
+        idle_events = unittest.mock.Mock()
+        idle_events.__next__ = unittest.mock.Mock(side_effect=wait_for_event)
+        idle_events.close.side_effect = released.set
+        
+        self.clients["unix:///run/a.sock"].events.side_effect = events
+        self.clients["unix:///run/a.sock"].containers.get.return_value = ContainerInfo(id="id1", names=["web"], ipv4s=["ipv4.1"], ipv6s=[])
+        self.clients["tcp://b:2375"].events.return_value = idle_events
+        self.d.reconnect_max_delay = 0
+        
+        self.d.run()
+        
+        idle_events.close.assert_called_once_with()
+        self.assertFalse(any(i.name.startswith("docker-") for i in threading.enumerate()), "handler threads are stopped")
+        
+        self.updater.add_host.assert_called_once_with(("web",), ["ipv4.1"], [])
+        self.assertEqual(self.d.get_state()["last_event_time"]["unix:///run/a.sock"], 1000000001)
+        self.assertEqual((self.d.events_received, self.d.events_handled), (1, 1), "events are counted across daemons")
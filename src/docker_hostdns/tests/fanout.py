@@ -0,0 +1,94 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import time
+import threading
+import unittest.mock
+from docker_hostdns.hostdns import NamedUpdater
+from docker_hostdns.fanout import MultiUpdater
+from docker_hostdns.exceptions import DnsException
+from docker_hostdns.fakes.dnsserver import DnsServer
+
+class MultiUpdaterTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.servers = [DnsServer("example-zone") for _i in range(2)]
+        for server in self.servers:
+            server.start()
+        
+        self.updaters = [NamedUpdater("example-zone", "127.0.0.1", instance_name="test", dns_port=i.port) for i in self.servers]
+        self.multi = MultiUpdater(self.updaters)
+        self.multi.timeout = 0.5
+        self.multi.resync_delay = 0.01
+        self.multi.setup()
+    
+    def tearDown(self):
+        self.multi.close()
+        for server in self.servers:
+            server.stop()
+    
+    def wait_for(self, condition):
+        for _i in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("Condition was not met in time")
+    
+    def test_fan_out(self):
+        self.multi.set_hosts({"a": (["10.0.0.1"], [])})
+        self.multi.add_host("b", ["10.0.0.2"], [])
+        self.multi.remove_host("a")
+        
+        for server in self.servers:
+            self.assertEqual(server.zone.get("a", "A"), set())
+            self.assertEqual(server.zone.get("b", "A"), {"10.0.0.2"})
+            self.assertEqual(server.zone.get("_container_test", "TXT"), {"b"})
+        
+        self.assertEqual(self.multi.desired, {"b": (["10.0.0.2"], [])})
+        self.assertEqual([i["healthy"] for i in self.multi.get_status()], [True, True])
+    
+    def test_resync_failed_server(self):
+        self.multi.set_hosts({"a": (["10.0.0.1"], [])})
+        
+        with unittest.mock.patch.object(self.updaters[1], "apply_changes", side_effect=DnsException("REFUSED")):
+            self.multi.apply_changes({"b": (["10.0.0.2"], [])})
+            status = self.multi.get_status()[1]
+            self.assertFalse(status["healthy"])
+            self.assertEqual(status["error"], "REFUSED")
+            
+            self.multi.apply_changes({"c": (["10.0.0.3"], [])})
+            self.assertEqual(self.servers[0].zone.get("c", "A"), {"10.0.0.3"}, "healthy server keeps receiving updates")
+        
+        self.wait_for(lambda: self.multi.get_status()[1]["healthy"])
+        self.assertEqual(self.servers[1].zone.get("_container_test", "TXT"), {"a", "b", "c"})
+        self.assertEqual(self.servers[1].zone.get("c", "A"), {"10.0.0.3"})
+    
+    def test_lagging_server(self):
+        release = threading.Event()
+        set_hosts = self.updaters[1].set_hosts
+        
+        def slow_set_hosts(hosts):
+            release.wait()
+            set_hosts(hosts)
+        
+        with unittest.mock.patch.object(self.updaters[1], "set_hosts", side_effect=slow_set_hosts):
+            started = time.monotonic()
+            self.multi.set_hosts({"a": (["10.0.0.1"], [])})
+            self.assertLess(time.monotonic() - started, 5, "slow server does not block update")
+            
+            self.multi.add_host("b", ["10.0.0.2"], [])
+            self.assertEqual(self.servers[0].zone.get("b", "A"), {"10.0.0.2"})
+            self.assertGreater(self.multi.get_status()[1]["lag"], 0)
+            
+            release.set()
+            self.wait_for(lambda: self.multi.get_status()[1]["healthy"])
+        
+        self.assertEqual(self.servers[1].zone.get("a", "A"), {"10.0.0.1"})
+        self.assertEqual(self.servers[1].zone.get("b", "A"), {"10.0.0.2"})
+    
+    def test_all_failed(self):
+        self.multi.set_hosts({})
+        for updater in self.updaters:
+            updater.connection.query = unittest.mock.Mock(side_effect=OSError("unreachable"))
+        
+        self.assertRaises(DnsException, self.multi.add_host, "a", ["10.0.0.1"], [])
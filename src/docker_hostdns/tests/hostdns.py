@@ -6,8 +6,11 @@ Created on 07.04.2017
 import unittest.mock
 from docker_hostdns.hostdns import NamedUpdater, ContainerInfo, DockerHandler
 import dns
+import dns.rrset
+import dns.reversename
+import docker.errors
 import contextlib
-from docker_hostdns.exceptions import ConnectionException
+from docker_hostdns.exceptions import ConnectionException, DnsException, StopException
 
 def _assert_called_once(mock):
     if hasattr(mock, "assert_called_once"):
@@ -15,7 +18,7 @@ def _assert_called_once(mock):
     else:
         def _assert(*args, **kwargs):
             assert mock.called
-    
+
 
 class NamedUpdaterTest(unittest.TestCase):
     
@@ -26,9 +29,11 @@ class NamedUpdaterTest(unittest.TestCase):
     
     @contextlib.contextmanager
     def mock_dns_query(self, protocol = 'tcp'):
-        with unittest.mock.patch("dns.query.%s" % protocol) as f:
+        target = "docker_hostdns.connection.DnsConnection.query" if protocol == "tcp" else "dns.query.%s" % protocol
+        with unittest.mock.patch(target) as f:
             ret = unittest.mock.MagicMock()
             ret.rcode.return_value = dns.rcode.NOERROR
+            ret.flags = 0
             f.return_value = ret
             
             yield f, ret
@@ -43,7 +48,7 @@ class NamedUpdaterTest(unittest.TestCase):
                 found = (not i.items and value is None) or (i.items[0].to_text().strip('"') == value)
                 if found:
                     break
-                
+        
         self.assertTrue(found, "%r %s dns record with value %r exists" % (name, dns.rdatatype.to_text(rtype), value))
     
     def create_obj(self):
@@ -66,7 +71,7 @@ class NamedUpdaterTest(unittest.TestCase):
             self.assert_dns_rrset(update, self.hostname, dns.rdatatype.A, self.host4_a)
             self.assert_dns_rrset(update, self.hostname, dns.rdatatype.A, self.host4_b)
             self.assert_dns_rrset(update, self.hostname, dns.rdatatype.AAAA, self.host6)
-            
+    
     def test_host_remove(self):
         n = self.create_obj()
         n.hosts.add(self.hostname)
@@ -92,6 +97,99 @@ class NamedUpdaterTest(unittest.TestCase):
         
         self.assertTrue(n.hosts.issubset([self.hostname, "second-host"]))
     
+    def test_hosts_add_batched(self):
+        n = self.create_obj()
+        hosts = dict(("host-%d" % i, ([self.host4_a], [self.host6])) for i in range(50))
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.add_hosts(hosts)
+            
+            self.assertEqual(f.call_count, 1, "all hosts are sent in single update")
+            update = f.call_args[0][0]
+            self.assert_dns_rrset(update, "host-42", dns.rdatatype.A, self.host4_a)
+            self.assert_dns_rrset(update, "*.host-42", dns.rdatatype.AAAA, self.host6)
+        
+        self.assertEqual(n.hosts, set(hosts.keys()))
+    
+    def test_hosts_add_split_by_size(self):
+        n = self.create_obj()
+        n.max_message_size = n.message_size_reserve + 1000
+        hosts = dict(("host-%d" % i, ([self.host4_a], [self.host6])) for i in range(50))
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.add_hosts(hosts)
+            
+            self.assertGreater(f.call_count, 1, "hosts are split between many updates")
+            for call in f.call_args_list:
+                self.assertLess(len(call[0][0].to_wire()), n.max_message_size)
+        
+        self.assertEqual(n.hosts, set(hosts.keys()))
+    
+    def test_hosts_add_fallback(self):
+        n = self.create_obj()
+        
+        with unittest.mock.patch.object(NamedUpdater, "_update") as f:
+            f.side_effect = [DnsException(), None, DnsException()]
+            n.add_hosts({"a": ([self.host4_a], []), "b": ([self.host4_b], [])})
+            
+            self.assertEqual(f.call_count, 3, "rejected batch is retried host by host")
+        
+        self.assertEqual(n.hosts, {"a"})
+    
+    def test_hosts_set_batched(self):
+        n = self.create_obj()
+        n.hosts.update(["old-1", "old-2"])
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.set_hosts({"a": ([self.host4_a], []), "b": ([self.host4_b], [])})
+            
+            _assert_called_once(f)
+            update = f.call_args[0][0]
+            self.assert_dns_rrset(update, "a", dns.rdatatype.A, self.host4_a)
+            self.assert_dns_rrset(update, "old-1", dns.rdatatype.A, None, deleting=dns.rdataclass.ANY)
+        
+        self.assertEqual(n.hosts, {"a", "b"})
+    
+    def test_changes_apply(self):
+        n = self.create_obj()
+        n.hosts.update(["removed", "replaced"])
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.apply_changes({
+                "removed": None,
+                "replaced": ([self.host4_b], []),
+                "added": ([self.host4_a], [self.host6]),
+            })
+            
+            _assert_called_once(f)
+            update = f.call_args[0][0]
+            self.assert_dns_rrset(update, "removed", dns.rdatatype.A, None, deleting=dns.rdataclass.ANY)
+            self.assert_dns_rrset(update, "replaced", dns.rdatatype.A, None, deleting=dns.rdataclass.ANY)
+            self.assert_dns_rrset(update, "replaced", dns.rdatatype.A, self.host4_b)
+            self.assert_dns_rrset(update, "added", dns.rdatatype.AAAA, self.host6)
+        
+        self.assertEqual(n.hosts, {"replaced", "added"})
+    
+    def test_changes_diff(self):
+        n = self.create_obj()
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.set_hosts({self.hostname: ([self.host4_a], [self.host6])})
+            n.set_hosts({self.hostname: ([self.host4_b], [self.host6])})
+            
+            self.assertEqual(f.call_count, 2)
+            update = f.call_args[0][0]
+            
+            self.assert_dns_rrset(update, self.hostname, dns.rdatatype.A, self.host4_a, deleting=dns.rdataclass.NONE)
+            self.assert_dns_rrset(update, "*.%s" % self.hostname, dns.rdatatype.A, self.host4_a, deleting=dns.rdataclass.NONE)
+            self.assert_dns_rrset(update, self.hostname, dns.rdatatype.A, self.host4_b)
+            self.assertEqual(len(update.authority), 4, "only changed records are sent")
+            
+            n.set_hosts({self.hostname: ([self.host4_b], [self.host6])})
+            self.assertEqual(f.call_count, 2, "nothing is sent when state did not change")
+        
+        self.assertEqual(n.records[self.hostname], (frozenset([self.host4_b]), frozenset([self.host6])))
+    
     def test_load_hosts(self):
         n = self.create_obj()
         with self.mock_dns_query('udp') as (_f, ret):
@@ -104,6 +202,162 @@ class NamedUpdaterTest(unittest.TestCase):
         
         self.assertTrue(n.hosts.issubset([self.hostname]))
     
+    def test_load_hosts_truncated(self):
+        n = self.create_obj()
+        with self.mock_dns_query('udp') as (udp, udp_ret):
+            udp_ret.flags = dns.flags.TC | dns.flags.QR
+            with self.mock_dns_query() as (tcp, tcp_ret):
+                tcp_ret.answer = "test"
+                tcp_ret.find_rrset.return_value = [
+                    dns.rdtypes.ANY.TXT.TXT(dns.rdataclass.IN, dns.rdatatype.TXT, [self.hostname])
+                ]
+                
+                n.load_records()
+                
+                _assert_called_once(tcp)
+                self.assertIsNotNone(udp.call_args[0][0].edns, "EDNS is used")
+        
+        self.assertEqual(n.hosts, {self.hostname})
+    
+    def test_owner_shards(self):
+        n = NamedUpdater("example-zone", "127.0.0.3", instance_name="test", owner_shards=4)
+        hosts = dict(("host-%d" % i, ([self.host4_a], [])) for i in range(20))
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.add_hosts(hosts)
+            update = f.call_args[0][0]
+        
+        owners = set()
+        for rrset in update.authority:
+            if rrset.rdtype == dns.rdatatype.TXT:
+                owners.add(rrset.name.to_text(omit_final_dot=True))
+        
+        self.assertEqual(owners, set("_container_test-%d.example-zone" % i for i in range(4)), "hosts are spread between all shards")
+        
+        with self.mock_dns_query('udp') as (f, ret):
+            ret.answer = "test"
+            ret.find_rrset.return_value = [
+                dns.rdtypes.ANY.TXT.TXT(dns.rdataclass.IN, dns.rdatatype.TXT, [self.hostname])
+            ]
+            
+            n.load_records()
+            
+            self.assertEqual(f.call_count, 5, "all shards and legacy record are loaded")
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.remove_host(self.hostname)
+            update = f.call_args[0][0]
+            self.assert_dns_rrset(update, "_container_test", dns.rdatatype.TXT, self.hostname, deleting=dns.rdataclass.NONE)
+    
+    def test_ptr_configured_zone(self):
+        n = NamedUpdater("example-zone", "127.0.0.3", instance_name="test", reverse_zones=["in-addr.arpa", "168.192.in-addr.arpa"])
+        
+        with self.mock_dns_query() as (f, _ret):
+            with unittest.mock.patch.object(n, "_lookup_reverse_zone", return_value=None) as lookup:
+                n.add_hosts({
+                    self.hostname: ([self.host4_a], [self.host6]),
+                    "other-host": ([self.host4_b], []),
+                })
+            
+            self.assertEqual(f.call_count, 2, "PTR records are sent in single update")
+            update = f.call_args[0][0]
+            
+            self.assertEqual(update.question[0].name, dns.name.from_text("168.192.in-addr.arpa"))
+            self.assert_dns_rrset(update, "1.1.168.192.in-addr.arpa.", dns.rdatatype.PTR, "%s.example-zone." % self.hostname)
+            self.assert_dns_rrset(update, "2.1.168.192.in-addr.arpa.", dns.rdatatype.PTR, "other-host.example-zone.")
+            self.assert_dns_rrset(update, "2.1.168.192.in-addr.arpa.", dns.rdatatype.PTR, None, deleting=dns.rdataclass.ANY)
+            self.assertEqual(len(update.authority), 4, "added records replace PTR rrsets")
+            # ipv6 address is not in configured zones
+            lookup.assert_called_once_with(dns.reversename.from_address(self.host6))
+    
+    def test_ptr_diff(self):
+        n = NamedUpdater("example-zone", "127.0.0.3", instance_name="test", reverse_zones=["168.192.in-addr.arpa"])
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.set_hosts({self.hostname: ([self.host4_a], [])})
+            n.set_hosts({self.hostname: ([self.host4_b], [])})
+            
+            self.assertEqual(f.call_count, 4)
+            update = f.call_args[0][0]
+            self.assert_dns_rrset(update, "1.1.168.192.in-addr.arpa.", dns.rdatatype.PTR, "%s.example-zone." % self.hostname, deleting=dns.rdataclass.NONE)
+            self.assert_dns_rrset(update, "2.1.168.192.in-addr.arpa.", dns.rdatatype.PTR, "%s.example-zone." % self.hostname)
+            
+            n.remove_host(self.hostname)
+            update = f.call_args[0][0]
+            self.assert_dns_rrset(update, "2.1.168.192.in-addr.arpa.", dns.rdatatype.PTR, "%s.example-zone." % self.hostname, deleting=dns.rdataclass.NONE)
+    
+    def test_ptr_names(self):
+        n = NamedUpdater("example-zone", "127.0.0.3", instance_name="test", reverse_zones=["168.192.in-addr.arpa"], ptr_names={"web"})
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.add_host(("0123456789ab", "web", "web-alias"), [self.host4_a], [])
+            
+            self.assertEqual(f.call_count, 2)
+            update = f.call_args[0][0]
+            self.assert_dns_rrset(update, "1.1.168.192.in-addr.arpa.", dns.rdatatype.PTR, "web.example-zone.")
+            self.assertEqual(len(update.authority), 2, "single PTR record points to main name")
+            
+            n.remove_host(("0123456789ab", "web", "web-alias"))
+            update = f.call_args[0][0]
+            self.assertEqual(len(update.authority), 3, "PTR records are removed for all names")
+    
+    def test_ptr_unknown_addresses(self):
+        n = NamedUpdater("example-zone", "127.0.0.3", instance_name="test", reverse_zones=["168.192.in-addr.arpa"])
+        # host loaded from ownership records
+        n.hosts = {self.hostname}
+        
+        def lookup(q):
+            r = dns.message.make_response(q)
+            if q.question[0].rdtype == dns.rdatatype.A:
+                r.answer.append(dns.rrset.from_text(q.question[0].name, 60, "IN", "A", self.host4_a))
+            return r
+        
+        with self.mock_dns_query() as (f, _ret):
+            with unittest.mock.patch.object(n, "_query", side_effect=lookup) as query:
+                n.set_hosts({})
+            
+            self.assertEqual(query.call_count, 2)
+            self.assertEqual(f.call_count, 2)
+            update = f.call_args[0][0]
+            self.assert_dns_rrset(update, "1.1.168.192.in-addr.arpa.", dns.rdatatype.PTR, "%s.example-zone." % self.hostname, deleting=dns.rdataclass.NONE)
+    
+    def test_ptr_not_managed_by_default(self):
+        n = self.create_obj()
+        
+        with self.mock_dns_query() as (f, _ret):
+            n.add_host(self.hostname, [self.host4_a])
+            _assert_called_once(f)
+    
+    def test_ptr_failure(self):
+        n = NamedUpdater("example-zone", "127.0.0.3", instance_name="test", reverse_zones=["168.192.in-addr.arpa"])
+        
+        with self.mock_dns_query() as (f, ret):
+            ret.rcode.side_effect = [dns.rcode.NOERROR, dns.rcode.REFUSED]
+            n.add_host(self.hostname, [self.host4_a])
+            
+            self.assertEqual(f.call_count, 2)
+        
+        self.assertEqual(n.hosts, {self.hostname}, "forward records are kept when PTR update fails")
+    
+    def test_reverse_zone_lookup(self):
+        n = NamedUpdater("example-zone", "127.0.0.3", instance_name="test", manage_ptr=True)
+        zone = dns.name.from_text("168.192.in-addr.arpa")
+        
+        with self.mock_dns_query("udp") as (f, ret):
+            ret.flags = dns.flags.AA
+            ret.rcode.return_value = dns.rcode.NXDOMAIN
+            ret.answer = []
+            ret.authority = [dns.rrset.from_text(zone, 60, "IN", "SOA", "ns.example. hostmaster.example. 1 3600 600 86400 60")]
+            
+            self.assertEqual(n._get_reverse_zone(dns.reversename.from_address(self.host4_a)), zone)
+            self.assertEqual(n._get_reverse_zone(dns.reversename.from_address(self.host4_b)), zone)
+            _assert_called_once(f)
+            
+            ret.flags = 0
+            self.assertIsNone(n._get_reverse_zone(dns.reversename.from_address("10.0.0.1")), "only authoritative answers are used")
+            self.assertIsNone(n._get_reverse_zone(dns.reversename.from_address("10.0.0.2")))
+            self.assertEqual(f.call_count, 2, "missing zone is cached")
+    
     def test_dns_hostname_resolving(self):
         ip_addr = "127.0.0.3"
         with unittest.mock.patch("socket.gethostbyname") as f:
@@ -146,6 +400,7 @@ class ContainerInfoTest(unittest.TestCase):
         c = ContainerInfo.from_container(m, self.networks)
         self.assertEqual(c.id, self.test_id)
         self.assertEqual(sorted(c.names), [self.test_id, "some-test"])
+        self.assertEqual(c.name, "some-test")
         self.assertEqual(c.ipv4s, [])
         self.assertEqual(c.ipv6s, [])
     
@@ -153,6 +408,7 @@ class ContainerInfoTest(unittest.TestCase):
         m = self.create_container(self.test_id, self.test_id, label_name="name_from_label")
         c = ContainerInfo.from_container(m, self.networks)
         self.assertEqual(c.names, {"name-from-label"})
+        self.assertEqual(c.name, "name-from-label")
     
     def test_multiple_networks(self):
         m = self.create_container(
@@ -190,6 +446,16 @@ class DockerHandlerTest(unittest.TestCase):
             client.ping.side_effect = Exception()
             self.assertRaises(ConnectionException, d.setup)
     
+    def test_tls_endpoint(self):
+        d = DockerHandler(unittest.mock.MagicMock(), endpoint="tcp+tls://docker-host:2376?cert_path=/certs")
+        
+        with unittest.mock.patch("docker.DockerClient") as client:
+            with unittest.mock.patch("docker.tls.TLSConfig") as tls:
+                d._create_client()
+        
+        tls.assert_called_once_with(client_cert=("/certs/cert.pem", "/certs/key.pem"), ca_cert="/certs/ca.pem", verify=True)
+        client.assert_called_once_with(base_url="tcp://docker-host:2376", tls=tls.return_value)
+    
     def test_setup(self):
         d, updater = self.get_object()
         with self.mock_docker_client() as client:
@@ -202,8 +468,86 @@ class DockerHandlerTest(unittest.TestCase):
                 info.side_effect = lambda c, networks: ContainerInfo(id=c[0], names=[c[1]], ipv4s=c[2], ipv6s=c[3])
                 d.setup()
         
-        # second "a" should be dropped
-        updater.set_hosts.assert_called_once_with({'b': (['ipv4'], []), 'a': (['ipv4'], ['ipv6'])})
+        # second "a" should be renamed
+        updater.set_hosts.assert_called_once_with({'b': (['ipv4'], []), 'a': (['ipv4'], ['ipv6']), 'a-1': (['ipv4'], [])})
+    
+    def test_setup_from_networks(self):
+        updater = unittest.mock.MagicMock()
+        d = DockerHandler(updater, inventory="networks")
+        
+        with self.mock_docker_client() as client:
+            networks = {
+                "bridge": {
+                    "idA": {"IPv4Address": "172.17.0.2/16", "IPv6Address": ""},
+                },
+                "custom": {
+                    "idB": {"IPv4Address": "172.18.0.2/16", "IPv6Address": "fd00::2/64"},
+                    "idC": {"IPv4Address": "172.18.0.3/16", "IPv6Address": ""},
+                    "ep-remote": {"IPv4Address": "172.18.0.4/16", "IPv6Address": ""},
+                }
+            }
+            client.networks.get.side_effect = lambda name: unittest.mock.Mock(attrs={"Containers": networks[name]})
+            client.api.containers.return_value = [
+                {"Id": "idA", "Names": ["/a"], "Labels": {}},
+                {"Id": "idB", "Names": ["/b"], "Labels": {"pl.glorpen.hostname": "labeled"}},
+                {"Id": "idC", "Names": ["/c"], "Labels": None},
+            ]
+            
+            with self.mock_container_info_factory() as info:
+                info.side_effect = lambda c, networks: ContainerInfo(id="idC", names=["c", "c-alias"], ipv4s=["172.18.0.3"], ipv6s=[])
+                d.setup(["bridge", "custom"])
+            
+            client.containers.list.assert_not_called()
+            client.containers.get.assert_called_once_with("idC")
+        
+        updater.set_hosts.assert_called_once_with({
+            "a": (["172.17.0.2"], []),
+            "idA": (["172.17.0.2"], []),
+            "labeled": (["172.18.0.2"], ["fd00::2"]),
+            "c": (["172.18.0.3"], []),
+            "c-alias": (["172.18.0.3"], []),
+        })
+    
+    def test_resume(self):
+        d, updater = self.get_object()
+        
+        def summary(id_, ipv4):
+            return {"Id": id_, "Names": ["/%s" % id_], "Labels": {}, "NetworkSettings": {"Networks": {
+                "bridge": {"IPAddress": ipv4, "GlobalIPv6Address": ""}
+            }}}
+        
+        with self.mock_docker_client() as client:
+            client.api.containers.return_value = [
+                summary("unchanged", "ipv4.1"),
+                summary("changed", "ipv4.3"),
+                summary("new", "ipv4.4"),
+            ]
+            
+            with self.mock_container_info_factory() as info:
+                info.side_effect = lambda c, networks: ContainerInfo(id=c, names={c}, ipv4s=["inspected"], ipv6s=[])
+                client.containers.get.side_effect = lambda id_: id_
+                
+                d.setup(state={
+                    "last_event_time": 1000000001,
+                    "containers": {
+                        "unchanged": [["unchanged"], ["ipv4.1"], [], "unchanged"],
+                        "changed": [["changed"], ["ipv4.2"], []],
+                        "gone": [["gone"], ["ipv4.5"], []],
+                    }
+                })
+            
+            client.containers.list.assert_not_called()
+            self.assertEqual(sorted(c[0][0] for c in client.containers.get.call_args_list), ["changed", "new"], "only changed containers are inspected")
+        
+        updater.set_hosts.assert_not_called()
+        updater.remove_host.assert_called_once_with(("gone",))
+        self.assertEqual(sorted(c[0][0] for c in updater.add_host.call_args_list), [("changed",), ("new",)])
+        self.assertEqual(d.last_event_time, 1000000001)
+        
+        state = d.get_state()
+        self.assertEqual(sorted(state["containers"].keys()), ["changed", "new", "unchanged"])
+        self.assertEqual(state["containers"]["unchanged"], [("unchanged",), ["ipv4.1"], [], "unchanged"], "main name is restored")
+        self.assertIn("unchanged", d.registry.primary_names)
     
     def test_connection_events_handlers(self):
         d, updater = self.get_object()
@@ -216,6 +560,20 @@ class DockerHandlerTest(unittest.TestCase):
         d.on_disconnect("known-id")
         updater.remove_host.assert_called_once_with(("name",))
     
+    def test_renamed_on_reconnect(self):
+        d, updater = self.get_object()
+        
+        d.on_connect("first-id", ["web"], ["ipv4.1"], [])
+        d.on_connect("second-id", ["web"], ["ipv4.2"], [])
+        d.on_disconnect("first-id")
+        updater.remove_host.reset_mock()
+        
+        d.on_connect("second-id", ["web"], ["ipv4.2"], [])
+        
+        updater.remove_host.assert_called_once_with(("web-1",))
+        updater.add_host.assert_called_with(("web",), ["ipv4.2"], [])
+        self.assertEqual(d.get_hosts(), {"web": (["ipv4.2"], [])})
+    
     def test_connection_events_dispatcher(self):
         with unittest.mock.patch.object(DockerHandler, 'on_connect') as on_connect:
             with unittest.mock.patch.object(DockerHandler, 'on_disconnect') as on_disconnect:
@@ -226,7 +584,7 @@ class DockerHandlerTest(unittest.TestCase):
                         
                         d.setup(["test-network"])
                         
-                        c = ContainerInfo(id="container-1", names={"c-1"})
+                        c = ContainerInfo(id="container-1", names={"c-1"}, name="c-1")
                         info.return_value = c
                         
                         d.handle_event({
@@ -235,7 +593,7 @@ class DockerHandlerTest(unittest.TestCase):
                             "Actor":{"Attributes":{"container":"test-id", "name": "test-network"}}
                         })
                         
-                        on_connect.assert_called_once_with("test-id", {"c-1"}, None, None)
+                        on_connect.assert_called_once_with("test-id", {"c-1"}, None, None, "c-1")
                         
                         d.handle_event({
                             "Type": "network",
@@ -244,3 +602,109 @@ class DockerHandlerTest(unittest.TestCase):
                         })
                         
                         on_disconnect.assert_called_once_with("test-id")
+                        
+                        d.handle_event({
+                            "Type": "network",
+                            "Action": "connect",
+                            "Actor":{"Attributes":{"container":"test-id", "name": "other-network"}}
+                        })
+                        d.handle_event({
+                            "Type": "container",
+                            "Action": "start",
+                            "Actor":{"Attributes":{"name": "test-container"}}
+                        })
+                        
+                        self.assertEqual(d.events_received, 4)
+                        self.assertEqual(d.events_handled, 2)
+    
+    def test_events_resume(self):
+        d, _updater = self.get_object()
+        
+        def broken_stream(events):
+            for event in events:
+                yield event
+            raise Exception("connection reset")
+        
+        def stopped_stream(events):
+            for event in events:
+                yield event
+            raise StopException()
+        
+        first = {"Type": "network", "timeNano": 1000000001}
+        second = {"Type": "network", "timeNano": 2000000001}
+        
+        with self.mock_docker_client() as client:
+            client.events.side_effect = [
+                broken_stream([first]),
+                Exception("connection refused"),
+                stopped_stream([first, second]),
+            ]
+            
+            with unittest.mock.patch.object(DockerHandler, 'handle_event') as handle_event:
+                with unittest.mock.patch.object(d._stopping, "wait") as sleep:
+                    d.setup()
+                    d.run()
+            
+            self.assertEqual(handle_event.call_args_list, [unittest.mock.call(first), unittest.mock.call(second)], "replayed event is skipped")
+            self.assertEqual(sleep.call_args_list, [unittest.mock.call(1), unittest.mock.call(2)], "exponential backoff")
+            self.assertEqual(client.events.call_args_list[-1][1]["since"], 1)
+            self.assertEqual(d.last_event_time, 2000000001)
+    
+    def test_events_resume_before_first_event(self):
+        d, _updater = self.get_object()
+        
+        def stopped_stream():
+            raise StopException()
+            yield
+        
+        with self.mock_docker_client() as client:
+            client.events.side_effect = [Exception("connection reset"), stopped_stream()]
+            
+            with unittest.mock.patch.object(d._stopping, "wait"):
+                d.setup()
+                d.run()
+            
+            since = [i[1].get("since") for i in client.events.call_args_list]
+            self.assertIsNotNone(since[0])
+            self.assertEqual(since[0], since[1], "reconnected stream starts where first one did")
+    
+    def test_events_of_removed_container(self):
+        d, updater = self.get_object()
+        
+        def stopped_stream(events):
+            for event in events:
+                yield event
+            raise StopException()
+        
+        def event(action, time_nano):
+            return {
+                "Type": "network", "Action": action, "timeNano": time_nano,
+                "Actor": {"Attributes": {"container": "test-id", "name": "bridge"}}
+            }
+        
+        with self.mock_docker_client() as client:
+            client.events.side_effect = [stopped_stream([event("connect", 1000000001), event("disconnect", 2000000001)])]
+            client.containers.list.return_value = []
+            client.containers.get.side_effect = docker.errors.NotFound("No such container")
+            
+            d.setup()
+            d.run()
+            
+            updater.add_host.assert_not_called()
+            self.assertEqual(d.events_received, 2)
+            self.assertEqual(d.last_event_time, 2000000001, "daemon keeps handling events after missing container")
+    
+    def test_events_without_reconnecting(self):
+        d, _updater = self.get_object()
+        d.reconnect_max_delay = 0
+        
+        with self.mock_docker_client() as client:
+            client.events.side_effect = Exception("connection refused")
+            d.setup()
+            d.run()
+            
+            client.events.assert_called_once_with(decode=True, since=d.subscribed_time, filters={
+                "type": ["network"],
+                "event": ["connect", "disconnect"],
+                "network": ["bridge"],
+            })
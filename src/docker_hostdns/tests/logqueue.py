@@ -0,0 +1,60 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import logging
+import threading
+import unittest.mock
+from docker_hostdns import metrics
+from docker_hostdns.logqueue import DroppingQueue, LogQueue
+
+class _BlockedHandler(logging.Handler):
+    def __init__(self):
+        super(_BlockedHandler, self).__init__()
+        self.released = threading.Event()
+        self.messages = []
+    
+    def emit(self, record):
+        self.released.wait()
+        self.messages.append(self.format(record))
+
+class LogQueueTest(unittest.TestCase):
+    
+    def test_dropping_queue(self):
+        q = DroppingQueue(2)
+        dropped = metrics.LOG_DROPPED.get()
+        
+        for i in range(4):
+            q.put_nowait(i)
+        
+        self.assertEqual([q.get_nowait(), q.get_nowait()], [2, 3], "oldest items are dropped")
+        self.assertEqual(q.dropped, 2)
+        self.assertEqual(metrics.LOG_DROPPED.get(), dropped + 2)
+        
+        q.put_nowait(None)
+        q.put_nowait(1)
+        self.assertEqual([q.get_nowait(), q.get_nowait()], [None, 1], "stop sentinel is not dropped")
+    
+    def test_slow_handler(self):
+        handler = _BlockedHandler()
+        self.addCleanup(handler.released.set)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        
+        log_queue = LogQueue([handler], max_size=3)
+        logger = logging.getLogger("test_slow_handler")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(log_queue.handler)
+        self.addCleanup(logger.removeHandler, log_queue.handler)
+        
+        names = ["a"]
+        with unittest.mock.patch.object(log_queue.handler, "format") as format_:
+            for i in range(10):
+                logger.info("Adding %r:%d", names, i)
+            format_.assert_not_called()
+        
+        log_queue.start()
+        handler.released.set()
+        log_queue.stop()
+        
+        self.assertEqual(log_queue.dropped, 7)
+        self.assertEqual(handler.messages, ["INFO Adding ['a']:7", "INFO Adding ['a']:8", "INFO Adding ['a']:9"], "messages are formatted by listener")
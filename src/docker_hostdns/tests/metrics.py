@@ -0,0 +1,112 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import time
+import urllib.request
+import urllib.error
+import unittest.mock
+import dns.rcode
+from docker_hostdns import metrics
+from docker_hostdns.hostdns import NamedUpdater
+from docker_hostdns.pipeline import UpdatePipeline
+
+class MetricsTest(unittest.TestCase):
+    
+    def test_render(self):
+        registry = []
+        counter = metrics.Counter("test_events", "Events.", labels=("action",), registry=registry)
+        gauge = metrics.Gauge("test_hosts", "Hosts.", registry=registry)
+        histogram = metrics.Histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1), registry=registry)
+        
+        counter.inc("connect")
+        counter.inc("connect")
+        counter.inc('dis"connect')
+        gauge.set_function(lambda: 3)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        
+        self.assertEqual(metrics.render(registry).splitlines(), [
+            "# HELP test_events Events.",
+            "# TYPE test_events counter",
+            'test_events_total{action="connect"} 2',
+            'test_events_total{action="dis\\"connect"} 1',
+            "# HELP test_hosts Hosts.",
+            "# TYPE test_hosts gauge",
+            "test_hosts 3",
+            "# HELP test_latency_seconds Latency.",
+            "# TYPE test_latency_seconds histogram",
+            'test_latency_seconds_bucket{le="0.1"} 1',
+            'test_latency_seconds_bucket{le="1.0"} 2',
+            'test_latency_seconds_bucket{le="+Inf"} 3',
+            "test_latency_seconds_sum 5.55",
+            "test_latency_seconds_count 3",
+        ])
+    
+    def test_counter_function(self):
+        registry = []
+        metrics.Counter("test_received", "Received.", registry=registry).set_function(lambda: 7)
+        
+        self.assertEqual(metrics.render(registry).splitlines()[2:], ["test_received_total 7"])
+    
+    def test_labelled_gauge(self):
+        registry = []
+        gauge = metrics.Gauge("test_lag_seconds", "Lag.", labels=("server",), registry=registry)
+        gauge.set_function(lambda: {("b",): 1.5, ("a",): 0})
+        
+        self.assertEqual(metrics.render(registry).splitlines()[2:], [
+            'test_lag_seconds{server="a"} 0',
+            'test_lag_seconds{server="b"} 1.5',
+        ])
+    
+    def test_server(self):
+        registry = []
+        metrics.Counter("test_events", "Events.", registry=registry).inc()
+        
+        server = metrics.MetricsServer(0, registry=registry)
+        server.start()
+        self.addCleanup(server.stop)
+        
+        with urllib.request.urlopen("http://127.0.0.1:%d/metrics" % server.port) as response:
+            self.assertIn("text/plain", response.headers["Content-Type"])
+            self.assertIn("test_events_total 1", response.read().decode())
+        
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen("http://127.0.0.1:%d/other" % server.port)
+        self.assertEqual(e.exception.code, 404)
+        e.exception.close()
+    
+    def test_dns_updates(self):
+        n = NamedUpdater("example-zone", "127.0.0.3", instance_name="test")
+        
+        refused = metrics.DNS_UPDATES.get("REFUSED")
+        updates = metrics.DNS_UPDATE_LATENCY.count
+        
+        with unittest.mock.patch("docker_hostdns.connection.DnsConnection.query") as f:
+            f.return_value.rcode.return_value = dns.rcode.REFUSED
+            with self.assertRaises(Exception):
+                n.add_host("example", ["192.168.1.1"], [])
+        
+        self.assertEqual(metrics.DNS_UPDATES.get("REFUSED"), refused + 1)
+        self.assertEqual(metrics.DNS_UPDATE_LATENCY.count, updates + 1)
+    
+    def test_event_latency(self):
+        n = NamedUpdater("example-zone", "127.0.0.3", instance_name="test", reverse_zones=["168.192.in-addr.arpa"])
+        
+        with unittest.mock.patch("docker_hostdns.connection.DnsConnection.query") as f:
+            f.return_value.rcode.return_value = dns.rcode.NOERROR
+            with unittest.mock.patch.object(metrics.EVENT_LATENCY, "observe") as observe:
+                with metrics.event_time(time.time() - 5):
+                    n.add_host("example", ["192.168.1.1"], [])
+                observe.assert_not_called()
+                
+                p = UpdatePipeline(n)
+                p.start()
+                with metrics.event_time(time.time() - 5):
+                    p.add_host("other", ["192.168.1.2"], [])
+                    metrics.observe_applied()
+                p.close()
+        
+        self.assertEqual(f.call_count, 4, "forward and PTR records are updated")
+        observe.assert_called_once()
+        self.assertGreaterEqual(observe.call_args[0][0], 5)
@@ -0,0 +1,272 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import os
+import json
+import time
+import tempfile
+import unittest.mock
+import threading
+from docker_hostdns import metrics
+from docker_hostdns.pipeline import UpdatePipeline, Coalescer, RetryQueue
+from docker_hostdns.exceptions import DnsException
+
+class UpdatePipelineTest(unittest.TestCase):
+    
+    def test_writes_in_order(self):
+        updater = unittest.mock.Mock()
+        p = UpdatePipeline(updater)
+        p.start()
+        
+        p.set_hosts({"a": (["ipv4"], [])})
+        p.add_host(("b",), ["ipv4"], [])
+        p.remove_host(("a",))
+        p.close()
+        
+        self.assertEqual(updater.mock_calls, [
+            unittest.mock.call.set_hosts({"a": (["ipv4"], [])}),
+            unittest.mock.call.add_host(("b",), ["ipv4"], []),
+            unittest.mock.call.remove_host(("a",)),
+        ])
+        self.assertEqual(p.processed, 3)
+        self.assertEqual(p.pending, 0)
+        self.assertTrue(p.synced)
+    
+    def test_backpressure(self):
+        release = threading.Event()
+        updater = unittest.mock.Mock()
+        updater.add_host.side_effect = lambda *args: release.wait()
+        
+        p = UpdatePipeline(updater, max_size=1)
+        p.add_host(("a",))
+        self.assertEqual(p.pending, 1)
+        self.assertFalse(p.synced)
+        self.assertGreaterEqual(p.lag, 0)
+        
+        producer = threading.Thread(target=p.add_host, args=(("b",),))
+        producer.start()
+        producer.join(0.1)
+        self.assertTrue(producer.is_alive(), "producer is blocked on full queue")
+        
+        p.start()
+        release.set()
+        producer.join()
+        p.close()
+        
+        self.assertEqual(p.processed, 2)
+        self.assertEqual(p.lag, 0)
+    
+    def test_writer_error(self):
+        updater = unittest.mock.Mock()
+        updater.add_host.side_effect = DnsException()
+        
+        p = UpdatePipeline(updater)
+        p.start()
+        p.add_host(("a",))
+        p.queue.join()
+        
+        self.assertRaises(DnsException, p.add_host, ("b",))
+        p.close()
+    
+    def test_coalesced_writes(self):
+        updater = unittest.mock.Mock()
+        updater.hosts = {"published"}
+        p = UpdatePipeline(updater, coalescer=Coalescer(60))
+        p.start()
+        
+        for i in range(100):
+            p.add_host(("web-%d" % i,), ["ipv4"], [])
+        p.remove_host(("web-0",))
+        p.remove_host("gone")
+        p.add_host(("published",), ["ipv4"], [])
+        p.remove_host("published")
+        p.queue.join()
+        
+        self.assertEqual(p.pending, 102)
+        updater.apply_changes.assert_not_called()
+        
+        p.close()
+        
+        updater.apply_changes.assert_called_once()
+        changes = updater.apply_changes.call_args[0][0]
+        self.assertEqual(len(changes), 101)
+        self.assertNotIn("web-0", changes, "host added and removed in same window is skipped")
+        self.assertIsNone(changes["gone"])
+        self.assertIsNone(changes["published"], "already published host is removed even if it was added in same window")
+        self.assertEqual(changes["web-1"], (["ipv4"], []))
+    
+    def test_retried_writes(self):
+        written = threading.Event()
+        updater = unittest.mock.Mock()
+        updater.add_host.side_effect = DnsException()
+        
+        def apply_changes(changes):
+            if updater.apply_changes.call_count == 1:
+                raise OSError()
+            written.set()
+        
+        updater.apply_changes.side_effect = apply_changes
+        
+        retry = RetryQueue(delay=0.01)
+        p = UpdatePipeline(updater, retry=retry)
+        p.start()
+        p.add_host(("a",), ["ipv4"], [])
+        p.add_host(("b",), ["ipv4"], [])
+        p.remove_host("b")
+        
+        self.assertTrue(written.wait(5))
+        p.add_host(("c",), ["ipv4"], [])
+        p.close()
+        
+        self.assertIsNone(p.error, "writer is not stopped by failed updates")
+        self.assertEqual(updater.apply_changes.call_args_list, [
+            unittest.mock.call({"a": (["ipv4"], [])}),
+            unittest.mock.call({"a": (["ipv4"], [])}),
+            unittest.mock.call({"c": (["ipv4"], [])}),
+        ], "pending changes are retried once more on close")
+        self.assertEqual(len(retry), 0)
+    
+    def test_retries_exhausted(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        
+        updater = unittest.mock.Mock()
+        updater.add_host.side_effect = DnsException("refused")
+        updater.apply_changes.side_effect = DnsException("refused")
+        
+        retry = RetryQueue(max_attempts=3, delay=0.01, dead_letter_path=path)
+        p = UpdatePipeline(updater, retry=retry)
+        p.start()
+        p.add_host(("a",), ["ipv4"], [])
+        
+        for _i in range(500):
+            if retry.dead:
+                break
+            time.sleep(0.01)
+        
+        self.assertEqual(updater.apply_changes.call_count, 2, "first attempt and two retries")
+        self.assertEqual(retry.dead, 1)
+        self.assertEqual(len(retry), 0)
+        self.assertFalse(p.synced, "given up updates are not written")
+        
+        updater.add_host.side_effect = None
+        p.add_host(("a",), ["ipv4"], [])
+        p.close()
+        self.assertTrue(p.synced, "given up name is written by later update")
+        
+        with open(path) as f:
+            entries = [json.loads(line) for line in f]
+        
+        self.assertEqual([(i["host"], i["addresses"], i["attempts"]) for i in entries], [("a", [["ipv4"], []], 3)])
+    
+    def test_event_latency(self):
+        updater = unittest.mock.Mock()
+        updater.hosts = set()
+        
+        with unittest.mock.patch.object(metrics.EVENT_LATENCY, "observe") as observe:
+            p = UpdatePipeline(updater)
+            p.start()
+            with metrics.event_time(time.time() - 5):
+                p.add_host(("a",), ["ipv4"], [])
+            p.add_host(("b",), ["ipv4"], [])
+            p.close()
+            
+            p = UpdatePipeline(updater, coalescer=Coalescer(60))
+            p.start()
+            with metrics.event_time(time.time() - 10):
+                p.add_host(("c",), ["ipv4"], [])
+            with metrics.event_time(time.time() - 1):
+                p.add_host(("d",), ["ipv4"], [])
+            p.close()
+        
+        self.assertEqual(len(observe.call_args_list), 2, "only updates caused by events are observed")
+        self.assertGreaterEqual(observe.call_args_list[0][0][0], 5, "latency is measured until update is applied")
+        self.assertGreaterEqual(observe.call_args_list[1][0][0], 10, "batch is measured from its oldest event")
+
+class RetryQueueTest(unittest.TestCase):
+    
+    def test_backoff(self):
+        q = RetryQueue(delay=1, max_delay=4)
+        delays = []
+        for _i in range(5):
+            q.push({"a": None}, "error", 0)
+            delays.append(q.next_deadline())
+        
+        self.assertTrue(0.5 <= delays[0] <= 1)
+        self.assertTrue(1 <= delays[1] <= 2)
+        self.assertTrue(2 <= delays[4] <= 4, "delay is capped")
+        
+        self.assertEqual(q.pop(delays[4] - 0.1), {})
+        self.assertEqual(q.pop(delays[4]), {"a": None})
+        self.assertIsNone(q.next_deadline())
+        
+        q.succeeded()
+        q.push({"a": None}, "error", 0)
+        self.assertLessEqual(q.next_deadline(), 1)
+    
+    def test_merge(self):
+        q = RetryQueue()
+        q.push({"a": (["ipv4.1"], []), "b": None}, "error", 0)
+        q.discard(["a"])
+        q.push({"b": (["ipv4.2"], [])}, "error", 0)
+        
+        self.assertEqual(q.pop(0, True), {"b": (["ipv4.2"], [])})
+    
+    def test_dead_letter(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        
+        q = RetryQueue(max_attempts=2, max_size=1, dead_letter_path=path)
+        q.push({"a": (["ipv4"], [])}, "refused", 0)
+        q.push({"b": None}, "refused", 0)
+        q.push({"b": None}, "timeout", 0)
+        
+        self.assertEqual(len(q), 0)
+        self.assertEqual(q.dead, 2)
+        
+        with open(path) as f:
+            entries = [json.loads(line) for line in f]
+        
+        self.assertEqual([(i["host"], i["addresses"], i["attempts"], i["error"]) for i in entries], [
+            ("a", [["ipv4"], []], 1, "refused"),
+            ("b", None, 2, "timeout"),
+        ])
+
+class CoalescerTest(unittest.TestCase):
+    
+    def test_net_effect(self):
+        c = Coalescer(1)
+        c.push("a", (["ipv4.1"], []), 0)
+        c.push("a", None, 0.1)
+        c.push("a", (["ipv4.2"], []), 0.2)
+        c.push("b", None, 0.3)
+        c.push("b", (["ipv4.3"], []), 0.4)
+        c.push("c", (["ipv4.4"], []), 0.5)
+        c.push("c", None, 0.6)
+        c.push("d", (["ipv4.5"], []), 0.7)
+        c.push("d", None, 0.8)
+        
+        self.assertEqual(c.next_deadline(), 1)
+        self.assertEqual(c.pop(0.9), {})
+        self.assertEqual(c.pop(1.8, published={"d"}), {"a": (["ipv4.2"], []), "b": (["ipv4.3"], []), "d": None})
+        self.assertEqual(len(c), 0)
+        self.assertIsNone(c.next_deadline())
+    
+    def test_hold_down(self):
+        c = Coalescer(1, hold_down=10)
+        
+        now = 0
+        for _i in range(Coalescer.flap_threshold):
+            c.push("a", (["ipv4"], []), now)
+            c.push("a", None, now + 0.5)
+            now += 1
+        c.push("a", (["ipv4"], []), now)
+        
+        self.assertEqual(c.pop(now + 2), {}, "flapping host is held down")
+        self.assertEqual(c.next_deadline(), now + 10)
+        self.assertEqual(c.pop(now + 10), {"a": (["ipv4"], [])})
+        
+        c.push("b", (["ipv4"], []), 0)
+        self.assertEqual(c.pop(1), {"b": (["ipv4"], [])}, "stable host is not affected")
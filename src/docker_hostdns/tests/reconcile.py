@@ -0,0 +1,86 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import unittest.mock
+from docker_hostdns.hostdns import NamedUpdater
+from docker_hostdns.reconcile import Reconciler
+from docker_hostdns.fakes.dnsserver import DnsServer
+
+class ReconcileTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = DnsServer("example-zone")
+        self.server.start()
+        
+        self.updater = NamedUpdater("example-zone", "127.0.0.1", instance_name="test", dns_port=self.server.port)
+        self.updater.setup()
+    
+    def tearDown(self):
+        self.updater.close()
+        self.server.stop()
+    
+    def test_fix_drift(self):
+        zone = self.server.zone
+        self.updater.set_hosts({
+            "a": (["10.0.0.1"], []),
+            "b": (["10.0.0.2"], ["fd00::2"]),
+            "c": (["10.0.0.3"], []),
+        })
+        self.assertEqual(zone.get("a", "A"), {"10.0.0.1"})
+        self.assertEqual(zone.get("_container_test", "TXT"), {"a", "b", "c"})
+        
+        # manual zone edits
+        zone.set("a", "A", ["10.0.0.100"])
+        zone.set("b", "AAAA", [])
+        zone.set("*.c", "A", ["10.0.0.3", "10.0.0.4"])
+        zone.set("_container_test", "TXT", ["a", "b", "c", "stale"])
+        zone.set("stale", "A", ["10.0.0.5"])
+        zone.set("unmanaged", "A", ["10.0.0.6"])
+        
+        updates = zone.updates
+        self.updater.reconcile()
+        self.assertEqual(zone.updates, updates + 1, "single corrective update is sent")
+        
+        self.assertEqual(zone.get("a", "A"), {"10.0.0.1"})
+        self.assertEqual(zone.get("*.a", "A"), {"10.0.0.1"})
+        self.assertEqual(zone.get("b", "AAAA"), {"fd00::2"})
+        self.assertEqual(zone.get("*.c", "A"), {"10.0.0.3"})
+        self.assertEqual(zone.get("stale", "A"), set())
+        self.assertEqual(zone.get("unmanaged", "A"), {"10.0.0.6"}, "records of other hosts are kept")
+        self.assertEqual(zone.get("_container_test", "TXT"), {"a", "b", "c"})
+        self.assertEqual(self.updater.hosts, {"a", "b", "c"})
+        
+        with unittest.mock.patch.object(NamedUpdater, "_transfer", autospec=True, side_effect=NamedUpdater._transfer) as transfer:
+            self.updater.reconcile()
+            self.assertEqual(transfer.call_count, 1, "zone changed by corrections is checked again")
+            self.assertEqual(zone.updates, updates + 1)
+            
+            self.updater.reconcile()
+            self.assertEqual(transfer.call_count, 1, "zone with unchanged serial is not transferred")
+    
+    def test_no_drift(self):
+        self.updater.set_hosts({"a": (["10.0.0.1"], [])})
+        
+        updates = self.server.zone.updates
+        self.updater.reconcile()
+        self.assertEqual(self.server.zone.updates, updates, "nothing is sent when zone is in sync")
+
+class ReconcilerTest(unittest.TestCase):
+    
+    def test_jitter(self):
+        r = Reconciler(None, 100, 0.1)
+        for _i in range(100):
+            self.assertTrue(90 <= r.get_delay() <= 110)
+    
+    def test_schedule(self):
+        updater = unittest.mock.Mock()
+        updater.reconcile.side_effect = [Exception("transfer refused"), None]
+        r = Reconciler(updater, 10, 0)
+        
+        with unittest.mock.patch.object(r, "_stop") as stop:
+            stop.wait.side_effect = [False, False, True]
+            r._run()
+            
+            stop.wait.assert_called_with(10)
+        
+        self.assertEqual(updater.reconcile.call_count, 2, "errors do not stop reconciler")
@@ -0,0 +1,82 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import os
+import json
+import tempfile
+import unittest.mock
+from docker_hostdns.hostdns import DockerHandler
+from docker_hostdns.recording import Recorder, ReplayHandler
+from docker_hostdns.fakes.dockerserver import DockerServer
+
+class RecordingTest(unittest.TestCase):
+    
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "events.jsonl")
+        self.socket_path = os.path.join(tmp_dir.name, "docker.sock")
+    
+    def record(self):
+        server = DockerServer(self.socket_path)
+        server.start()
+        self.addCleanup(server.stop)
+        
+        server.add_container("id1", "web", {"bridge": ("10.0.0.1", None)})
+        server.add_event("connect", "id1", "bridge", 1000000001)
+        server.add_event("connect", "id2", "other", 2000000001)
+        server.add_event("disconnect", "id1", "bridge", 3000000001)
+        
+        updater = unittest.mock.Mock()
+        d = DockerHandler(updater, endpoint="unix://%s" % self.socket_path)
+        d.reconnect_max_delay = 0
+        d.recorder = Recorder(self.path)
+        d.recorder.open()
+        
+        d.setup()
+        d.run()
+        d.recorder.close()
+        
+        return updater
+    
+    def test_record(self):
+        self.record()
+        
+        with open(self.path, "rt") as f:
+            records = [json.loads(line) for line in f]
+        
+        self.assertEqual([i.get("event", {}).get("Action", i.get("inspect")) for i in records], ["connect", "id1", "connect", "disconnect"])
+        self.assertEqual(records[1]["attrs"]["Name"], "/web", "inspect data is recorded after its event")
+    
+    def test_replay(self):
+        recorded = self.record()
+        
+        with open(self.path, "at") as f:
+            f.write('{"time":1,"event":{"Type":"netw')
+        
+        updater = unittest.mock.Mock()
+        d = ReplayHandler(updater, self.path, speed=0)
+        d.setup()
+        results = d.run()
+        
+        updater.set_hosts.assert_called_once_with({})
+        self.assertEqual(updater.add_host.call_args_list, recorded.add_host.call_args_list)
+        self.assertEqual(updater.remove_host.call_args_list, recorded.remove_host.call_args_list)
+        self.assertEqual(results["events"], 3, "broken record is skipped")
+        self.assertEqual(results["handled"], 2)
+        self.assertEqual(d.last_event_time, 3000000001)
+    
+    def test_replay_speed(self):
+        with open(self.path, "wt") as f:
+            for t in (100, 100.1, 100.2):
+                f.write(json.dumps({"time": t, "event": {"Type": "network", "Action": "connect", "Actor": {"Attributes": {"container": "id1", "name": "bridge"}}}}) + "\n")
+        
+        d = ReplayHandler(unittest.mock.Mock(), self.path, speed=2)
+        d.setup()
+        
+        with unittest.mock.patch("time.sleep") as sleep:
+            results = d.run()
+        
+        self.assertEqual(sleep.call_count, 2, "events are delayed as recorded")
+        self.assertLessEqual(max(i[0][0] for i in sleep.call_args_list), 0.1)
+        self.assertEqual(results["skipped"], 3, "events without recorded inspect data are skipped")
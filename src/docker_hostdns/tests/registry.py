@@ -0,0 +1,63 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import unittest
+from docker_hostdns.registry import HostRegistry
+
+class HostRegistryTest(unittest.TestCase):
+    
+    def test_add_and_remove(self):
+        r = HostRegistry()
+        
+        self.assertEqual(r.add("id-1", {"b", "a"}), ("a", "b"))
+        self.assertIn("id-1", r)
+        self.assertEqual(r.owner("a"), "id-1")
+        
+        self.assertEqual(r.remove("id-1"), ("a", "b"))
+        self.assertNotIn("id-1", r)
+        self.assertIsNone(r.owner("a"))
+        self.assertIsNone(r.remove("id-1"), "unknown container")
+    
+    def test_duplicated_names(self):
+        r = HostRegistry()
+        
+        r.add("id-1", ["a"])
+        self.assertEqual(r.add("id-2", ["a", "b"]), ("a-1", "b"))
+        self.assertEqual(r.add("id-3", ["a"]), ("a-2",))
+        self.assertEqual(r.owner("a-2"), "id-3")
+        
+        r.remove("id-2")
+        self.assertEqual(r.add("id-4", ["a"]), ("a-1",), "freed suffix is used again")
+        self.assertEqual(r.add("id-5", ["a"]), ("a-3",))
+        
+        r.remove("id-4")
+        r.remove("id-3")
+        r.remove("id-5")
+        self.assertEqual(r.add("id-6", ["a"]), ("a-1",))
+    
+    def test_suffix_collision(self):
+        r = HostRegistry()
+        
+        r.add("id-1", ["a"])
+        r.add("id-2", ["a-1"])
+        self.assertEqual(r.add("id-3", ["a"]), ("a-2",), "name taken by other container is skipped")
+    
+    def test_readd(self):
+        r = HostRegistry()
+        
+        r.add("id-1", ["a"])
+        self.assertEqual(r.add("id-1", ["a"]), ("a",), "container does not collide with itself")
+        self.assertEqual(len(r), 1)
+    
+    def test_primary_names(self):
+        r = HostRegistry()
+        
+        r.add("id-1", ["a", "a-alias"], "a")
+        r.add("id-2", ["a", "b"], "a")
+        self.assertEqual(r.primary_names, {"a", "a-1"}, "main name is deduplicated")
+        
+        r.add("id-1", ["c", "a-alias"], "c")
+        self.assertEqual(r.primary_names, {"c", "a-1"})
+        
+        r.remove("id-2")
+        self.assertEqual(r.primary_names, {"c"})
@@ -0,0 +1,77 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import unittest
+import dns.flags
+import dns.query
+import dns.rcode
+import dns.message
+import dns.rdatatype
+from docker_hostdns.server import ZoneServer
+
+class ZoneServerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = ZoneServer("docker", port=0)
+        self.server.start()
+        self.addCleanup(self.server.close)
+    
+    def query(self, name, rdtype="A", tcp=False, **kwargs):
+        q = dns.message.make_query(name, rdtype, **kwargs)
+        query = dns.query.tcp if tcp else dns.query.udp
+        return query(q, "127.0.0.1", port=self.server.port, timeout=2)
+    
+    def get_answer(self, r):
+        return sorted(rd.to_text() for rrset in r.answer for rd in rrset)
+    
+    def test_query(self):
+        self.server.set_hosts({
+            "web": (["10.0.0.1", "10.0.0.2"], ["fe80::1"]),
+            "Db": (["10.0.0.3"], []),
+        })
+        
+        r = self.query("web.docker.")
+        self.assertEqual(r.rcode(), dns.rcode.NOERROR)
+        self.assertTrue(r.flags & dns.flags.AA)
+        self.assertEqual(self.get_answer(r), ["10.0.0.1", "10.0.0.2"])
+        
+        self.assertEqual(self.get_answer(self.query("web.docker.", "AAAA", tcp=True)), ["fe80::1"])
+        self.assertEqual(self.get_answer(self.query("a.b.web.docker.")), ["10.0.0.1", "10.0.0.2"], "wildcard below host")
+        self.assertEqual(self.get_answer(self.query("db.docker.")), ["10.0.0.3"], "names are case insensitive")
+        
+        r = self.query("db.docker.", "AAAA")
+        self.assertEqual((r.rcode(), r.answer), (dns.rcode.NOERROR, []), "no data")
+        self.assertEqual(r.authority[0].rdtype, dns.rdatatype.SOA)
+        
+        self.assertEqual(self.query("other.docker.").rcode(), dns.rcode.NXDOMAIN)
+        self.assertEqual(self.query("web.example.").rcode(), dns.rcode.REFUSED)
+        
+        r = self.query("docker.", "SOA", use_edns=0)
+        self.assertEqual(r.answer[0][0].serial, self.server.serial)
+    
+    def test_cache(self):
+        self.server.add_host(["web", "id1"], ["10.0.0.1"], [])
+        
+        first = self.query("WeB.docker.")
+        second = self.query("WeB.docker.")
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(str(second.question[0].name), "WeB.docker.", "case of question is kept")
+        self.assertEqual(len(self.server._cache), 1, "response is cached")
+        
+        self.query("id1.docker.")
+        self.server.add_host("web", ["10.0.0.2"], [])
+        
+        self.assertEqual(len(self.server._cache), 1, "only responses for changed host are dropped")
+        self.assertEqual(self.get_answer(self.query("web.docker.")), ["10.0.0.2"])
+        
+        self.server.remove_host(["web"])
+        self.assertEqual(self.query("web.docker.").rcode(), dns.rcode.NXDOMAIN)
+        self.assertEqual(self.server.hosts, {"id1"})
+    
+    def test_truncation(self):
+        self.server.add_host("web", ["10.0.%d.%d" % (i // 256, i % 256) for i in range(100)], [])
+        
+        r = self.query("web.docker.")
+        self.assertTrue(r.flags & dns.flags.TC)
+        self.assertEqual(len(self.query("web.docker.", use_edns=0, payload=4096).answer[0]), 100)
+        self.assertEqual(len(self.query("web.docker.", tcp=True).answer[0]), 100)
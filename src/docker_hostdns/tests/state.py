@@ -0,0 +1,72 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import unittest
+import tempfile
+import shutil
+import os
+from docker_hostdns.state import StateFile
+
+class StateFileTest(unittest.TestCase):
+    
+    state = {
+        "last_event_time": 1000000001,
+        "containers": {
+            "id-1": [["a", "a-alias"], ["ipv4"], []],
+            "id-2": [["b"], [], ["ipv6"]],
+        }
+    }
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "state.json")
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    
+    def test_save_and_load(self):
+        f = StateFile(self.path, identity={"zone": "docker"})
+        self.assertIsNone(f.load(), "no state before first save")
+        
+        f.save(self.state)
+        state = f.load()
+        
+        self.assertEqual(state["containers"], self.state["containers"])
+        self.assertEqual(state["last_event_time"], self.state["last_event_time"])
+        self.assertEqual(os.listdir(self.dir), ["state.json"], "no temporary files are left")
+        
+        self.assertEqual(StateFile.get_hosts(state), {
+            "a": (["ipv4"], []),
+            "a-alias": (["ipv4"], []),
+            "b": ([], ["ipv6"]),
+        })
+        
+        f.remove()
+        self.assertIsNone(f.load())
+    
+    def test_identity(self):
+        StateFile(self.path, identity={"zone": "docker"}).save(self.state)
+        self.assertIsNone(StateFile(self.path, identity={"zone": "other"}).load(), "state from other configuration is ignored")
+    
+    def test_broken_file(self):
+        with open(self.path, "wt") as f:
+            f.write("{not json")
+        
+        self.assertIsNone(StateFile(self.path).load())
+    
+    def test_interval(self):
+        f = StateFile(self.path, interval=0)
+        self.assertTrue(f.is_due())
+        
+        f = StateFile(self.path, interval=60)
+        self.assertFalse(f.is_due())
+    
+    def test_not_synced(self):
+        synced = [True]
+        f = StateFile(self.path, identity={"zone": "docker"}, is_synced=lambda: synced[0])
+        self.assertTrue(f.save(self.state))
+        
+        synced[0] = False
+        self.assertFalse(f.save(dict(self.state, containers={})), "state with unwritten hosts is not saved")
+        self.assertFalse(f.is_due())
+        self.assertEqual(f.load()["containers"], self.state["containers"], "last synced state is kept")
@@ -0,0 +1,129 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import os
+import sys
+import json
+import pstats
+import tempfile
+import unittest
+import threading
+import tracemalloc
+from docker_hostdns import tracing
+from docker_hostdns.hostdns import ContainerInfo
+
+class TracerTest(unittest.TestCase):
+    
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "trace.json")
+    
+    def test_disabled(self):
+        tracer = tracing.Tracer()
+        self.assertFalse(tracer.enabled)
+        self.assertEqual(tracer.files, [])
+        
+        with tracer.span("noop"):
+            pass
+    
+    def test_spans(self):
+        tracer = tracing.Tracer()
+        tracer.open(self.path)
+        
+        with tracer.span("outer", zone="docker"):
+            with tracer.span("inner"):
+                pass
+        
+        thread = threading.Thread(target=lambda: tracer.span("threaded").__enter__().__exit__(None, None, None), name="worker")
+        thread.start()
+        thread.join()
+        
+        tracer.close()
+        
+        with open(self.path, "rt") as f:
+            events = json.load(f)
+        
+        spans = dict((i["name"], i) for i in events if i["ph"] == "X")
+        self.assertEqual(sorted(spans.keys()), ["inner", "outer", "threaded"])
+        self.assertEqual(spans["outer"]["args"], {"zone": "docker"})
+        self.assertNotIn("args", spans["inner"])
+        self.assertLessEqual(spans["outer"]["ts"], spans["inner"]["ts"])
+        self.assertGreaterEqual(spans["outer"]["ts"] + spans["outer"]["dur"], spans["inner"]["ts"] + spans["inner"]["dur"])
+        
+        threads = dict((i["tid"], i["args"]["name"]) for i in events if i["ph"] == "M")
+        self.assertEqual(threads[spans["threaded"]["tid"]], "worker")
+        self.assertEqual(len(threads), 2)
+    
+    def test_global_tracer(self):
+        tracing.TRACER.open(self.path)
+        try:
+            ContainerInfo.from_attrs("a" * 64, "/web", {}, {}, ["bridge"])
+        finally:
+            tracing.TRACER.close()
+        
+        with open(self.path, "rt") as f:
+            events = json.load(f)
+        
+        self.assertEqual([i["name"] for i in events if i["ph"] == "X"], ["container_info"])
+
+def _work_in_thread():
+    return sorted(range(1000))
+
+class ProfilerTest(unittest.TestCase):
+    
+    def test_toggle(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profiler = tracing.Profiler(tmp_dir)
+            
+            profiler.toggle()
+            self.assertTrue(profiler.running)
+            self.assertTrue(tracemalloc.is_tracing())
+            
+            sorted(range(1000))
+            
+            profile_path, snapshot_path = profiler.stop()
+            self.assertFalse(profiler.running)
+            self.assertFalse(tracemalloc.is_tracing())
+            
+            self.assertTrue(pstats.Stats(profile_path).total_calls)
+            tracemalloc.Snapshot.load(snapshot_path)
+    
+    def test_threads(self):
+        profiler = tracing.Profiler()
+        attached = threading.Event()
+        stopped = threading.Event()
+        hooks = []
+        
+        def worker():
+            profiler.attach()
+            _work_in_thread()
+            attached.set()
+            stopped.wait()
+            profiler.attach()
+            hooks.append(sys.getprofile())
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profiler.directory = tmp_dir
+            profiler.start()
+            
+            thread = threading.Thread(target=worker)
+            thread.start()
+            attached.wait()
+            
+            profile_path, _snapshot_path = profiler.stop()
+            stopped.set()
+            thread.join()
+            
+            functions = [i[2] for i in pstats.Stats(profile_path).stats.keys()]
+            self.assertIn("_work_in_thread", functions, "worker thread is profiled")
+            self.assertEqual(hooks, [None], "worker thread stops profiling on next attach")
+    
+    def test_toggle_errors(self):
+        profiler = tracing.Profiler("/nonexistent/directory")
+        
+        profiler.toggle()
+        with self.assertLogs("Profiler", "ERROR"):
+            profiler.toggle()
+        
+        self.assertFalse(profiler.running, "profiling is stopped even when stats could not be written")
@@ -0,0 +1,115 @@
+'''
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+import unittest.mock
+from docker_hostdns.zones import ZonedDockerHandler, get_network_zones
+
+def _container(id_, name, networks):
+    attrs = {
+        "Id": id_,
+        "Name": "/%s" % name,
+        "Config": {"Labels": {}},
+        "NetworkSettings": {"Networks": dict(
+            (network, {"IPAddress": address, "GlobalIPv6Address": "", "Aliases": None}) for network, address in networks.items()
+        )},
+    }
+    return unittest.mock.Mock(attrs=attrs)
+
+class GetNetworkZonesTest(unittest.TestCase):
+    
+    def test_mapping(self):
+        self.assertEqual(get_network_zones(None, "docker"), {"docker": ["bridge"]})
+        self.assertEqual(
+            get_network_zones(["bridge", "frontend=fe.docker", "backend=be.docker", "admin=fe.docker"], "docker"),
+            {"docker": ["bridge"], "fe.docker": ["frontend", "admin"], "be.docker": ["backend"]}
+        )
+        self.assertEqual(get_network_zones(["frontend=fe.docker", "frontend=fe.docker"], "docker"), {"fe.docker": ["frontend"]})
+    
+    def test_invalid(self):
+        self.assertRaises(ValueError, get_network_zones, ["frontend=fe.docker", "frontend=be.docker"], "docker")
+        self.assertRaises(ValueError, get_network_zones, ["=fe.docker"], "docker")
+
+class ZonedDockerHandlerTest(unittest.TestCase):
+    
+    endpoint = "unix:///run/docker.sock"
+    
+    def setUp(self):
+        self.client = unittest.mock.MagicMock()
+        p_client = unittest.mock.patch("docker.DockerClient", return_value=self.client)
+        p_client.start()
+        self.addCleanup(p_client.stop)
+        
+        self.fe = unittest.mock.MagicMock()
+        self.be = unittest.mock.MagicMock()
+        self.d = ZonedDockerHandler({
+            "fe.docker": (self.fe, ["frontend"]),
+            "be.docker": (self.be, ["backend", "db"]),
+        }, endpoint=self.endpoint)
+    
+    def test_setup(self):
+        self.client.containers.list.return_value = [
+            _container("a" * 64, "web", {"frontend": "10.0.0.2", "backend": "10.1.0.2"}),
+            _container("b" * 64, "api", {"backend": "10.1.0.3"}),
+            _container("c" * 64, "other", {"bridge": "172.17.0.2"}),
+        ]
+        
+        self.d.setup()
+        
+        self.client.containers.list.assert_called_once()
+        self.fe.set_hosts.assert_called_once_with({"web": (["10.0.0.2"], []), "a" * 12: (["10.0.0.2"], [])})
+        self.be.set_hosts.assert_called_once_with({
+            "web": (["10.1.0.2"], []), "a" * 12: (["10.1.0.2"], []),
+            "api": (["10.1.0.3"], []), "b" * 12: (["10.1.0.3"], []),
+        })
+        
+        state = self.d.get_state()
+        self.assertEqual(sorted(state["containers"].keys()), ["be.docker/" + "a" * 64, "be.docker/" + "b" * 64, "fe.docker/" + "a" * 64])
+        self.assertEqual(ZonedDockerHandler.get_zone_state(state, "fe.docker")["containers"], {"a" * 64: [("a" * 12, "web"), ["10.0.0.2"], [], "web"]})
+    
+    def test_events(self):
+        self.client.containers.list.return_value = []
+        self.d.setup()
+        
+        filters, _since = self.d._get_events_filter()
+        self.assertEqual(sorted(filters["network"]), ["backend", "db", "frontend"], "single event stream covers all zones")
+        
+        self.client.containers.get.return_value = _container("a" * 64, "web", {"frontend": "10.0.0.2", "backend": "10.1.0.2"})
+        
+        def event(action, network):
+            return {"Type": "network", "Action": action, "Actor": {"Attributes": {"container": "a" * 64, "name": network}}}
+        
+        self.d.handle_event(event("connect", "db"))
+        self.d.handle_event(event("connect", "frontend"))
+        self.d.handle_event(event("disconnect", "frontend"))
+        self.d.handle_event(event("connect", "bridge"))
+        
+        self.be.add_host.assert_called_once_with(("a" * 12, "web"), ["10.1.0.2"], [])
+        self.fe.add_host.assert_called_once_with(("a" * 12, "web"), ["10.0.0.2"], [])
+        self.fe.remove_host.assert_called_once_with(("a" * 12, "web"))
+        self.be.remove_host.assert_not_called()
+        
+        self.assertEqual(self.d.events_received, 4)
+        self.assertEqual(self.d.events_handled, 3)
+    
+    def test_resume(self):
+        self.client.api.containers.return_value = [
+            {"Id": "a" * 64, "Names": ["/web"], "Labels": {}, "NetworkSettings": {"Networks": {
+                "frontend": {"IPAddress": "10.0.0.2", "GlobalIPv6Address": ""},
+                "backend": {"IPAddress": "10.1.0.2", "GlobalIPv6Address": ""},
+            }}},
+        ]
+        
+        self.d.setup(state={
+            "last_event_time": 1000000001,
+            "containers": {
+                "fe.docker/" + "a" * 64: [["web"], ["10.0.0.2"], []],
+                "be.docker/" + "a" * 64: [["web"], ["10.1.0.2"], []],
+                "be.docker/" + "b" * 64: [["api"], ["10.1.0.3"], []],
+            }
+        })
+        
+        self.client.api.containers.assert_called_once()
+        self.client.containers.get.assert_not_called()
+        self.fe.remove_host.assert_not_called()
+        self.be.remove_host.assert_called_once_with(("api",))
+        self.assertEqual(self.d.last_event_time, 1000000001)
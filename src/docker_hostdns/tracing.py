@@ -0,0 +1,251 @@
+'''
+Opt-in instrumentation: timing spans written in Chrome trace format and signal triggered profiling.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+import os
+import json
+import time
+import pstats
+import signal
+import cProfile
+import logging
+import threading
+import tracemalloc
+
+class _NullSpan(object):
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        pass
+
+class _Span(object):
+    __slots__ = ("tracer", "name", "args", "started")
+    
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.started = None
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.tracer.write(self.name, self.started, time.perf_counter() - self.started, self.args)
+
+class Tracer(object):
+    """
+    Writes duration of spans as complete events of Chrome trace JSON array format, viewable in chrome://tracing or Perfetto.
+    Closing bracket of the array is optional in this format, so file is usable while it is still being written.
+    Spans are no-ops until file is opened.
+    """
+    
+    # seconds between flushing written events to disk
+    flush_interval = 1
+    
+    _null_span = _NullSpan()
+    
+    def __init__(self):
+        super(Tracer, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._threads = set()
+        self._first = True
+        self._last_flush = None
+    
+    @property
+    def enabled(self):
+        return self._file is not None
+    
+    @property
+    def files(self):
+        """
+        Returns list of open files, to be kept open when daemonizing.
+        """
+        return [] if self._file is None else [self._file]
+    
+    def open(self, path):
+        with self._lock:
+            self.path = path
+            self._file = open(path, "wt")
+            self._file.write("[\n")
+            self._threads = set()
+            self._first = True
+            self._last_flush = time.monotonic()
+        
+        self.logger.info("Writing trace to %r", path)
+    
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write("\n]\n")
+            self._file.close()
+            self._file = None
+    
+    def span(self, name, **args):
+        """
+        Returns context manager measuring given block, args are shown with the span in trace viewer.
+        """
+        if self._file is None:
+            return self._null_span
+        return _Span(self, name, args)
+    
+    def _dump(self, event):
+        if not self._first:
+            self._file.write(",\n")
+        self._first = False
+        self._file.write(json.dumps(event, separators=(",", ":")))
+    
+    def write(self, name, started, duration, args=None):
+        """
+        Writes complete event, times are given in seconds of perf_counter clock.
+        """
+        pid = os.getpid()
+        thread = threading.current_thread()
+        
+        with self._lock:
+            if self._file is None:
+                return
+            
+            if thread.ident not in self._threads:
+                self._threads.add(thread.ident)
+                self._dump({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread.ident, "args": {"name": thread.name}})
+            
+            event = {"name": name, "ph": "X", "ts": started * 1000000, "dur": duration * 1000000, "pid": pid, "tid": thread.ident}
+            if args:
+                event["args"] = args
+            self._dump(event)
+            
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+TRACER = Tracer()
+
+def span(name, **args):
+    """
+    Returns span of global tracer.
+    """
+    return TRACER.span(name, **args)
+
+class _Snapshot(object):
+    """
+    Stats source for pstats, which reads profile without disabling it, as it can still be enabled in other thread.
+    """
+    
+    def __init__(self, profile):
+        super(_Snapshot, self).__init__()
+        self.profile = profile
+        self.stats = None
+    
+    def create_stats(self):
+        self.profile.snapshot_stats()
+        self.stats = self.profile.stats
+
+class Profiler(object):
+    """
+    Toggles cProfile and tracemalloc on signal: first signal starts them, next one writes cProfile stats
+    and tracemalloc snapshot to given directory, so live process can be profiled without restarting.
+    cProfile measures only thread calling it, so it is started in thread receiving signals
+    and worker threads join by calling ``attach`` from their loops. Stats of all threads are written to single file.
+    """
+    
+    tracemalloc_frames = 5
+    
+    def __init__(self, directory=None):
+        super(Profiler, self).__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        
+        self.directory = directory
+        self._running = False
+        # incremented on each start, so threads can tell their profile is from previous run
+        self._generation = 0
+        self._profiles = []
+        # reentrant, as signal handler can interrupt attaching in same thread
+        self._lock = threading.RLock()
+        self._local = threading.local()
+    
+    @property
+    def running(self):
+        return self._running
+    
+    def install(self, signum=signal.SIGUSR2):
+        signal.signal(signum, lambda *args: self.toggle())
+    
+    def attach(self):
+        """
+        Starts profiling of calling thread while profiler is running and stops it afterwards, cheap when nothing changed.
+        """
+        current = getattr(self._local, "profile", None)
+        
+        if current is not None and (not self._running or current[0] != self._generation):
+            current[1].disable()
+            self._local.profile = current = None
+        
+        if current is None and self._running:
+            profile = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(profile)
+            self._local.profile = (self._generation, profile)
+            profile.enable()
+    
+    def start(self):
+        tracemalloc.start(self.tracemalloc_frames)
+        with self._lock:
+            self._generation += 1
+            self._profiles = []
+            self._running = True
+        self.attach()
+        self.logger.info("Profiling started")
+    
+    def stop(self):
+        """
+        Stops profiling and returns paths of written cProfile stats and tracemalloc snapshot.
+        Worker threads stop their profiles on next call of ``attach``.
+        """
+        with self._lock:
+            self._running = False
+            profiles = self._profiles
+            self._profiles = []
+        self.attach()
+        
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        
+        prefix = os.path.join(self.directory, "docker-hostdns-%d-%s" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+        paths = (prefix + ".pstats", prefix + ".tracemalloc")
+        
+        pstats.Stats(*[_Snapshot(i) for i in profiles]).dump_stats(paths[0])
+        snapshot.dump(paths[1])
+        
+        self.logger.info("Profiling of %d threads stopped, stats written to %r and %r", len(profiles), *paths)
+        return paths
+    
+    def toggle(self):
+        # called from signal handler, so errors must not propagate to interrupted code
+        try:
+            if self.running:
+                self.stop()
+            else:
+                self.start()
+        except Exception as e:
+            self.logger.error("Toggling profiler failed: %s", e)
+
+PROFILER = Profiler()
+
+def attach():
+    """
+    Lets global profiler measure calling thread, called from loops of worker threads.
+    """
+    PROFILER.attach()
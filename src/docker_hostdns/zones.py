@@ -0,0 +1,145 @@
+'''
+Publishing containers of different networks to different zones.
+
+@author: Arkadiusz Dzięgiel <arkadiusz.dziegiel@glorpen.pl>
+'''
+
+from docker_hostdns import metrics
+from docker_hostdns import tracing
+from docker_hostdns.hostdns import DockerHandler, NetworkEvent
+
+def get_network_zones(networks, default_zone):
+    """
+    Parses list of "<network>" or "<network>=<zone>" items, returns dict of zone: list of networks.
+    """
+    zones = {}
+    seen = {}
+    
+    for item in networks or ["bridge"]:
+        network, _sep, zone = item.partition("=")
+        network = network.strip()
+        zone = zone.strip() or default_zone
+        
+        if not network:
+            raise ValueError("Network name is missing in %r" % item)
+        if seen.get(network, zone) != zone:
+            raise ValueError("Network %r is mapped to both %r and %r zones" % (network, seen[network], zone))
+        
+        if network not in seen:
+            seen[network] = zone
+            zones.setdefault(zone, []).append(network)
+    
+    return zones
+
+class ZonedDockerHandler(DockerHandler):
+    """
+    Watches networks mapped to different zones with single Docker connection, inventory scan and event stream.
+    Containers of each zone are tracked by own DockerHandler, so names are unique per zone,
+    and each event is routed to updater of zone its network belongs to.
+    Zones is a dict of zone: (dns updater, list of networks).
+    """
+    
+    _recorder = None
+    
+    def __init__(self, zones, inventory="containers", endpoint=None):
+        super(ZonedDockerHandler, self).__init__(None, inventory, endpoint)
+        
+        self.handlers = {}
+        # network name: handler of its zone
+        self._routes = {}
+        
+        for zone, (dns_updater, networks) in zones.items():
+            handler = DockerHandler(dns_updater, inventory, endpoint, lock=self.lock)
+            handler.networks = tuple(networks)
+            self.handlers[zone] = handler
+            for network in networks:
+                self._routes[network] = handler
+        
+        self.networks = tuple(self._routes.keys())
+    
+    @property
+    def recorder(self):
+        return self._recorder
+    
+    @recorder.setter
+    def recorder(self, value):
+        self._recorder = value
+        for handler in self.handlers.values():
+            handler.recorder = value
+    
+    @staticmethod
+    def get_zone_state(state, zone):
+        """
+        Returns part of saved state with containers of given zone, in format of single DockerHandler.
+        """
+        prefix = zone + "/"
+        return {
+            "last_event_time": state["last_event_time"],
+            "containers": dict(
+                (key[len(prefix):], value) for key, value in state["containers"].items() if key.startswith(prefix)
+            ),
+        }
+    
+    def setup(self, networks=None, state=None):
+        """
+        Connects to Docker and publishes hosts of all zones, networks are given per zone on creation so the parameter is ignored.
+        """
+        self._connect()
+        
+        for handler in self.handlers.values():
+            handler.client = self.client
+        
+        if state is None:
+            self.load_containers()
+        else:
+            self.resume(state)
+    
+    def load_containers(self):
+        """
+        Registers containers from single scan in every zone, with addresses only from networks of given zone.
+        """
+        with metrics.LOAD_CONTAINERS.time(), tracing.span("load_containers"):
+            sources = self._scan()
+        with self.lock:
+            for handler in self.handlers.values():
+                handler._register([self._get_info(i, handler.networks) for i in sources])
+    
+    def resume(self, state):
+        summaries = self.client.api.containers(filters={"status":"running"})
+        
+        for zone, handler in self.handlers.items():
+            handler._resume(self.get_zone_state(state, zone), summaries)
+        
+        self.last_event_time = state.get("last_event_time")
+    
+    def get_hosts(self):
+        """
+        Returns dict of zone: dict of hostname: (ipv4s, ipv6s).
+        """
+        with self.lock:
+            return dict((zone, handler.get_hosts()) for zone, handler in self.handlers.items())
+    
+    def get_state(self):
+        containers = {}
+        
+        with self.lock:
+            for zone, handler in self.handlers.items():
+                for container_id, value in handler.get_state()["containers"].items():
+                    containers["%s/%s" % (zone, container_id)] = value
+        
+        return {
+            "last_event_time": self.last_event_time,
+            "containers": containers,
+        }
+    
+    def handle_event(self, event):
+        self.events_received += 1
+        
+        network_event = NetworkEvent.from_dict(event)
+        handler = None if network_event is None else self._routes.get(network_event.network)
+        if handler is None:
+            return
+        
+        handled = handler.events_handled
+        handler.handle_event(event)
+        self.events_handled += handler.events_handled - handled